@@ -21,18 +21,202 @@ import base64
 import json
 import time
 import uuid
+import shutil
+import zipfile
+import io
+import collections
+import threading
+import random
+import resource
+import functools
+import hashlib
+import hmac
+import inspect
+import contextlib
+import queue
+import http.client
+import urllib.request
+import urllib.error
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 APP_VERSION = "7.0.0"
 APP_TITLE = "Kompres"
 APP_TAGLINE = "Kompresi Video Profesional"
 
 SUPPORTED_FORMATS = ["mp4", "mov", "mkv", "avi", "webm"]
-OUTPUT_FORMATS = {"MP4 (H.264)": "mp4", "WebM (VP9)": "webm", "GIF Animasi": "gif"}
+OUTPUT_FORMATS = {
+    "MP4 (H.264)": "mp4",
+    "MP4 (HEVC)": "hevc",
+    "MP4 (AV1)": "av1",
+    "WebM (VP9)": "webm",
+    "GIF Animasi": "gif",
+    "WebP Animasi": "webp",
+    "AVIF Animasi": "avif",
+}
+FORMAT_ENCODERS = {
+    "mp4": "libx264",
+    "hevc": "libx265",
+    "av1": "libsvtav1",
+    "webm": "libvpx-vp9",
+    "gif": "gif",
+    "webp": "libwebp_anim",
+    "avif": "libaom-av1",
+}
+FORMAT_EXTENSIONS = {"hevc": "mp4", "av1": "mp4"}
+MIME_TYPES = {
+    "mp4": "video/mp4", "webm": "video/webm", "gif": "image/gif", "webp": "image/webp", "avif": "image/avif",
+}
+ANIMATED_IMAGE_FORMATS = ["gif", "webp", "avif"]
+IMAGE_QUALITY_DEFAULT = 75
+WEBP_COMPRESSION_LEVELS = {"ultrafast": 0, "fast": 1, "medium": 2, "slow": 4, "veryslow": 6}
+AVIF_SPEEDS = {
+    "ultrafast": ("realtime", 8),
+    "fast": ("good", 6),
+    "medium": ("good", 6),
+    "slow": ("good", 5),
+    "veryslow": ("good", 4),
+}
+AVIF_CRF_RANGE = (10, 55)
+MULTI_OUTPUT_FORMATS = ["mp4", "hevc", "av1", "webm"]
+HEVC_CRF_OFFSET = 4
+SVTAV1_PRESETS = {"ultrafast": 12, "fast": 10, "medium": 8, "slow": 6, "veryslow": 4}
+VP9_SPEEDS = {
+    "ultrafast": ("realtime", 8),
+    "fast": ("good", 5),
+    "medium": ("good", 4),
+    "slow": ("good", 2),
+    "veryslow": ("good", 1),
+}
+VP9_FIRST_PASS_CPU_USED = 4
+SCALER_FLAGS = {"ultrafast": "bilinear", "fast": "bilinear", "medium": "bicubic", "slow": "lanczos", "veryslow": "lanczos"}
+GIF_DEFAULT_FPS = 15
+# Tangga pengaturan GIF dari kualitas tertinggi: (fps, lebar maks, dithering, palet)
+GIF_SIZE_LADDER = [
+    (15, 480, "sierra2_4a", "frame"),
+    (15, 480, "sierra2_4a", "global"),
+    (15, 480, "bayer", "global"),
+    (12, 480, "bayer", "global"),
+    (12, 360, "bayer", "global"),
+    (10, 360, "bayer", "global"),
+    (10, 320, "bayer", "global"),
+    (8, 320, "bayer", "global"),
+    (8, 240, "bayer", "global"),
+    (6, 240, "none", "global"),
+]
+GIF_SAMPLE_COUNT = 3
+GIF_SAMPLE_SECONDS = 2
+GIF_SIZE_SAFETY = 0.9
+VP9_MIN_TILE_WIDTH = 256
+VP9_MAX_TILE_COLUMNS = 6
 FFMPEG_THREADS = 0
 SESSION_DIR = "/tmp/kompres_sessions"
 SESSION_MAX_AGE = 3600
+STORAGE_BACKEND = os.environ.get("KOMPRES_STORAGE", "local")
+S3_BUCKET = os.environ.get("KOMPRES_S3_BUCKET", "")
+S3_PREFIX = os.environ.get("KOMPRES_S3_PREFIX", "sessions")
+S3_ENDPOINT = os.environ.get("KOMPRES_S3_ENDPOINT", "")
+S3_PART_SIZE = 8 * 1024 * 1024
+S3_READ_CHUNK = 8 * 1024 * 1024
+UPLOAD_URL = os.environ.get("KOMPRES_UPLOAD_URL", "").rstrip("/")
+UPLOAD_DIR = "/tmp/kompres_uploads"
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_COPY_CHUNK = 1024 * 1024
+UPLOAD_MAX_SIZE = 4 * 1024 * 1024 * 1024
+UPLOAD_MAX_AGE = 24 * 3600
+STATS_DIR = "/tmp/kompres_stats"
+SIZE_SAMPLES_PATH = os.path.join(STATS_DIR, "size_samples.jsonl")
+SIZE_MODEL_PATH = os.path.join(STATS_DIR, "size_model.json")
+SIZE_MODEL_MIN_SAMPLES = 30
+SIZE_MODEL_MAX_SAMPLES = 5000
+SIZE_MODEL_REFIT_INTERVAL = 600
+SIZE_MODEL_FORMATS = ["mp4", "webm", "hevc", "av1"]
+BACKGROUND_WORKERS = 2
+ENCODE_SLOTS = int(os.environ.get("KOMPRES_ENCODE_SLOTS", "2"))
+SCHEDULER_MAX_JOBS_PER_TOKEN = 1
+SCHEDULER_POLL_INTERVAL = 0.5
+PRESET_COSTS = {"ultrafast": 0.3, "fast": 0.6, "medium": 1.0, "slow": 2.0, "veryslow": 4.0}
+TRACE_PATH = os.environ.get("KOMPRES_TRACE_PATH", "")
+try:
+    TRACE_SAMPLE_RATE = float(os.environ.get("KOMPRES_TRACE_SAMPLE_RATE", "1.0"))
+except ValueError:
+    TRACE_SAMPLE_RATE = 1.0
+# Nilai di luar 0-1 dipotong, NaN dianggap default
+TRACE_SAMPLE_RATE = min(max(TRACE_SAMPLE_RATE, 0.0), 1.0) if not math.isnan(TRACE_SAMPLE_RATE) else 1.0
+TRACE_ARG_MAX_LENGTH = 200
+QUALITY_WIDTH = 320
+QUALITY_BLOCK = 16
+QUALITY_MAX_SAMPLES = 120
+CROPDETECT_SAMPLES = 5
+CROPDETECT_FRAMES = 6
+CROPDETECT_MIN_SAVING = 0.02
+CROPDETECT_TOLERANCE = 4
+DECIMATE_SAMPLES = 4
+DECIMATE_SAMPLE_SECONDS = 3
+DECIMATE_MIN_RATIO = 0.5
+DECIMATE_MAX_GAP = 1
+DECIMATE_DEFAULT_FPS = 30
+DENOISE_SAMPLES = 5
+DENOISE_ANALYSIS_WIDTH = 1280
+DENOISE_SAMPLE_COUNT = 2
+DENOISE_SAMPLE_SECONDS = 2
+DENOISE_MIN_SAVING = 0.05
+# (batas atas sigma noise luma, kekuatan denoise); di bawah batas pertama sumber dianggap bersih
+DENOISE_LEVELS = [(2.0, None), (4.0, "ringan"), (7.0, "sedang"), (float("inf"), "kuat")]
+# hqdn3d: luma_spatial, chroma_spatial, luma_tmp, chroma_tmp
+DENOISE_HQDN3D = {"ringan": (4, 3, 6, 4.5), "sedang": (6, 4.5, 9, 6.75), "kuat": (8, 6, 12, 9)}
+# nlmeans jauh lebih lambat, hanya untuk preset encoder yang memang lambat
+DENOISE_NLMEANS = {"ringan": 2.0, "sedang": 4.0, "kuat": 6.0}
+DENOISE_NLMEANS_PRESETS = ["slow", "veryslow"]
+WORKER_NODES = [url.strip().rstrip("/") for url in os.environ.get("KOMPRES_WORKERS", "").split(",") if url.strip()]
+WORKER_SEGMENT_SECONDS = 30
+WORKER_MIN_DURATION = 90
+WORKER_HEARTBEAT_INTERVAL = 2
+WORKER_MAX_MISSED = 3
+WORKER_REQUEST_TIMEOUT = 3600
+SHARED_SECRET = os.environ.get("KOMPRES_SECRET", "")
+WORKER_SECRET_HEADER = "X-Kompres-Secret"
+UPLOAD_SIGNATURE_HEADER = "X-Kompres-Signature"
+LOOPBACK_HOSTS = ["127.0.0.1", "localhost", "::1"]
+WORKER_BITRATE_PATTERN = re.compile(r"^\d+(\.\d+)?[kM]?$")
+WORKER_JOB_KEYS = [
+    "crf", "preset", "resolution", "trim_start", "trim_end", "target_fps", "aspect_ratio",
+    "max_bitrate", "out_format", "crop_rect", "decimate", "out_width", "two_pass", "source_size", "denoise",
+    "source_fps",
+]
+FILMSTRIP_FRAMES = 12
+FILMSTRIP_THUMB_WIDTH = 160
+PACKET_INDEX_SUFFIX = "_index.npz"
+KEYFRAME_SEEK_EPSILON = 0.001
+FRAGMENTED_MOVFLAGS = "+frag_keyframe+empty_moov+default_base_moof"
+HLS_SEGMENT_SECONDS = 4
+PREVIEW_INTERVAL = 10
+PREVIEW_MAX_BYTES = 32 * 1024 * 1024
+SIZE_PROJECTION_MIN_PROGRESS = 0.2
+SIZE_PROJECTION_MARGIN = 1.1
+SIZE_RETUNE_MAX_ATTEMPTS = 2
+SIZE_RETUNE_SAFETY = 0.9
+SPECULATION_ENABLED = os.environ.get("KOMPRES_SPECULATE", "0") == "1"
+SPECULATION_WORKERS = 2
+SPECULATION_DELAY = 2
+SPECULATION_NICENESS = 10
+SPECULATION_UNKNOWN_DURATION = 3600
+CHECKPOINT_SEGMENT_SECONDS = int(os.environ.get("KOMPRES_CHECKPOINT_SECONDS", "60"))
+CHECKPOINT_MIN_COST = 600
+CHECKPOINT_MAX_AGE = 24 * 3600
+CHECKPOINT_PREFIX = "ckpt_"
+AUDIO_BITRATE_KBPS = 96
+AUDIO_MAX_CHANNELS = 2
+AUDIO_COPY_CODECS = {"mp4": ["AAC"], "hevc": ["AAC"], "av1": ["AAC"], "webm": ["OPUS"]}
+SCENE_THRESHOLD = 0.3
+SCENE_MIN_SECONDS = 1.0
+SCENE_ANALYSIS_WIDTH = 160
+# (batas rata-rata skor perubahan frame, pengali bitrate x264 zone)
+SCENE_COMPLEXITY_LEVELS = [(0.01, 0.75), (0.04, 1.0), (float("inf"), 1.3)]
 
 _temp_files = []
+_trace_state = threading.local()
+_trace_lock = threading.Lock()
 
 RESOLUTION_MAP = {
     "1080p": 1080,
@@ -75,6 +259,7 @@ PLATFORM_PRESETS = {
         "max_bitrate": "2M",
         "fps": 30,
         "aspect": None,
+        "max_size_mb": 16,
         "description": "Optimal untuk pengiriman via WhatsApp.",
     },
     "Instagram Feed": {
@@ -102,6 +287,7 @@ PLATFORM_PRESETS = {
         "max_bitrate": None,
         "fps": None,
         "aspect": None,
+        "suggest_format": "hevc",
         "description": "Kualitas dan ukuran seimbang untuk Telegram.",
     },
     "Email": {
@@ -111,6 +297,8 @@ PLATFORM_PRESETS = {
         "max_bitrate": "1M",
         "fps": 24,
         "aspect": None,
+        "suggest_format": "hevc",
+        "max_size_mb": 25,
         "description": "Ukuran file minimal untuk lampiran email.",
     },
 }
@@ -339,33 +527,210 @@ def calculate_reduction(original, compressed):
     return ((original - compressed) / original) * 100
 
 
-def get_clean_filename(uploaded_name, out_format="mp4"):
+def get_clean_filename(uploaded_name, out_format="mp4", suffix=""):
     p = pathlib.Path(uploaded_name)
-    return "kompres_" + p.stem + "." + out_format
+    return "kompres_" + p.stem + suffix + "." + out_format
 
 
-def estimate_output_size(duration, crf, resolution, has_audio, out_format="mp4"):
-    """Estimasi kasar ukuran output berdasarkan parameter."""
-    res_bitrate = {"1080p": 4000, "720p": 2000, "480p": 1000, "360p": 600}
-    base_kbps = res_bitrate.get(resolution, 2500)
-    crf_factor = 2.0 ** ((28 - crf) / 6.0)
-    video_kbps = base_kbps * crf_factor
-    if out_format == "gif":
-        video_kbps = video_kbps * 3
-    elif out_format == "webm":
-        video_kbps = video_kbps * 0.85
-    audio_kbps = 96 if has_audio and out_format != "gif" else 0
+def get_output_extension(out_format):
+    return FORMAT_EXTENSIONS.get(out_format, out_format)
+
+
+@st.cache_resource(show_spinner=False)
+def get_available_encoders():
+    """Daftar encoder yang tersedia di build ffmpeg terpasang (dicek sekali per proses)."""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True, timeout=30,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return frozenset()
+    encoders = set()
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0][0] in "VAS":
+            encoders.add(parts[1])
+    return frozenset(encoders)
+
+
+def get_output_formats():
+    """OUTPUT_FORMATS yang encodernya tersedia di ffmpeg ini."""
+    encoders = get_available_encoders()
+    return {
+        label: fmt for label, fmt in OUTPUT_FORMATS.items()
+        if fmt in ("mp4", "gif") or FORMAT_ENCODERS[fmt] in encoders
+    }
+
+
+def get_preset_slug(preset_name):
+    return re.sub(r"[^a-z0-9]+", "_", preset_name.lower()).strip("_")
+
+
+def start_job_trace(kind, **attrs):
+    """Mulai trace untuk satu job bila tracing aktif dan job ini terpilih sampling."""
+    _trace_state.trace = None
+    _trace_state.stack = []
+    if not TRACE_PATH or random.random() >= TRACE_SAMPLE_RATE:
+        return None
+    _trace_state.trace = {
+        "job_id": uuid.uuid4().hex[:12],
+        "kind": kind,
+        "attrs": attrs,
+        "started_at": time.time(),
+        "spans": [],
+    }
+    return _trace_state.trace
+
+
+def get_job_trace():
+    return getattr(_trace_state, "trace", None)
+
+
+def _trace_value(value):
+    if hasattr(value, "name") and hasattr(value, "getbuffer"):
+        return value.name
+    text = value if isinstance(value, str) else repr(value)
+    return text[:TRACE_ARG_MAX_LENGTH]
+
+
+@contextlib.contextmanager
+def trace_span(name, **args):
+    """Catat durasi satu tahap pipeline ke trace job yang sedang aktif."""
+    trace = get_job_trace()
+    if trace is None:
+        yield None
+        return
+    span = {
+        "name": name,
+        "args": {k: _trace_value(v) for k, v in args.items() if not callable(v)},
+        "start_ms": round((time.time() - trace["started_at"]) * 1000, 1),
+    }
+    stack = getattr(_trace_state, "stack", None)
+    if stack is None:
+        stack = _trace_state.stack = []
+    stack.append(span)
+    start = time.perf_counter()
+    try:
+        yield span
+    except BaseException as err:
+        span["error"] = type(err).__name__
+        raise
+    finally:
+        span["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        stack.remove(span)
+        trace["spans"].append(span)
+
+
+def traced(name):
+    """Decorator: bungkus fungsi dalam trace_span beserta argumennya."""
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            span_args = signature.bind_partial(*args, **kwargs).arguments
+            with trace_span(name, **span_args):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def parse_ffmpeg_benchmark(stderr_text):
+    """Ambil waktu CPU, waktu nyata, dan peak RSS dari output -benchmark ffmpeg."""
+    bench = {}
+    for line in stderr_text.splitlines():
+        if not line.startswith("bench:"):
+            continue
+        for key, value in re.findall(r"(utime|stime|rtime)=([0-9.]+)s", line):
+            bench[key + "_s"] = float(value)
+        rss = re.search(r"maxrss=\s*([0-9]+)", line)
+        if rss:
+            bench["maxrss_kb"] = int(rss.group(1))
+    return bench
+
+
+def annotate_ffmpeg_span(stderr_text):
+    """Tempel hasil -benchmark ffmpeg ke span terdalam yang sedang berjalan."""
+    stack = getattr(_trace_state, "stack", None)
+    if not stack:
+        return
+    bench = parse_ffmpeg_benchmark(stderr_text)
+    if bench:
+        stack[-1].setdefault("ffmpeg", []).append(bench)
+
+
+def finish_job_trace(status="ok"):
+    """Tulis semua span job aktif sebagai JSON lines ke TRACE_PATH."""
+    trace = get_job_trace()
+    _trace_state.trace = None
+    if trace is None:
+        return
+    lines = []
+    for span in trace["spans"]:
+        lines.append(json.dumps({"job_id": trace["job_id"], "type": "span", **span}))
+    lines.append(json.dumps({
+        "job_id": trace["job_id"],
+        "type": "job",
+        "kind": trace["kind"],
+        "status": status,
+        "attrs": {k: _trace_value(v) for k, v in trace["attrs"].items()},
+        "started_at": trace["started_at"],
+        "duration_ms": round((time.time() - trace["started_at"]) * 1000, 1),
+        "python_maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }))
+    try:
+        os.makedirs(os.path.dirname(TRACE_PATH) or ".", exist_ok=True)
+        with _trace_lock, open(TRACE_PATH, "a") as f:
+            f.write("\n".join(lines) + "\n")
+    except OSError:
+        pass
+
+
+def run_ffmpeg_capture(stream_spec):
+    """ffmpeg.run dengan stdout/stderr ditangkap; tambah -benchmark saat job di-trace."""
+    if get_job_trace() is not None:
+        stream_spec = stream_spec.global_args("-benchmark")
+    out, err = ffmpeg.run(stream_spec, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+    annotate_ffmpeg_span(err.decode("utf-8", errors="ignore"))
+    return out, err
+
+
+def estimate_output_size(
+    duration, crf, resolution, has_audio, out_format="mp4", audio_kbps=AUDIO_BITRATE_KBPS,
+    video_metadata=None, aspect_ratio=None, target_fps=None,
+):
+    """Estimasi ukuran output berdasarkan parameter.
+
+    Bila model hasil job sebelumnya sudah tersedia dan metadata sumber
+    diketahui, bitrate video diprediksi oleh model tersebut. Jika tidak,
+    dipakai perkiraan kasar per resolusi.
+    """
+    video_kbps = predict_video_kbps(video_metadata, crf, resolution, out_format, aspect_ratio, target_fps, duration)
+    if video_kbps is None:
+        res_bitrate = {"1080p": 4000, "720p": 2000, "480p": 1000, "360p": 600}
+        base_kbps = res_bitrate.get(resolution, 2500)
+        crf_factor = 2.0 ** ((28 - crf) / 6.0)
+        video_kbps = base_kbps * crf_factor
+        format_factor = {"gif": 3.0, "webp": 1.7, "avif": 0.9, "webm": 0.85, "hevc": 0.65, "av1": 0.55}
+        video_kbps = video_kbps * format_factor.get(out_format, 1.0)
+    if not has_audio or out_format in ANIMATED_IMAGE_FORMATS:
+        audio_kbps = 0
     total_kbps = video_kbps + audio_kbps
     size_bytes = (total_kbps * duration * 1000) / 8
     return max(int(size_bytes), 0)
 
 
-def calculate_target_bitrate(target_mb, duration, has_audio):
+def image_quality_to_crf(quality):
+    """Kualitas WebP/AVIF (0-100) ke CRF skala x264 yang kira-kira setara, untuk estimasi ukuran."""
+    return 18 + (100 - quality) * 0.24
+
+
+def calculate_target_bitrate(target_mb, duration, has_audio, audio_kbps=AUDIO_BITRATE_KBPS):
     """Hitung bitrate video untuk mencapai target ukuran file."""
     if duration <= 0:
         return None
     target_bits = target_mb * 8 * 1024 * 1024
-    audio_bits = 96 * 1000 * duration if has_audio else 0
+    audio_bits = audio_kbps * 1000 * duration if has_audio else 0
     video_bits = target_bits - audio_bits
     if video_bits <= 0:
         return None
@@ -373,17 +738,300 @@ def calculate_target_bitrate(target_mb, duration, has_audio):
     return str(video_kbps) + "k"
 
 
-def extract_frame(video_path, timestamp=1.0):
-    """Ambil satu frame dari video dan kembalikan sebagai base64 JPEG."""
+def retune_for_size(crf, limit_bytes, duration, audio_kbps=0):
+    """CRF dan maxrate baru setelah encode dihentikan karena proyeksi ukuran melewati batas.
+
+    CRF dinaikkan 4 langkah dan maxrate dipasang ke bitrate video yang muat
+    di SIZE_RETUNE_SAFETY dari batas, sehingga percobaan ulang dijamin lebih kecil.
+    """
+    target_mb = limit_bytes * SIZE_RETUNE_SAFETY / (1024 * 1024)
+    return min(crf + 4, 51), calculate_target_bitrate(target_mb, duration, audio_kbps > 0, audio_kbps)
+
+
+def bitrate_to_kbps(bitrate):
+    """Ubah string bitrate ffmpeg ("800k", "3.5M") ke kbps."""
+    if bitrate.endswith("M"):
+        return float(bitrate[:-1]) * 1000
+    if bitrate.endswith("k"):
+        return float(bitrate[:-1])
+    return float(bitrate) / 1000
+
+
+def cap_bitrate_for_size(max_bitrate, limit_mb, duration, audio_kbps=0):
+    """Bitrate maks untuk encode per segmen yang harus muat di batas ukuran.
+
+    Jalur terdistribusi dan checkpoint tidak punya guard proyeksi ukuran, jadi
+    batasnya dipasang sejak awal; maxrate preset dipakai bila sudah lebih kecil.
+    """
+    target = calculate_target_bitrate(limit_mb * SIZE_RETUNE_SAFETY, duration, audio_kbps > 0, audio_kbps)
+    if target is None:
+        return max_bitrate
+    if max_bitrate and bitrate_to_kbps(max_bitrate) <= bitrate_to_kbps(target):
+        return max_bitrate
+    return target
+
+
+def can_copy_audio(video_metadata, out_format, audio_budget_kbps=AUDIO_BITRATE_KBPS):
+    """Cek apakah track audio sumber bisa disalin tanpa re-encode.
+
+    Audio hanya disalin bila codec cocok dengan container tujuan, maksimal
+    stereo, dan bitrate-nya diketahui serta tidak melebihi anggaran audio.
+    """
+    if not video_metadata or not video_metadata.get("has_audio"):
+        return False
+    if video_metadata.get("audio_codec") not in AUDIO_COPY_CODECS.get(out_format, []):
+        return False
+    if video_metadata.get("audio_channels", 0) > AUDIO_MAX_CHANNELS:
+        return False
+    audio_kbps = video_metadata.get("audio_bitrate", 0)
+    return 0 < audio_kbps <= audio_budget_kbps
+
+
+def get_source_size(video_metadata):
+    """(lebar, tinggi, SAR) stream video sumber dari metadata, atau None."""
+    if not video_metadata or not video_metadata.get("width") or not video_metadata.get("height"):
+        return None
+    return video_metadata["width"], video_metadata["height"], video_metadata.get("sar") or 1.0
+
+
+def get_source_fps(video_metadata):
+    """fps stream video sumber dari metadata, atau None."""
+    if not video_metadata or not video_metadata.get("fps"):
+        return None
+    return video_metadata["fps"]
+
+
+def plan_geometry(width, height, resolution, aspect_ratio=None, crop_rect=None, sar=1.0):
+    """Rencanakan geometri output sebagai satu crop lalu satu scale dengan angka absolut.
+
+    Crop bingkai hitam dan crop aspect ratio (di tengah, dihitung dalam
+    piksel tampilan bila SAR bukan 1:1) digabung menjadi satu persegi
+    ber-koordinat genap. Resolusi target tidak pernah memperbesar video.
+    Mengembalikan dict berisi crop (w, h, x, y) atau None, scale (w, h)
+    atau None bila tidak perlu, serta width/height output.
+    """
+    x, y, w, h = 0.0, 0.0, float(width), float(height)
+    if crop_rect:
+        x, y, w, h = crop_rect["x"], crop_rect["y"], float(crop_rect["w"]), float(crop_rect["h"])
+    if aspect_ratio:
+        num, _, den = aspect_ratio.partition(":")
+        ratio = float(num) / float(den or 1)
+        if w * sar / h > ratio:
+            new_w = h * ratio / sar
+            x, w = x + (w - new_w) / 2, new_w
+        else:
+            new_h = w * sar / ratio
+            y, h = y + (h - new_h) / 2, new_h
+
+    crop_w, crop_h = int(w) // 2 * 2, int(h) // 2 * 2
+    crop = (crop_w, crop_h, int(x) // 2 * 2, int(y) // 2 * 2)
+    if crop_w == width and crop_h == height:
+        crop = None
+
+    out_h = crop_h
+    if resolution in RESOLUTION_MAP:
+        out_h = min(RESOLUTION_MAP[resolution], crop_h) // 2 * 2
+    out_w = int(round(out_h * crop_w * sar / crop_h / 2)) * 2
+    scale = (out_w, out_h) if (out_w, out_h) != (crop_w, crop_h) else None
+    return {"crop": crop, "scale": scale, "width": out_w, "height": out_h}
+
+
+def output_dimensions(width, height, resolution, aspect_ratio=None):
+    """Hitung resolusi output (lebar, tinggi) sesuai rantai filter compress_video."""
+    if not width or not height:
+        return None
+    plan = plan_geometry(width, height, resolution, aspect_ratio)
+    return plan["width"], plan["height"]
+
+
+def planned_output_width(video_metadata, crop_rect, resolution, aspect_ratio=None):
+    """Lebar output encode untuk sumber (setelah crop bingkai hitam), atau None bila tidak diketahui."""
+    source_size = get_source_size(video_metadata)
+    if not source_size:
+        return None
+    width, height, sar = source_size
+    return plan_geometry(width, height, resolution, aspect_ratio, crop_rect, sar)["width"]
+
+
+def size_model_features(sample):
+    """Vektor fitur model ukuran: CRF, fps, durasi, bpp sumber, dan format."""
+    src_pixels = sample["src_width"] * sample["src_height"] * max(sample["src_fps"], 1)
+    src_bpp = sample["src_bitrate"] / src_pixels
+    features = [
+        1.0,
+        float(sample["crf"]),
+        math.log(max(sample["fps"], 1)),
+        math.log(max(sample["duration"], 0.5)),
+        math.log(max(src_bpp, 1e-4)),
+    ]
+    for fmt in SIZE_MODEL_FORMATS[1:]:
+        features.append(1.0 if sample["out_format"] == fmt else 0.0)
+    return features
+
+
+def record_size_sample(video_metadata, crf, resolution, out_format, aspect_ratio, target_fps,
+                       duration, output_size, audio_kbps=0):
+    """Simpan hasil satu job (sumber, pengaturan, ukuran akhir) untuk melatih estimator."""
+    if not video_metadata or not video_metadata.get("bitrate") or duration <= 0:
+        return
+    if out_format not in SIZE_MODEL_FORMATS:
+        return
+    dims = output_dimensions(video_metadata.get("width"), video_metadata.get("height"), resolution, aspect_ratio)
+    if not dims:
+        return
+    video_bits = output_size * 8 - audio_kbps * 1000 * duration
+    if video_bits <= 0:
+        return
+    sample = {
+        "src_width": video_metadata["width"],
+        "src_height": video_metadata["height"],
+        "src_fps": video_metadata.get("fps", 0),
+        "src_bitrate": video_metadata["bitrate"],
+        "width": dims[0],
+        "height": dims[1],
+        "fps": target_fps or video_metadata.get("fps", 0),
+        "duration": duration,
+        "crf": crf,
+        "out_format": out_format,
+        "video_bits": video_bits,
+        "timestamp": time.time(),
+    }
+    try:
+        os.makedirs(STATS_DIR, exist_ok=True)
+        with open(SIZE_SAMPLES_PATH, "a") as f:
+            f.write(json.dumps(sample) + "\n")
+    except OSError:
+        pass
+
+
+def fit_size_model():
+    """Latih ulang regresi log bits-per-pixel dari hasil job yang tersimpan."""
+    try:
+        with open(SIZE_SAMPLES_PATH, "r") as f:
+            total = 0
+            lines = collections.deque(maxlen=SIZE_MODEL_MAX_SAMPLES)
+            for line in f:
+                lines.append(line)
+                total += 1
+    except OSError:
+        return None
+    # File sampel dipangkas agar tidak tumbuh tanpa batas; sampel lama tidak dipakai lagi
+    if total > 2 * SIZE_MODEL_MAX_SAMPLES:
+        try:
+            with open(SIZE_SAMPLES_PATH + ".tmp", "w") as f:
+                f.writelines(lines)
+            os.replace(SIZE_SAMPLES_PATH + ".tmp", SIZE_SAMPLES_PATH)
+        except OSError:
+            pass
+
+    rows, targets = [], []
+    for line in lines:
+        try:
+            sample = json.loads(line)
+            # Sampel GIF dari versi lama: fps/CRF yang tercatat tidak sesuai encode sebenarnya
+            if sample["out_format"] not in SIZE_MODEL_FORMATS:
+                continue
+            pixels = sample["width"] * sample["height"] * max(sample["fps"], 1) * sample["duration"]
+            rows.append(size_model_features(sample))
+            targets.append(math.log(sample["video_bits"] / pixels))
+        except (ValueError, KeyError, ZeroDivisionError):
+            continue
+    if len(rows) < SIZE_MODEL_MIN_SAMPLES:
+        return None
+
+    x = np.array(rows)
+    y = np.array(targets)
+    # Ridge kecil agar tetap stabil saat satu format belum punya banyak sampel
+    ridge = 1e-3 * np.eye(x.shape[1])
+    ridge[0, 0] = 0.0
+    coef = np.linalg.solve(x.T @ x + ridge, x.T @ y)
+    model = {"coef": coef.tolist(), "samples": len(rows), "fitted_at": time.time()}
+    try:
+        with open(SIZE_MODEL_PATH, "w") as f:
+            json.dump(model, f)
+    except OSError:
+        pass
+    return model
+
+
+def load_size_model():
+    try:
+        with open(SIZE_MODEL_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+@st.cache_resource(show_spinner=False)
+def get_size_model_state():
+    return {"model": load_size_model(), "checked_at": 0.0, "lock": threading.Lock()}
+
+
+def refit_size_model(state):
+    try:
+        model = fit_size_model()
+        if model:
+            state["model"] = model
+    finally:
+        state["lock"].release()
+
+
+def get_size_model():
+    """Ambil model ukuran terkini; latih ulang di background bila sudah kedaluwarsa."""
+    state = get_size_model_state()
+    if time.time() - state["checked_at"] > SIZE_MODEL_REFIT_INTERVAL and state["lock"].acquire(blocking=False):
+        state["checked_at"] = time.time()
+        threading.Thread(target=refit_size_model, args=(state,), daemon=True).start()
+    return state["model"]
+
+
+def predict_video_kbps(video_metadata, crf, resolution, out_format, aspect_ratio=None, target_fps=None, duration=0):
+    """Prediksi bitrate video (kbps) dari model ukuran, atau None bila belum tersedia."""
+    if not video_metadata or not video_metadata.get("bitrate") or duration <= 0:
+        return None
+    if out_format not in SIZE_MODEL_FORMATS:
+        return None
+    model = get_size_model()
+    if not model:
+        return None
+    dims = output_dimensions(video_metadata.get("width"), video_metadata.get("height"), resolution, aspect_ratio)
+    if not dims:
+        return None
+    fps = target_fps or video_metadata.get("fps", 0)
+    sample = {
+        "src_width": video_metadata["width"],
+        "src_height": video_metadata["height"],
+        "src_fps": video_metadata.get("fps", 0),
+        "src_bitrate": video_metadata["bitrate"],
+        "fps": fps,
+        "duration": duration,
+        "crf": crf,
+        "out_format": out_format,
+    }
+    features = size_model_features(sample)
+    if len(model["coef"]) != len(features):
+        return None
+    log_bpp = float(np.dot(model["coef"], features))
+    return math.exp(log_bpp) * dims[0] * dims[1] * max(fps, 1) / 1000
+
+
+@traced("extract_frame")
+def extract_frame(video_path, timestamp=1.0, index=None):
+    """Ambil satu frame dari video dan kembalikan sebagai base64 JPEG.
+
+    Dengan indeks packet, seek langsung ke keyframe pada atau sebelum
+    timestamp sehingga hanya satu frame yang didecode.
+    """
+    input_args = {"ss": timestamp}
+    if index is not None:
+        input_args = {"ss": keyframe_at_or_before(index, timestamp), "noaccurate_seek": None}
     try:
         out_path = video_path + "_thumb.jpg"
         _temp_files.append(out_path)
-        (
+        run_ffmpeg_capture(
             ffmpeg
-            .input(video_path, ss=timestamp)
+            .input(video_path, **input_args)
             .output(out_path, vframes=1, format="image2", **{"q:v": 2})
-            .overwrite_output()
-            .run(capture_stdout=True, capture_stderr=True)
         )
         if os.path.exists(out_path):
             with open(out_path, "rb") as f:
@@ -393,6 +1041,396 @@ def extract_frame(video_path, timestamp=1.0):
     return None
 
 
+def build_filmstrip(video_path):
+    """Buat sprite sheet thumbnail dari keyframe saja untuk memilih titik potong.
+
+    Decoder melewati semua frame non-key (-skip_frame nokey), keyframe dipilih
+    dengan jarak merata, lalu disusun filter tile menjadi satu JPEG kecil oleh
+    satu proses ffmpeg. Hasil disimpan di samping file sesi agar bisa dipakai
+    lagi saat sesi dilanjutkan.
+    """
+    sprite_path = video_path + "_filmstrip.jpg"
+    meta_path = video_path + "_filmstrip.json"
+    cached = load_filmstrip(video_path)
+    if cached:
+        return cached
+
+    metadata = probe_video(video_path)
+    duration = metadata.get("duration", 0) if metadata else 0
+    interval = duration / FILMSTRIP_FRAMES if duration > 0 else 1.0
+    try:
+        video = ffmpeg.input(video_path, skip_frame="nokey").video
+        video = ffmpeg.filter(video, "select", "isnan(prev_selected_t)+gte(t-prev_selected_t," + f"{interval:.3f}" + ")")
+        video = ffmpeg.filter(video, "showinfo")
+        video = ffmpeg.filter(video, "scale", FILMSTRIP_THUMB_WIDTH, -2, flags="fast_bilinear")
+        video = ffmpeg.filter(video, "tile", str(FILMSTRIP_FRAMES) + "x1")
+        _, err = run_ffmpeg_capture(
+            ffmpeg.output(video, sprite_path, vframes=1, fps_mode="vfr", **{"q:v": 4}),
+        )
+    except ffmpeg.Error:
+        return None
+
+    timestamps = [
+        float(t) for t in re.findall(r"pts_time:([0-9.]+)", err.decode("utf-8", errors="ignore"))
+    ][:FILMSTRIP_FRAMES]
+    if not timestamps or not os.path.exists(sprite_path):
+        return None
+    filmstrip = {"sprite_path": sprite_path, "timestamps": timestamps, "duration": duration}
+    with open(meta_path, "w") as f:
+        json.dump(filmstrip, f)
+    return filmstrip
+
+
+def load_filmstrip(video_path):
+    try:
+        with open(video_path + "_filmstrip.json", "r") as f:
+            filmstrip = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    return filmstrip if os.path.exists(filmstrip.get("sprite_path", "")) else None
+
+
+@traced("build_packet_index")
+def build_packet_index(video_path):
+    """Bangun indeks packet stream video dari satu pass ffprobe tanpa decode.
+
+    Indeks berisi timestamp, offset byte, dan ukuran setiap packet (untuk
+    profil bitrate) serta posisi keyframe, sebagai array numpy yang disimpan
+    dalam .npz di samping file sesi dan di storage sesi. Seek dan batas
+    segmen cukup dicari dengan searchsorted, tanpa decode dari awal.
+    """
+    try:
+        result = subprocess.run(
+            [
+                "ffprobe", "-v", "error", "-select_streams", "v:0",
+                "-show_entries", "packet=pts_time,pos,size,flags", "-of", "compact=p=0", video_path,
+            ],
+            capture_output=True, check=True,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+    pts, pos, size, key = [], [], [], []
+    for line in result.stdout.decode("utf-8", errors="ignore").splitlines():
+        fields = dict(part.split("=", 1) for part in line.split("|") if "=" in part)
+        try:
+            pts.append(float(fields["pts_time"]))
+        except (KeyError, ValueError):
+            continue
+        pos.append(int(fields["pos"]) if fields.get("pos", "").isdigit() else -1)
+        size.append(int(fields["size"]) if fields.get("size", "").isdigit() else 0)
+        key.append(fields.get("flags", "").startswith("K"))
+    if not any(key):
+        return None
+
+    # Packet B-frame datang dalam urutan decode; urutkan per timestamp dan
+    # jadikan relatif terhadap awal stream seperti -ss ffmpeg
+    order = np.argsort(np.array(pts), kind="stable")
+    pts_array = np.array(pts, dtype=np.float64)[order]
+    index = {
+        "pts": pts_array - pts_array[0],
+        "pos": np.array(pos, dtype=np.int64)[order],
+        "size": np.array(size, dtype=np.int32)[order],
+        "key": np.flatnonzero(np.array(key, dtype=bool)[order]),
+    }
+    index_path = video_path + PACKET_INDEX_SUFFIX
+    # Nama tmp unik: indexer background dan encode checkpoint bisa membangun indeks yang sama bersamaan
+    tmp_path = index_path + "." + uuid.uuid4().hex + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, **index)
+    os.replace(tmp_path, index_path)
+    _temp_files.append(index_path)
+    # .npz lokal cukup untuk replika ini; storage hanya berbagi indeks ke replika lain
+    try:
+        get_storage().put_file(os.path.basename(index_path), index_path)
+    except OSError:
+        pass
+    return index
+
+
+def load_packet_index(video_path):
+    """Indeks packet file sesi dari cache lokal atau storage sesi, atau None bila belum ada."""
+    index_path = video_path + PACKET_INDEX_SUFFIX
+    if not os.path.exists(index_path):
+        storage = get_storage()
+        if not storage.exists(os.path.basename(index_path)):
+            return None
+        try:
+            storage.fetch(os.path.basename(index_path), index_path)
+        except OSError:
+            return None
+        _temp_files.append(index_path)
+    try:
+        with np.load(index_path) as data:
+            return {name: data[name] for name in ("pts", "pos", "size", "key")}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def ensure_packet_index(video_path):
+    return load_packet_index(video_path) or build_packet_index(video_path)
+
+
+def keyframe_at_or_before(index, timestamp):
+    """Timestamp keyframe terakhir pada atau sebelum timestamp (detik)."""
+    key_pts = index["pts"][index["key"]]
+    i = int(np.searchsorted(key_pts, timestamp + KEYFRAME_SEEK_EPSILON, side="right")) - 1
+    return float(key_pts[max(i, 0)])
+
+
+def keyframe_segment_times(index, segment_seconds, trim_start=None, trim_end=None):
+    """Batas segmen keyframe untuk rentang trim: (awal, titik potong, akhir atau None).
+
+    Titik potong adalah keyframe pertama pada atau setelah setiap kelipatan
+    segment_seconds dari awal rentang, sama seperti muxer segment ffmpeg.
+    """
+    key_pts = index["pts"][index["key"]]
+    start = keyframe_at_or_before(index, trim_start or 0)
+    end = None
+    if trim_end:
+        i = int(np.searchsorted(key_pts, trim_end - KEYFRAME_SEEK_EPSILON, side="left"))
+        end = float(key_pts[i]) if i < len(key_pts) else None
+    limit = end if end is not None else float(index["pts"][-1])
+    targets = np.arange(start + segment_seconds, limit, segment_seconds)
+    picks = np.unique(np.searchsorted(key_pts, targets - KEYFRAME_SEEK_EPSILON, side="left"))
+    cuts = [float(key_pts[i]) for i in picks if i < len(key_pts) and key_pts[i] < limit]
+    return start, cuts, end
+
+
+def index_bitrate(index, start=None, end=None):
+    """Bitrate video sumber (bit/s) pada rentang waktu, dari ukuran packet di indeks."""
+    pts = index["pts"]
+    lo = int(np.searchsorted(pts, start or 0, side="left"))
+    hi = int(np.searchsorted(pts, end, side="left")) if end else len(pts)
+    if hi - lo < 2:
+        return 0
+    span = float(pts[hi - 1] - pts[lo]) or 1.0
+    return int(index["size"][lo:hi].sum() * 8 / span)
+
+
+@st.cache_resource(show_spinner=False)
+def get_background_pool():
+    return ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="kompres-bg")
+
+
+@st.cache_resource(show_spinner=False)
+def get_speculation_pool():
+    """Pool terpisah untuk encode spekulatif agar filmstrip tidak antre di belakangnya."""
+    return ThreadPoolExecutor(max_workers=SPECULATION_WORKERS, thread_name_prefix="kompres-spec")
+
+
+class FairScheduler:
+    """Antrean encode bersama dengan weighted fair queueing per token sesi.
+
+    Setiap job mendapat tag selesai virtual: max(waktu virtual, tag selesai
+    job sebelumnya dari token yang sama) + biaya / bobot. Slot kosong
+    diberikan ke job menunggu dengan tag terkecil yang tokennya belum
+    mencapai batas job bersamaan. Job pendek jadi didahulukan, dan token
+    yang mengirim banyak job panjang tidak bisa memonopoli antrean.
+
+    Waktu virtual maju ke tag selesai setiap job yang selesai dilayani
+    (self-clocked), sehingga aliran job pendek dari token baru ikut menaikkan
+    tag-nya sendiri dan job panjang yang menunggu tetap mendapat giliran
+    setelah layanan sebanyak biayanya.
+
+    Job background (encode spekulatif) berprioritas paling rendah: hanya
+    mendapat slot bila tidak ada job biasa yang menunggu, tidak memakai
+    tag virtual maupun batas per token, dan ditandai preempted begitu job
+    biasa menunggu slot. Pemiliknya harus menghentikan kerja dan melepas
+    ticket saat melihat tanda itu.
+    """
+
+    def __init__(self, slots, per_token_limit):
+        self.slots = slots
+        self.per_token_limit = per_token_limit
+        self.cond = threading.Condition()
+        self.virtual_time = 0.0
+        self.last_finish = {}
+        self.running = {}
+        self.waiting = []
+        self.background_waiting = []
+        self.background_running = []
+        self.active = 0
+        self.sequence = 0
+
+    def submit(self, token, cost, weight=1.0, background=False):
+        with self.cond:
+            if background:
+                self.sequence += 1
+                ticket = {
+                    "token": token,
+                    "seq": self.sequence,
+                    "granted": False,
+                    "background": True,
+                    "preempted": False,
+                }
+                self.background_waiting.append(ticket)
+                self.dispatch()
+                return ticket
+            start = max(self.virtual_time, self.last_finish.get(token, 0.0))
+            self.sequence += 1
+            ticket = {
+                "token": token,
+                "start": start,
+                "finish": start + cost / weight,
+                "seq": self.sequence,
+                "granted": False,
+            }
+            self.last_finish[token] = ticket["finish"]
+            self.waiting.append(ticket)
+            self.dispatch()
+            return ticket
+
+    def dispatch(self):
+        while self.active < self.slots:
+            eligible = [t for t in self.waiting if self.running.get(t["token"], 0) < self.per_token_limit]
+            if not eligible:
+                break
+            ticket = min(eligible, key=lambda t: (t["finish"], t["seq"]))
+            self.waiting.remove(ticket)
+            ticket["granted"] = True
+            self.active += 1
+            self.running[ticket["token"]] = self.running.get(ticket["token"], 0) + 1
+            self.virtual_time = max(self.virtual_time, ticket["start"])
+        demand = sum(1 for t in self.waiting if self.running.get(t["token"], 0) < self.per_token_limit)
+        if demand:
+            # Job biasa menunggu: hentikan encode background sebanyak job yang menunggu
+            for ticket in self.background_running:
+                if demand <= 0:
+                    break
+                if not ticket["preempted"]:
+                    ticket["preempted"] = True
+                demand -= 1
+        else:
+            while self.active < self.slots and self.background_waiting:
+                ticket = self.background_waiting.pop(0)
+                ticket["granted"] = True
+                self.active += 1
+                self.background_running.append(ticket)
+        self.cond.notify_all()
+
+    def wait(self, ticket, timeout):
+        """Tunggu paling lama timeout detik; True bila ticket sudah mendapat slot."""
+        with self.cond:
+            if not ticket["granted"]:
+                self.cond.wait(timeout)
+            return ticket["granted"]
+
+    def position(self, ticket):
+        """(posisi ticket dalam antrean, jumlah job menunggu); posisi 0 berarti sedang berjalan."""
+        with self.cond:
+            if ticket["granted"]:
+                return 0, len(self.waiting)
+            key = (ticket["finish"], ticket["seq"])
+            ahead = sum(1 for t in self.waiting if (t["finish"], t["seq"]) < key)
+            return ahead + 1, len(self.waiting)
+
+    def busy(self):
+        """True bila semua slot terpakai atau ada job yang menunggu."""
+        with self.cond:
+            return self.active >= self.slots or bool(self.waiting)
+
+    def release(self, ticket):
+        with self.cond:
+            if ticket.get("background"):
+                if ticket in self.background_waiting:
+                    self.background_waiting.remove(ticket)
+                elif ticket in self.background_running:
+                    self.background_running.remove(ticket)
+                    ticket["granted"] = False
+                    self.active -= 1
+                self.dispatch()
+                return
+            token = ticket["token"]
+            if ticket in self.waiting:
+                self.waiting.remove(ticket)
+            elif ticket["granted"]:
+                ticket["granted"] = False
+                self.active -= 1
+                self.running[token] -= 1
+                self.virtual_time = max(self.virtual_time, ticket["finish"])
+            idle = self.running.get(token, 0) == 0 and not any(t["token"] == token for t in self.waiting)
+            if idle:
+                self.running.pop(token, None)
+                if self.last_finish.get(token, 0.0) <= self.virtual_time:
+                    self.last_finish.pop(token, None)
+            self.dispatch()
+
+
+@st.cache_resource(show_spinner=False)
+def get_scheduler():
+    """Scheduler encode bersama untuk seluruh sesi dalam proses ini."""
+    return FairScheduler(ENCODE_SLOTS, SCHEDULER_MAX_JOBS_PER_TOKEN)
+
+
+def estimate_job_cost(duration, presets):
+    """Biaya job untuk scheduler: durasi video dikali biaya preset setiap output."""
+    return max(duration, 1.0) * sum(PRESET_COSTS.get(p, 1.0) for p in presets)
+
+
+@contextlib.contextmanager
+def encode_slot(token, cost, status_placeholder=None):
+    """Tunggu giliran di scheduler sambil menampilkan posisi antrean, lalu lepaskan slot setelah encode."""
+    scheduler = get_scheduler()
+    ticket = scheduler.submit(token, cost)
+    wait_start = time.time()
+    try:
+        with trace_span("queue_wait", cost=cost):
+            while not scheduler.wait(ticket, SCHEDULER_POLL_INTERVAL):
+                position, waiting = scheduler.position(ticket)
+                if status_placeholder is not None and position:
+                    status_placeholder.caption(
+                        "Menunggu giliran encode: posisi " + str(position) + " dari " + str(waiting)
+                    )
+        st.session_state["last_queue_wait"] = time.time() - wait_start
+        if status_placeholder is not None:
+            status_placeholder.empty()
+        yield
+    finally:
+        scheduler.release(ticket)
+
+
+def start_filmstrip(video_path):
+    """Mulai pembuatan filmstrip dan indeks packet di background untuk file sesi ini."""
+    pool = get_background_pool()
+    st.session_state["filmstrip_future"] = pool.submit(build_filmstrip, video_path)
+    pool.submit(ensure_packet_index, video_path)
+
+
+def get_filmstrip(video_path):
+    """Ambil filmstrip bila sudah selesai dibuat, tanpa menunggu."""
+    future = st.session_state.get("filmstrip_future")
+    if future is not None and future.done():
+        try:
+            return future.result()
+        except Exception:
+            return None
+    if future is None:
+        return load_filmstrip(video_path)
+    return None
+
+
+def filmstrip_pending():
+    """Apakah pembuatan filmstrip masih berjalan; False bila sudah selesai, gagal, atau tidak dimulai."""
+    future = st.session_state.get("filmstrip_future")
+    return future is not None and not future.done()
+
+
+def get_stream_rotation(video_stream):
+    """Rotasi tampilan stream (derajat) dari side data displaymatrix atau tag rotate lama."""
+    for side_data in video_stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            try:
+                return int(float(side_data["rotation"])) % 360
+            except (TypeError, ValueError):
+                return 0
+    try:
+        return int(float(video_stream.get("tags", {}).get("rotate", 0))) % 360
+    except (TypeError, ValueError):
+        return 0
+
+
+@traced("probe_video")
 def probe_video(file_path):
     try:
         info = ffmpeg.probe(file_path, analyzeduration="5000000", probesize="5000000")
@@ -426,244 +1464,2315 @@ def probe_video(file_path):
             result["height"] = int(video_stream.get("height", 0))
             result["codec"] = video_stream.get("codec_name", "unknown").upper()
             result["fps"] = fps
-            result["resolution_text"] = str(video_stream.get("width", 0)) + "x" + str(video_stream.get("height", 0))
+            sar_parts = video_stream.get("sample_aspect_ratio", "1:1").split(":")
+            if len(sar_parts) == 2 and sar_parts[0].isdigit() and int(sar_parts[0]) > 0 and int(sar_parts[1]) > 0:
+                result["sar"] = int(sar_parts[0]) / int(sar_parts[1])
+            # ffmpeg memutar frame saat decode (autorotate), jadi filter melihat ukuran tampilan;
+            # video HP portrait 1920x1080 dengan rotasi 90 harus direncanakan sebagai 1080x1920
+            result["rotation"] = get_stream_rotation(video_stream)
+            if result["rotation"] in (90, 270):
+                result["width"], result["height"] = result["height"], result["width"]
+                if result.get("sar"):
+                    result["sar"] = 1 / result["sar"]
+            result["resolution_text"] = str(result["width"]) + "x" + str(result["height"])
 
         if audio_stream:
             result["audio_codec"] = audio_stream.get("codec_name", "unknown").upper()
             ab = audio_stream.get("bit_rate", 0)
             result["audio_bitrate"] = int(ab) // 1000 if ab else 0
+            result["audio_channels"] = int(audio_stream.get("channels", 0))
 
         return result
     except Exception:
         return None
 
 
-def compress_video(
-    input_path,
-    output_path,
-    crf,
-    preset,
-    mute_audio,
-    resolution,
-    trim_start=None,
-    trim_end=None,
-    target_fps=None,
-    aspect_ratio=None,
-    max_bitrate=None,
-    progress_callback=None,
-    duration_seconds=0,
-    out_format="mp4",
-):
+@traced("analyze_scenes")
+def analyze_scenes(input_path, trim_start=None, trim_end=None):
+    """Deteksi batas adegan dan tingkat kompleksitasnya dari analisis resolusi rendah.
+
+    Skor scene ffmpeg dihitung untuk setiap frame pada video yang diperkecil.
+    Skor di atas SCENE_THRESHOLD menandai awal adegan baru, sedangkan rata-rata
+    skor dalam satu adegan dipakai sebagai ukuran gerak atau kompleksitasnya.
+    """
     try:
-        input_args = {}
-        if trim_start is not None and trim_start > 0:
-            input_args["ss"] = trim_start
-        if trim_end is not None and trim_end > 0:
-            input_args["to"] = trim_end
+        video = ffmpeg.input(input_path, **build_input_args(trim_start, trim_end)).video
+        video = ffmpeg.filter(video, "scale", SCENE_ANALYSIS_WIDTH, -2, flags="fast_bilinear")
+        video = ffmpeg.filter(video, "select", "gte(scene,0)")
+        video = ffmpeg.filter(video, "metadata", "print", file="-")
+        out, _ = run_ffmpeg_capture(ffmpeg.output(video, "-", f="null", threads=FFMPEG_THREADS))
+    except ffmpeg.Error:
+        return []
+
+    frames = []
+    pts_time = None
+    for line in out.decode("utf-8", errors="ignore").splitlines():
+        if line.startswith("frame:"):
+            match = re.search(r"pts_time:([0-9.]+)", line)
+            pts_time = float(match.group(1)) if match else None
+        elif line.startswith("lavfi.scene_score=") and pts_time is not None:
+            frames.append((pts_time, float(line.split("=", 1)[1])))
+    if not frames:
+        return []
+
+    scenes = [{"start": 0.0, "scores": []}]
+    for pts, score in frames:
+        current = scenes[-1]
+        if score > SCENE_THRESHOLD and pts - current["start"] >= SCENE_MIN_SECONDS:
+            scenes.append({"start": pts, "scores": []})
+        else:
+            current["scores"].append(score)
 
-        source = ffmpeg.input(input_path, **input_args)
-        video = source.video
-        audio = source.audio
+    end_time = frames[-1][0]
+    for i, scene in enumerate(scenes):
+        scene["end"] = scenes[i + 1]["start"] if i + 1 < len(scenes) else end_time
+        scores = scene.pop("scores")
+        scene["complexity"] = sum(scores) / len(scores) if scores else 0.0
+    return scenes
 
-        if resolution in RESOLUTION_MAP:
-            target_h = RESOLUTION_MAP[resolution]
-            video = ffmpeg.filter(video, "scale", "trunc(oh*a/2)*2", target_h)
-        else:
-            video = ffmpeg.filter(video, "scale", "trunc(iw/2)*2", "trunc(ih/2)*2")
-
-        if aspect_ratio:
-            ratio_map = {"16:9": "16/9", "9:16": "9/16", "1:1": "1", "4:3": "4/3"}
-            if aspect_ratio in ratio_map:
-                r = ratio_map[aspect_ratio]
-                video = ffmpeg.filter(
-                    video, "crop",
-                    "if(gt(iw/ih," + r + "),ih*" + r + ",iw)",
-                    "if(gt(iw/ih," + r + "),ih,iw/(" + r + "))",
-                )
-                video = ffmpeg.filter(video, "scale", "trunc(iw/2)*2", "trunc(ih/2)*2")
 
-        if target_fps:
-            video = ffmpeg.filter(video, "fps", fps=target_fps)
+def build_scene_zones(scenes, fps):
+    """Ubah daftar adegan menjadi parameter zones x264 dengan pengali bitrate.
 
-        # --- GIF output ---
-        if out_format == "gif":
-            if not target_fps:
-                video = ffmpeg.filter(video, "fps", fps=15)
-            palette_path = output_path + "_palette.png"
-            _temp_files.append(palette_path)
-            palette_gen = ffmpeg.output(video, palette_path, vf="palettegen=stats_mode=diff", an=None)
-            ffmpeg.run(palette_gen, overwrite_output=True, capture_stdout=True, capture_stderr=True)
-            source2 = ffmpeg.input(input_path, **input_args)
-            vid2 = source2.video
-            if resolution in RESOLUTION_MAP:
-                vid2 = ffmpeg.filter(vid2, "scale", "trunc(oh*a/2)*2", RESOLUTION_MAP[resolution])
-            if target_fps:
-                vid2 = ffmpeg.filter(vid2, "fps", fps=target_fps)
-            else:
-                vid2 = ffmpeg.filter(vid2, "fps", fps=15)
-            palette_in = ffmpeg.input(palette_path)
-            gif_out = ffmpeg.filter([vid2, palette_in], "paletteuse", dither="bayer", bayer_scale=3)
-            output = ffmpeg.output(gif_out, output_path, an=None, loop=0)
-            ffmpeg.run(output, overwrite_output=True, capture_stdout=True, capture_stderr=True)
-            return True, None
+    Pengali dinormalisasi terhadap durasi sehingga rata-ratanya tetap 1.0;
+    bitrate hanya dipindah dari adegan statis ke adegan kompleks, total
+    anggaran (mis. Smart Compression) tidak berubah.
+    """
+    if len(scenes) < 2 or not fps:
+        return None
+
+    weights = []
+    for scene in scenes:
+        for limit, factor in SCENE_COMPLEXITY_LEVELS:
+            if scene["complexity"] < limit:
+                weights.append(factor)
+                break
+
+    total = sum(s["end"] - s["start"] for s in scenes)
+    if total <= 0 or len(set(weights)) < 2:
+        return None
+    mean = sum(w * (s["end"] - s["start"]) for w, s in zip(weights, scenes)) / total
+
+    zones = []
+    for weight, scene in zip(weights, scenes):
+        first = int(scene["start"] * fps)
+        last = int(scene["end"] * fps) - 1
+        if last >= first:
+            zones.append(str(first) + "," + str(last) + ",b=" + f"{weight / mean:.2f}")
+    return "zones=" + "/".join(zones) if zones else None
+
+
+def sample_timestamps(duration, count, trim_start=None, trim_end=None):
+    """Titik waktu tersebar merata di dalam rentang yang akan diencode."""
+    start = trim_start or 0.0
+    end = trim_end or duration
+    span = max(end - start, 0.0)
+    return [start + span * (i + 0.5) / count for i in range(count)]
+
+
+def detect_crop_at(input_path, timestamp):
+    """Jalankan cropdetect pada beberapa frame mulai dari satu titik waktu."""
+    try:
+        video = ffmpeg.input(input_path, ss=timestamp).video
+        video = ffmpeg.filter(video, "cropdetect", limit=24, round=2, reset=0)
+        _, err = run_ffmpeg_capture(ffmpeg.output(video, "-", f="null", vframes=CROPDETECT_FRAMES))
+    except ffmpeg.Error:
+        return None
+    found = re.findall(r"crop=(\d+):(\d+):(\d+):(\d+)", err.decode("utf-8", errors="ignore"))
+    return tuple(int(v) for v in found[-1]) if found else None
+
+
+@traced("detect_black_borders")
+def detect_black_borders(input_path, duration, video_metadata, trim_start=None, trim_end=None):
+    """Cari persegi crop yang stabil untuk membuang letterbox/pillarbox.
+
+    cropdetect dijalankan paralel pada beberapa titik waktu dan persegi yang
+    paling sering muncul (selisih sampai CROPDETECT_TOLERANCE piksel dianggap
+    sama) dipakai. Satu adegan gelap tidak boleh menggeser crop, jadi bila
+    persegi itu tidak disepakati mayoritas sampel, video tidak di-crop.
+    Mengembalikan None bila tidak ada bingkai hitam yang berarti.
+    """
+    if duration <= 0 or not video_metadata or not video_metadata.get("width"):
+        return None
+    timestamps = sample_timestamps(duration, CROPDETECT_SAMPLES, trim_start, trim_end)
+    with ThreadPoolExecutor(max_workers=CROPDETECT_SAMPLES) as pool:
+        rects = [r for r in pool.map(lambda t: detect_crop_at(input_path, t), timestamps) if r]
+    if not rects:
+        return None
+
+    def agreeing(rect):
+        return [r for r in rects if all(abs(a - b) <= CROPDETECT_TOLERANCE for a, b in zip(r, rect))]
+
+    best = max(set(rects), key=lambda rect: (len(agreeing(rect)), rects.count(rect)))
+    if len(agreeing(best)) * 2 <= CROPDETECT_SAMPLES:
+        return None
+
+    w, h, x, y = best
+    full_area = video_metadata["width"] * video_metadata["height"]
+    if w <= 0 or h <= 0 or w * h >= full_area * (1 - CROPDETECT_MIN_SAVING):
+        return None
+    return {"w": w, "h": h, "x": x, "y": y}
+
+
+def measure_duplicates_at(input_path, timestamp):
+    """Hitung frame yang dipertahankan dan dibuang mpdecimate dalam satu jendela sampel."""
+    try:
+        video = ffmpeg.input(input_path, ss=timestamp, t=DECIMATE_SAMPLE_SECONDS).video
+        video = ffmpeg.filter(video, "scale", SCENE_ANALYSIS_WIDTH, -2)
+        video = ffmpeg.filter(video, "mpdecimate")
+        output = ffmpeg.output(video, "-", f="null").global_args("-loglevel", "debug")
+        _, err = run_ffmpeg_capture(output)
+    except ffmpeg.Error:
+        return None
+    text = err.decode("utf-8", errors="ignore")
+    return len(re.findall(r" keep pts:", text)), len(re.findall(r" drop pts:", text))
+
+
+@traced("analyze_duplicate_frames")
+def analyze_duplicate_frames(input_path, duration, trim_start=None, trim_end=None):
+    """Perkirakan rasio frame duplikat (0-1) dari beberapa jendela sampel paralel.
+
+    Rekaman layar dan video slide biasanya berisi banyak frame identik;
+    mengembalikan None bila video tidak bisa dianalisis.
+    """
+    if duration <= 0:
+        return None
+    timestamps = sample_timestamps(duration, DECIMATE_SAMPLES, trim_start, trim_end)
+    with ThreadPoolExecutor(max_workers=DECIMATE_SAMPLES) as pool:
+        counts = [c for c in pool.map(lambda t: measure_duplicates_at(input_path, t), timestamps) if c]
+    total = sum(kept + dropped for kept, dropped in counts)
+    if total == 0:
+        return None
+    return sum(dropped for _, dropped in counts) / total
+
+
+def estimate_noise_at(input_path, timestamp, width, height):
+    """Perkiraan sigma noise luma satu frame dengan metode Immerkær.
+
+    Frame dikonvolusi dengan kernel selisih dua laplacian yang meredam
+    struktur gambar, sehingga rata-rata nilai absolutnya sebanding dengan
+    simpangan baku noise (dalam level 8-bit).
+    """
+    try:
+        video = ffmpeg.input(input_path, ss=timestamp).video
+        video = ffmpeg.filter(video, "scale", width, height)
+        out, _ = run_ffmpeg_capture(ffmpeg.output(video, "-", f="rawvideo", pix_fmt="gray", vframes=1))
+    except ffmpeg.Error:
+        return None
+    if len(out) < width * height:
+        return None
+    f = np.frombuffer(out[:width * height], dtype=np.uint8).reshape(height, width).astype(np.float32)
+    residual = (
+        f[:-2, :-2] - 2 * f[:-2, 1:-1] + f[:-2, 2:]
+        - 2 * f[1:-1, :-2] + 4 * f[1:-1, 1:-1] - 2 * f[1:-1, 2:]
+        + f[2:, :-2] - 2 * f[2:, 1:-1] + f[2:, 2:]
+    )
+    return float(np.abs(residual).mean() * math.sqrt(math.pi / 2) / 6)
+
+
+@traced("estimate_source_noise")
+def estimate_source_noise(input_path, duration, video_metadata, trim_start=None, trim_end=None):
+    """Median sigma noise dari beberapa frame sampel paralel, atau None bila tidak bisa dianalisis.
+
+    Frame diperkecil ke DENOISE_ANALYSIS_WIDTH agar batas DENOISE_LEVELS
+    berlaku sama untuk sumber 1080p maupun 4K.
+    """
+    if duration <= 0 or not video_metadata or not video_metadata.get("width"):
+        return None
+    width = min(video_metadata["width"], DENOISE_ANALYSIS_WIDTH) // 2 * 2
+    height = int(video_metadata["height"] * width / video_metadata["width"]) // 2 * 2
+    if width < 16 or height < 16:
+        return None
+    timestamps = sample_timestamps(duration, DENOISE_SAMPLES, trim_start, trim_end)
+    with ThreadPoolExecutor(max_workers=DENOISE_SAMPLES) as pool:
+        sigmas = [v for v in pool.map(lambda t: estimate_noise_at(input_path, t, width, height), timestamps) if v]
+    if not sigmas:
+        return None
+    return float(np.median(sigmas))
+
+
+def denoise_level_for(sigma):
+    """Kekuatan denoise (kunci DENOISE_HQDN3D) sesuai tingkat noise, atau None untuk sumber bersih."""
+    return next(name for limit, name in DENOISE_LEVELS if sigma < limit)
+
+
+def build_denoise_filter(level, preset):
+    """Filter denoise untuk kekuatan dan kecepatan preset ini.
+
+    Hanya nama kekuatan yang dikirim antar fungsi dan ke worker; nama filter
+    dan argumennya selalu dibangun di sini dari tabel konstanta.
+    """
+    if preset in DENOISE_NLMEANS_PRESETS:
+        return {"filter": "nlmeans", "args": {"s": DENOISE_NLMEANS[level], "p": 7, "r": 9}}
+    luma_spatial, chroma_spatial, luma_tmp, chroma_tmp = DENOISE_HQDN3D[level]
+    return {
+        "filter": "hqdn3d",
+        "args": {
+            "luma_spatial": luma_spatial, "chroma_spatial": chroma_spatial,
+            "luma_tmp": luma_tmp, "chroma_tmp": chroma_tmp,
+        },
+    }
+
+
+@traced("measure_denoise_saving")
+def measure_denoise_saving(input_path, duration, denoise, crf, preset, resolution, out_format, aspect_ratio=None,
+                           crop_rect=None, source_size=None, trim_start=None, trim_end=None, niceness=0):
+    """Hemat bitrate (0-1) dari denoise, diukur dengan mengencode klip sampel dengan dan tanpa filter."""
+    start = trim_start or 0.0
+    end = trim_end or duration
+    span = max(end - start, 0.0)
+    if span <= 0:
+        return None
+    sample_seconds = min(DENOISE_SAMPLE_SECONDS, span / DENOISE_SAMPLE_COUNT)
+    windows = [
+        max(t - sample_seconds / 2, start)
+        for t in sample_timestamps(duration, DENOISE_SAMPLE_COUNT, trim_start, trim_end)
+    ]
+    work_dir = tempfile.mkdtemp(prefix="kompres_denoise_")
+
+    def render(job):
+        i, use_denoise = job
+        sample_path = os.path.join(
+            work_dir, str(i) + ("_dn." if use_denoise else ".") + get_output_extension(out_format),
+        )
+        success, _ = compress_video(
+            input_path, sample_path, crf=crf, preset=preset, mute_audio=True, resolution=resolution,
+            trim_start=windows[i], trim_end=windows[i] + sample_seconds, aspect_ratio=aspect_ratio,
+            out_format=out_format, crop_rect=crop_rect, source_size=source_size,
+            denoise=denoise if use_denoise else None, niceness=niceness,
+        )
+        return os.path.getsize(sample_path) if success else None
+
+    try:
+        jobs = [(i, use_denoise) for i in range(len(windows)) for use_denoise in (False, True)]
+        with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+            sizes = list(pool.map(render, jobs))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if None in sizes:
+        return None
+    plain = sum(sizes[0::2])
+    return 1 - sum(sizes[1::2]) / plain if plain else None
+
+
+def build_input_args(trim_start=None, trim_end=None):
+    input_args = {}
+    if trim_start is not None and trim_start > 0:
+        input_args["ss"] = trim_start
+    if trim_end is not None and trim_end > 0:
+        input_args["to"] = trim_end
+    return input_args
+
+
+def apply_video_filters(
+    video, resolution, aspect_ratio=None, target_fps=None, crop_rect=None, decimate=False,
+    source_size=None, scaler="bicubic", denoise=None, source_fps=None,
+):
+    """Terapkan rantai filter minimal: fps, satu crop, denoise, satu scale, lalu mpdecimate.
+
+    fps dipasang paling awal agar frame yang dibuang tidak ikut di-crop dan
+    di-scale. Dengan source_size (lebar, tinggi, SAR) geometri dihitung di
+    muka oleh plan_geometry sehingga crop dan scale memakai angka absolut
+    dan scale dilewati bila tidak perlu; tanpa itu dipakai ekspresi ffmpeg
+    dengan urutan yang sama.
+
+    denoise (hasil build_denoise_filter) dipasang setelah crop dan sebelum scale
+    agar noise dibuang pada resolusi sumber tanpa memproses area yang
+    dibuang crop.
+
+    mpdecimate dipasang di akhir agar frame duplikat hasil konversi fps ikut
+    dibuang; output harus memakai fps_mode vfr supaya muxer tidak
+    menggandakannya kembali. Jeda antar frame dibatasi DECIMATE_MAX_GAP
+    detik (dihitung dari fps target, lalu fps sumber) agar player tetap
+    bisa seek dengan lancar.
+    """
+    if target_fps:
+        video = ffmpeg.filter(video, "fps", fps=target_fps)
+
+    if source_size:
+        width, height, sar = source_size
+        plan = plan_geometry(width, height, resolution, aspect_ratio, crop_rect, sar)
+        if plan["crop"]:
+            video = ffmpeg.filter(video, "crop", *plan["crop"])
+        if denoise:
+            video = ffmpeg.filter(video, denoise["filter"], **denoise["args"])
+        if plan["scale"]:
+            video = ffmpeg.filter(video, "scale", *plan["scale"], flags=scaler)
+            video = ffmpeg.filter(video, "setsar", 1)
+    else:
+        if crop_rect:
+            video = ffmpeg.filter(video, "crop", crop_rect["w"], crop_rect["h"], crop_rect["x"], crop_rect["y"])
+        ratio_map = {"16:9": "16/9", "9:16": "9/16", "1:1": "1", "4:3": "4/3"}
+        if aspect_ratio in ratio_map:
+            r = ratio_map[aspect_ratio]
+            video = ffmpeg.filter(
+                video, "crop",
+                "if(gt(iw/ih," + r + "),ih*" + r + ",iw)",
+                "if(gt(iw/ih," + r + "),ih,iw/(" + r + "))",
+            )
+        if denoise:
+            video = ffmpeg.filter(video, denoise["filter"], **denoise["args"])
+        if resolution in RESOLUTION_MAP:
+            target_h = "trunc(min(ih," + str(RESOLUTION_MAP[resolution]) + ")/2)*2"
+            video = ffmpeg.filter(video, "scale", -2, target_h, flags=scaler)
+        else:
+            video = ffmpeg.filter(video, "scale", "trunc(iw/2)*2", "trunc(ih/2)*2", flags=scaler)
+        video = ffmpeg.filter(video, "setsar", 1)
+
+    if decimate:
+        max_drop = max(int((target_fps or source_fps or DECIMATE_DEFAULT_FPS) * DECIMATE_MAX_GAP), 1)
+        video = ffmpeg.filter(video, "mpdecimate", max=max_drop)
+
+    return video
+
+
+def vp9_tile_columns(resolution, out_width=None):
+    """log2 jumlah kolom tile VP9 untuk lebar output (setiap tile minimal 256 piksel).
+
+    Tanpa out_width, lebar diperkirakan dari tinggi target dengan rasio 16:9.
+    """
+    width = out_width or int(RESOLUTION_MAP.get(resolution, 1080) * 16 / 9)
+    if width < VP9_MIN_TILE_WIDTH * 2:
+        return 0
+    return min(int(math.log2(width / VP9_MIN_TILE_WIDTH)), VP9_MAX_TILE_COLUMNS)
+
+
+def build_image_params(out_format, preset, quality=None):
+    """Parameter encoder WebP animasi (libwebp_anim) atau urutan gambar AVIF (libaom-av1).
+
+    quality 0-100 dipetakan ke -quality WebP atau CRF libaom; preset
+    menentukan compression_level WebP dan usage/cpu-used libaom.
+    """
+    quality = IMAGE_QUALITY_DEFAULT if quality is None else quality
+    if out_format == "webp":
+        return {
+            "vcodec": "libwebp_anim",
+            "quality": quality,
+            "compression_level": WEBP_COMPRESSION_LEVELS.get(preset, 2),
+            "lossless": 0,
+            "loop": 0,
+            "threads": FFMPEG_THREADS,
+        }
+    best, worst = AVIF_CRF_RANGE
+    usage, cpu_used = AVIF_SPEEDS.get(preset, AVIF_SPEEDS["medium"])
+    return {
+        "vcodec": "libaom-av1",
+        "crf": int(round(best + (100 - quality) * (worst - best) / 100)),
+        "b:v": "0",
+        "usage": usage,
+        "cpu-used": cpu_used,
+        "row-mt": 1,
+        "pix_fmt": "yuv420p",
+        "f": "avif",
+        "threads": FFMPEG_THREADS,
+    }
+
+
+def build_encoding_params(
+    out_format, crf, preset, max_bitrate=None, fragmented=False, copy_audio=False, resolution=None, out_width=None,
+):
+    """Parameter encoder video dan audio untuk format MP4 (H.264/HEVC/AV1) atau WebM.
+
+    crf selalu dalam skala x264 (slider UI) dan dipetakan ke skala encoder
+    HEVC/AV1 agar kualitas pada nilai yang sama kurang lebih setara.
+
+    Dengan fragmented=True, MP4 ditulis sebagai fragmented MP4 sehingga bisa
+    diputar selagi encoding berjalan dan tidak perlu pass faststart di akhir.
+    Dengan copy_audio=True, track audio sumber disalin apa adanya.
+
+    Untuk VP9, preset dipetakan ke deadline/cpu-used (VP9_SPEEDS) dan jumlah
+    kolom tile dipilih dari lebar output agar encode bisa paralel.
+    """
+    if out_format == "webm":
+        deadline, cpu_used = VP9_SPEEDS.get(preset, VP9_SPEEDS["medium"])
+        encoding_params = {
+            "vcodec": "libvpx-vp9",
+            "crf": crf,
+            "b:v": "0",
+            "deadline": deadline,
+            "cpu-used": cpu_used,
+            "tile-columns": vp9_tile_columns(resolution, out_width),
+            "frame-parallel": 1,
+            "threads": FFMPEG_THREADS,
+            "row-mt": 1,
+        }
+        if max_bitrate:
+            encoding_params["b:v"] = max_bitrate
+        audio_params = {"c:a": "libopus", "b:a": str(AUDIO_BITRATE_KBPS) + "k", "ac": AUDIO_MAX_CHANNELS}
+    elif out_format == "hevc":
+        encoding_params = {
+            "vcodec": "libx265",
+            "crf": crf + HEVC_CRF_OFFSET,
+            "preset": preset,
+            "movflags": FRAGMENTED_MOVFLAGS if fragmented else "+faststart",
+            "tag:v": "hvc1",
+            "x265-params": "log-level=error",
+            "threads": FFMPEG_THREADS,
+        }
+        encoding_params.update(COLOR_PROFILE)
+        if max_bitrate:
+            encoding_params["maxrate"] = max_bitrate
+            encoding_params["bufsize"] = max_bitrate
+        audio_params = {"c:a": "aac", "b:a": str(AUDIO_BITRATE_KBPS) + "k", "ac": AUDIO_MAX_CHANNELS}
+    elif out_format == "av1":
+        encoding_params = {
+            "vcodec": "libsvtav1",
+            "crf": min(int(round(crf * 1.25 + 4)), 63),
+            "preset": SVTAV1_PRESETS.get(preset, 8),
+            "movflags": FRAGMENTED_MOVFLAGS if fragmented else "+faststart",
+        }
+        encoding_params.update(COLOR_PROFILE)
+        if max_bitrate:
+            encoding_params["maxrate"] = max_bitrate
+        audio_params = {"c:a": "aac", "b:a": str(AUDIO_BITRATE_KBPS) + "k", "ac": AUDIO_MAX_CHANNELS}
+    else:
+        encoding_params = {
+            "vcodec": "libx264",
+            "crf": crf,
+            "preset": preset,
+            "movflags": FRAGMENTED_MOVFLAGS if fragmented else "+faststart",
+            "profile:v": "high",
+            "tune": "film",
+            "threads": FFMPEG_THREADS,
+        }
+        encoding_params.update(COLOR_PROFILE)
+        if max_bitrate:
+            encoding_params["maxrate"] = max_bitrate
+            encoding_params["bufsize"] = max_bitrate
+        audio_params = {"c:a": "aac", "b:a": str(AUDIO_BITRATE_KBPS) + "k", "ac": AUDIO_MAX_CHANNELS}
+    if copy_audio:
+        audio_params = {"c:a": "copy"}
+    return encoding_params, audio_params
+
+
+def run_ffmpeg(
+    output, progress_callback=None, duration_seconds=0, preview_callback=None, size_guard=None, niceness=0,
+):
+    """Jalankan ffmpeg dan laporkan progres dari baris time= di stderr.
+
+    preview_callback dipanggil paling sering setiap PREVIEW_INTERVAL detik
+    dengan detik video yang sudah diencode.
+
+    size_guard adalah dict berisi "limit" (byte). Ukuran akhir diproyeksikan
+    dari baris size= dibagi porsi durasi yang sudah diencode; bila setelah
+    SIZE_PROJECTION_MIN_PROGRESS proyeksi melewati limit dengan margin
+    SIZE_PROJECTION_MARGIN, ffmpeg dihentikan dan proyeksinya disimpan di
+    size_guard["projected"].
+
+    niceness > 0 menjalankan ffmpeg dengan prioritas CPU lebih rendah.
+    """
+    if get_job_trace() is not None:
+        output = output.global_args("-benchmark")
+    cmd = ffmpeg.compile(output, overwrite_output=True)
+
+    if progress_callback and duration_seconds > 0:
+        process = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+            preexec_fn=(lambda: os.nice(niceness)) if niceness else None,
+        )
+        pattern = re.compile(r"time=(\d+):(\d+):(\d+\.\d+)")
+        speed_pattern = re.compile(r"speed=\s*([0-9.]+)x")
+        size_pattern = re.compile(r"size=\s*(\d+)(KiB|kB)")
+        stderr_lines = []
+        start_time = time.time()
+        last_preview = start_time
+
+        try:
+            if process.stderr is not None:
+                for line in iter(process.stderr.readline, ""):
+                    stderr_lines.append(line)
+                    match = pattern.search(line)
+                    if match:
+                        h = float(match.group(1))
+                        m = float(match.group(2))
+                        s = float(match.group(3))
+                        elapsed = h * 3600 + m * 60 + s
+                        pct = min(elapsed / duration_seconds, 1.0)
+                        wall = time.time() - start_time
+                        speed_m = speed_pattern.search(line)
+                        speed_txt = speed_m.group(1) + "x" if speed_m else ""
+                        eta = ""
+                        if pct > 0.01 and wall > 2:
+                            remaining = (wall / pct) * (1 - pct)
+                            eta = format_duration(remaining)
+                        progress_callback(pct, speed_txt, eta)
+                        size_m = size_pattern.search(line)
+                        if size_guard and size_m and pct >= SIZE_PROJECTION_MIN_PROGRESS:
+                            projected = int(size_m.group(1)) * 1024 / pct
+                            if projected > size_guard["limit"] * SIZE_PROJECTION_MARGIN:
+                                size_guard["projected"] = projected
+                                size_guard["encoded_seconds"] = elapsed
+                                process.kill()
+                                process.wait()
+                                return False, (
+                                    "Encoding dihentikan: proyeksi ukuran " + format_filesize(projected)
+                                    + " melebihi batas " + format_filesize(size_guard["limit"])
+                                )
+                        if preview_callback and time.time() - last_preview >= PREVIEW_INTERVAL:
+                            last_preview = time.time()
+                            preview_callback(elapsed)
+        except BaseException:
+            # Rerun Streamlit (mis. pengguna membatalkan atau mengubah pengaturan)
+            # menghentikan script di tengah callback; ikut hentikan ffmpeg.
+            process.kill()
+            process.wait()
+            raise
+
+        process.wait()
+        annotate_ffmpeg_span("".join(stderr_lines))
+        if process.returncode != 0:
+            tail = stderr_lines[-50:] if len(stderr_lines) > 50 else stderr_lines
+            return False, "".join(tail)
+    else:
+        _, err = ffmpeg.run(output, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+        annotate_ffmpeg_span(err.decode("utf-8", errors="ignore"))
+
+    return True, None
+
+
+@traced("encode")
+def compress_video(
+    input_path,
+    output_path,
+    crf,
+    preset,
+    mute_audio,
+    resolution,
+    trim_start=None,
+    trim_end=None,
+    target_fps=None,
+    aspect_ratio=None,
+    max_bitrate=None,
+    progress_callback=None,
+    duration_seconds=0,
+    out_format="mp4",
+    fragmented=False,
+    hls_dir=None,
+    preview_callback=None,
+    copy_audio=False,
+    scene_zones=None,
+    crop_rect=None,
+    decimate=False,
+    out_width=None,
+    two_pass=False,
+    source_size=None,
+    size_guard=None,
+    niceness=0,
+    gif_options=None,
+    image_quality=None,
+    denoise=None,
+    source_fps=None,
+):
+    try:
+        input_args = build_input_args(trim_start, trim_end)
+        gif_options = gif_options or {}
+        # Gambar animasi memakai fps rendah secara default; setiap frame jauh lebih mahal daripada di video
+        if out_format in ANIMATED_IMAGE_FORMATS:
+            target_fps = gif_options.get("fps") or target_fps or GIF_DEFAULT_FPS
+
+        def build_video(stream):
+            stream = apply_video_filters(
+                stream, resolution, aspect_ratio, target_fps, crop_rect, decimate,
+                source_size, SCALER_FLAGS.get(preset, "bicubic"),
+                build_denoise_filter(denoise, preset) if denoise else None, source_fps,
+            )
+            if gif_options.get("width"):
+                stream = stream.filter(
+                    "scale", "min(iw," + str(gif_options["width"]) + ")", -2,
+                    flags=SCALER_FLAGS.get(preset, "bicubic"),
+                )
+            return stream
+
+        source = ffmpeg.input(input_path, **input_args)
+        video = build_video(source.video)
+        audio = source.audio
+
+        # --- GIF output ---
+        if out_format == "gif":
+            dither = gif_options.get("dither", "bayer")
+            dither_args = {"dither": dither, "bayer_scale": 3} if dither == "bayer" else {"dither": dither}
+            if gif_options.get("palette") == "frame":
+                # Palet per frame dalam satu pass: warna lebih akurat, file biasanya lebih besar
+                split = video.split()
+                palette = split[1].filter("palettegen", stats_mode="single")
+                gif_out = ffmpeg.filter([split[0], palette], "paletteuse", new=1, **dither_args)
+            else:
+                # Dua pass dengan rantai filter yang sama: palet global dulu, lalu render memakai palet itu
+                palette_path = output_path + "_palette.png"
+                _temp_files.append(palette_path)
+                palette = ffmpeg.filter(video, "palettegen", stats_mode="diff")
+                with trace_span("gif_palette", palette_path=palette_path):
+                    run_ffmpeg_capture(ffmpeg.output(palette, palette_path, vframes=1))
+                vid2 = build_video(ffmpeg.input(input_path, **input_args).video)
+                palette_in = ffmpeg.input(palette_path)
+                gif_out = ffmpeg.filter([vid2, palette_in], "paletteuse", **dither_args)
+            output = ffmpeg.output(gif_out, output_path, an=None, loop=0)
+            with trace_span("gif_render", output_path=output_path):
+                run_ffmpeg_capture(output)
+            return True, None
+
+        # --- WebP animasi / AVIF sequence ---
+        if out_format in ANIMATED_IMAGE_FORMATS:
+            output = ffmpeg.output(video, output_path, an=None, **build_image_params(out_format, preset, image_quality))
+            return run_ffmpeg(output, progress_callback, duration_seconds, niceness=niceness)
+
+        # --- MP4 H.264 / WebM VP9 output ---
+        encoding_params, audio_params = build_encoding_params(
+            out_format, crf, preset, max_bitrate, fragmented or bool(hls_dir), copy_audio, resolution, out_width,
+        )
+        if scene_zones and out_format == "mp4":
+            encoding_params["x264-params"] = scene_zones
+        if decimate:
+            encoding_params["fps_mode"] = "vfr"
+        target = output_path
+        if hls_dir and get_output_extension(out_format) == "mp4":
+            # Satu encode, dua muxer: fragmented MP4 dan playlist HLS fMP4
+            os.makedirs(hls_dir, exist_ok=True)
+            movflags = encoding_params.pop("movflags")
+            encoding_params["f"] = "tee"
+            encoding_params["flags"] = "+global_header"
+            encoding_params["force_key_frames"] = "expr:gte(t,n_forced*" + str(HLS_SEGMENT_SECONDS) + ")"
+            target = (
+                "[movflags=" + movflags + "]" + output_path
+                + "|[f=hls:hls_time=" + str(HLS_SEGMENT_SECONDS)
+                + ":hls_playlist_type=event:hls_segment_type=fmp4"
+                + ":hls_segment_filename=" + os.path.join(hls_dir, "segment_%04d.m4s")
+                + "]" + os.path.join(hls_dir, "index.m3u8")
+            )
+        if two_pass and out_format == "webm":
+            # Pass pertama hanya mengumpulkan statistik; setiap pass mendapat separuh progress bar
+            passlog = output_path + "_2pass"
+            _temp_files.append(passlog + "-0.log")
+            first_params = dict(encoding_params, **{"pass": 1, "passlogfile": passlog})
+            first_params["cpu-used"] = max(first_params["cpu-used"], VP9_FIRST_PASS_CPU_USED)
+            first_pass = ffmpeg.output(video, os.devnull, f="null", an=None, **first_params)
+            first_progress = None
+            if progress_callback:
+                first_progress = lambda pct, speed="", eta="": progress_callback(pct / 2, speed, "")
+                second_callback = progress_callback
+                progress_callback = lambda pct, speed="", eta="": second_callback(0.5 + pct / 2, speed, eta)
+            with trace_span("vp9_first_pass", passlog=passlog):
+                success, error = run_ffmpeg(first_pass, first_progress, duration_seconds, niceness=niceness)
+            if not success:
+                return False, error
+            encoding_params.update({"pass": 2, "passlogfile": passlog})
+
+        if mute_audio:
+            output = ffmpeg.output(video, target, an=None, **encoding_params)
+        elif two_pass and out_format == "webm":
+            # Log pass pertama dinamai menurut indeks stream output; video harus stream 0
+            output = ffmpeg.output(video, audio, target, **audio_params, **encoding_params)
+        else:
+            output = ffmpeg.output(audio, video, target, **audio_params, **encoding_params)
+
+        return run_ffmpeg(output, progress_callback, duration_seconds, preview_callback, size_guard, niceness)
+
+    except ffmpeg.Error as err:
+        error_detail = err.stderr.decode("utf-8") if err.stderr else "Proses encoding gagal"
+        return False, error_detail
+
+
+@traced("encode_multi")
+def compress_video_multi(
+    input_path,
+    targets,
+    mute_audio,
+    trim_start=None,
+    trim_end=None,
+    progress_callback=None,
+    duration_seconds=0,
+    out_format="mp4",
+    fragmented=False,
+    copy_audio=False,
+    crop_rect=None,
+    decimate=False,
+    source_size=None,
+    denoise=None,
+    source_fps=None,
+):
+    """Encode beberapa target platform sekaligus dengan satu kali decode.
+
+    Setiap target adalah dict berisi output_path, crf, preset, resolution,
+    fps, aspect, dan max_bitrate. Stream video didecode (dan di-denoise)
+    sekali lalu dipecah dengan filter split ke rantai scale/crop/fps
+    masing-masing target.
+    """
+    if out_format not in MULTI_OUTPUT_FORMATS:
+        return False, "Format " + out_format + " tidak mendukung ekspor multi platform."
+    try:
+        source = ffmpeg.input(input_path, **build_input_args(trim_start, trim_end))
+        video = source.video
+        if denoise:
+            # Satu denoise untuk semua target; nlmeans hanya bila semua preset target memang lambat
+            fastest = min((t["preset"] for t in targets), key=lambda p: PRESET_COSTS.get(p, 1.0))
+            spec = build_denoise_filter(denoise, fastest)
+            video = ffmpeg.filter(video, spec["filter"], **spec["args"])
+        branches = video.split()
+        outputs = []
+        for i, target in enumerate(targets):
+            video = apply_video_filters(
+                branches[i], target["resolution"], target.get("aspect"), target.get("fps"), crop_rect, decimate,
+                source_size, SCALER_FLAGS.get(target["preset"], "bicubic"), source_fps=source_fps,
+            )
+            encoding_params, audio_params = build_encoding_params(
+                out_format, target["crf"], target["preset"], target.get("max_bitrate"),
+                fragmented, copy_audio, target["resolution"], target.get("out_width"),
+            )
+            if decimate:
+                encoding_params["fps_mode"] = "vfr"
+            if mute_audio:
+                outputs.append(ffmpeg.output(video, target["output_path"], an=None, **encoding_params))
+            else:
+                outputs.append(ffmpeg.output(
+                    source.audio, video, target["output_path"], **audio_params, **encoding_params
+                ))
+
+        return run_ffmpeg(ffmpeg.merge_outputs(*outputs), progress_callback, duration_seconds)
+
+    except ffmpeg.Error as err:
+        error_detail = err.stderr.decode("utf-8") if err.stderr else "Proses encoding gagal"
+        return False, error_detail
+
+
+def split_keyframe_segments(input_path, segment_dir, segment_seconds=WORKER_SEGMENT_SECONDS, index=None,
+                            trim_start=None, trim_end=None):
+    """Potong stream video per keyframe tanpa re-encode.
+
+    Dengan indeks packet, batas segmen dihitung di muka dari daftar keyframe
+    dan hanya rentang trim (dibulatkan ke keyframe) yang dibaca. Mengembalikan
+    list dict berisi path, start, dan end segmen (detik pada timeline sumber).
+    """
+    os.makedirs(segment_dir, exist_ok=True)
+    list_path = os.path.join(segment_dir, "segments.csv")
+    input_args = {}
+    segment_args = {"segment_time": segment_seconds}
+    offset = 0.0
+    if index is not None:
+        offset, cuts, end = keyframe_segment_times(index, segment_seconds, trim_start, trim_end)
+        input_args = build_input_args(offset, end)
+        if cuts:
+            segment_args = {
+                "segment_times": ",".join(f"{t - offset - KEYFRAME_SEEK_EPSILON:.3f}" for t in cuts),
+            }
+    output = ffmpeg.output(
+        ffmpeg.input(input_path, **input_args)["v:0"],
+        os.path.join(segment_dir, "seg_%04d.mkv"),
+        c="copy",
+        f="segment",
+        segment_format="matroska",
+        reset_timestamps=1,
+        segment_list=list_path,
+        segment_list_type="csv",
+        **segment_args
+    )
+    run_ffmpeg_capture(output)
+    segments = []
+    with open(list_path, "r") as f:
+        for line in f:
+            name, start, end = line.strip().rsplit(",", 2)
+            segments.append({
+                "path": os.path.join(segment_dir, name),
+                "start": float(start) + offset,
+                "end": float(end) + offset,
+            })
+    return segments
+
+
+def build_segment_tasks(segments, segment_dir, job, trim_start=None, trim_end=None):
+    """Tugas encode per segmen keyframe dengan trim relatif terhadap awal segmen."""
+    tasks = []
+    for i, segment in enumerate(segments):
+        length = segment["end"] - segment["start"]
+        seg_start = max((trim_start or 0) - segment["start"], 0)
+        seg_end = trim_end - segment["start"] if trim_end else length
+        if seg_start >= length or seg_end <= 0:
+            continue
+        seg_job = dict(job)
+        seg_job["trim_start"] = seg_start or None
+        seg_job["trim_end"] = seg_end if seg_end < length else None
+        tasks.append({
+            "index": i,
+            "path": segment["path"],
+            "job": seg_job,
+            "output": os.path.join(segment_dir, "enc_" + str(i).zfill(4) + "." + get_output_extension(job["out_format"])),
+            "seconds": min(seg_end, length) - seg_start,
+        })
+    return tasks
+
+
+def join_encoded_segments(tasks, input_path, output_path, crf, preset, max_bitrate, out_format, fragmented,
+                          copy_audio, mute_audio, trim_start, trim_end):
+    """Gabungkan segmen hasil encode dan encode audio sumber sekali untuk seluruh video."""
+    encoding_params, audio_params = build_encoding_params(
+        out_format, crf, preset, max_bitrate, fragmented, copy_audio,
+    )
+    container_params = {k: v for k, v in encoding_params.items() if k in ("movflags", "tag:v")}
+    audio = None
+    if not mute_audio:
+        audio = ffmpeg.input(input_path, **build_input_args(trim_start, trim_end)).audio
+    with trace_span("join_segments"):
+        join_segments(
+            [task["output"] for task in tasks], output_path, audio,
+            audio_params if audio is not None else None, container_params,
+        )
+
+
+def join_segments(segment_paths, output_path, audio=None, audio_params=None, container_params=None):
+    """Gabungkan segmen video hasil encode dengan concat demuxer, plus audio opsional."""
+    list_path = output_path + "_concat.txt"
+    with open(list_path, "w") as f:
+        for path in segment_paths:
+            f.write("file '" + path.replace("'", "'\\''") + "'\n")
+    try:
+        streams = [ffmpeg.input(list_path, f="concat", safe=0).video]
+        if audio is not None:
+            streams.append(audio)
+        output = ffmpeg.output(
+            *streams, output_path, vcodec="copy", **(audio_params or {}), **(container_params or {})
+        )
+        run_ffmpeg_capture(output)
+    finally:
+        os.unlink(list_path)
+
+
+def check_worker_health(worker_url):
+    try:
+        with urllib.request.urlopen(worker_url + "/health", timeout=WORKER_HEARTBEAT_INTERVAL) as response:
+            return response.status == 200
+    except (OSError, http.client.HTTPException):
+        return False
+
+
+def check_secret(provided):
+    """Cocokkan shared secret dari header request dengan KOMPRES_SECRET (waktu konstan)."""
+    if not SHARED_SECRET:
+        return True
+    return hmac.compare_digest((provided or "").encode("utf-8"), SHARED_SECRET.encode("utf-8"))
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def validate_worker_job(job):
+    """Periksa tipe dan rentang parameter job dari coordinator sebelum diteruskan ke compress_video.
+
+    Return pesan error, atau None bila job valid.
+    """
+    def optional_number(v):
+        return v is None or (is_number(v) and v >= 0)
+
+    def optional_int(v):
+        return v is None or (isinstance(v, int) and not isinstance(v, bool) and v > 0)
+
+    checks = {
+        "crf": lambda v: isinstance(v, int) and not isinstance(v, bool) and 0 <= v <= 63,
+        "preset": lambda v: v in SPEED_OPTIONS,
+        "resolution": lambda v: v == "original" or v in RESOLUTION_MAP,
+        "trim_start": optional_number,
+        "trim_end": optional_number,
+        "target_fps": optional_number,
+        "source_fps": optional_number,
+        "aspect_ratio": lambda v: v is None or v in ASPECT_RATIOS.values(),
+        "max_bitrate": lambda v: v is None or (isinstance(v, str) and WORKER_BITRATE_PATTERN.match(v) is not None),
+        "out_format": lambda v: v in FORMAT_ENCODERS,
+        "crop_rect": lambda v: v is None or (
+            isinstance(v, dict) and sorted(v) == ["h", "w", "x", "y"]
+            and all(isinstance(n, int) and not isinstance(n, bool) and n >= 0 for n in v.values())
+        ),
+        "decimate": lambda v: isinstance(v, bool),
+        "two_pass": lambda v: isinstance(v, bool),
+        "out_width": optional_int,
+        "denoise": lambda v: v is None or v in DENOISE_HQDN3D,
+        "source_size": lambda v: v is None or (
+            isinstance(v, list) and len(v) == 3 and all(is_number(n) and n > 0 for n in v)
+        ),
+    }
+    for key in ["crf", "preset", "resolution"]:
+        if key not in job:
+            return "parameter " + key + " wajib diisi"
+    for key, check in checks.items():
+        if key in job and not check(job[key]):
+            return "parameter " + key + " tidak valid"
+    return None
+
+
+def post_segment(worker_url, segment_path, job, result_path):
+    """Kirim satu segmen ke worker dan simpan hasil encode ke result_path."""
+    with open(segment_path, "rb") as f:
+        request = urllib.request.Request(
+            worker_url + "/encode",
+            data=f,
+            method="POST",
+            headers={
+                "Content-Type": "application/octet-stream",
+                "Content-Length": str(os.path.getsize(segment_path)),
+                "X-Kompres-Job": json.dumps(job),
+                WORKER_SECRET_HEADER: SHARED_SECRET,
+            },
+        )
+        with urllib.request.urlopen(request, timeout=WORKER_REQUEST_TIMEOUT) as response:
+            with open(result_path, "wb") as out:
+                shutil.copyfileobj(response, out)
+
+
+def dispatch_segments(tasks, workers, progress_callback=None, duration_seconds=0):
+    """Bagikan task segmen ke worker dengan heartbeat dan penugasan ulang.
+
+    Worker yang gagal menjawab heartbeat WORKER_MAX_MISSED kali berturut-turut,
+    atau yang koneksinya putus, dianggap mati dan segmen yang sedang
+    dikerjakannya dikembalikan ke antrean. Mengembalikan (set indeks task
+    yang selesai, pesan error dari worker atau None).
+    """
+    pending = queue.Queue()
+    for index in range(len(tasks)):
+        pending.put(index)
+    lock = threading.Lock()
+    stop = threading.Event()
+    done = set()
+    inflight = {}
+    alive = {url: True for url in workers}
+    errors = []
+
+    def mark_dead(url):
+        with lock:
+            if not alive[url]:
+                return
+            alive[url] = False
+            index = inflight.pop(url, None)
+            if index is not None and index not in done:
+                pending.put(index)
+
+    def heartbeat():
+        missed = {url: 0 for url in workers}
+        while not stop.wait(WORKER_HEARTBEAT_INTERVAL):
+            for url in workers:
+                if not alive[url]:
+                    continue
+                missed[url] = 0 if check_worker_health(url) else missed[url] + 1
+                if missed[url] >= WORKER_MAX_MISSED:
+                    mark_dead(url)
+
+    def run_worker(url):
+        while not stop.is_set() and alive[url]:
+            try:
+                index = pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with lock:
+                if index in done:
+                    continue
+                if not alive[url]:
+                    pending.put(index)
+                    return
+                inflight[url] = index
+            task = tasks[index]
+            partial_path = task["output"] + "." + uuid.uuid4().hex[:8] + ".part"
+            try:
+                post_segment(url, task["path"], task["job"], partial_path)
+            except urllib.error.HTTPError as err:
+                # Worker hidup tapi encode gagal: worker lain akan gagal juga
+                errors.append(err.read().decode("utf-8", errors="ignore") or str(err))
+                stop.set()
+                return
+            except (OSError, http.client.HTTPException):
+                if os.path.exists(partial_path):
+                    os.unlink(partial_path)
+                mark_dead(url)
+                return
+            with lock:
+                if inflight.get(url) == index:
+                    del inflight[url]
+                if index in done:
+                    os.unlink(partial_path)
+                    continue
+                os.replace(partial_path, task["output"])
+                done.add(index)
+                if len(done) == len(tasks):
+                    stop.set()
+
+    threads = [threading.Thread(target=heartbeat, daemon=True)]
+    threads += [threading.Thread(target=run_worker, args=(url,), daemon=True) for url in workers]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while not stop.wait(0.5):
+            if not any(alive.values()):
+                break
+            if progress_callback and duration_seconds > 0:
+                with lock:
+                    encoded = sum(tasks[i]["seconds"] for i in done)
+                progress_callback(min(encoded / duration_seconds, 1.0))
+    finally:
+        # Request yang masih berjalan ke worker mati dibiarkan habis oleh timeout
+        stop.set()
+
+    return set(done), (errors[0] if errors else None)
+
+
+@traced("encode_distributed")
+def compress_video_distributed(
+    input_path,
+    output_path,
+    crf,
+    preset,
+    mute_audio,
+    resolution,
+    trim_start=None,
+    trim_end=None,
+    target_fps=None,
+    aspect_ratio=None,
+    max_bitrate=None,
+    progress_callback=None,
+    duration_seconds=0,
+    out_format="mp4",
+    fragmented=False,
+    copy_audio=False,
+    crop_rect=None,
+    decimate=False,
+    out_width=None,
+    two_pass=False,
+    source_size=None,
+    denoise=None,
+    source_fps=None,
+    workers=None,
+):
+    """Encode video terdistribusi di beberapa worker node (lihat worker.py).
+
+    Stream video dipotong per keyframe tanpa re-encode, setiap segmen
+    diencode worker lewat HTTP dengan trim relatif terhadap segmen, lalu
+    hasilnya digabung dengan concat demuxer dan audio diencode sekali di
+    sini. Segmen yang tidak selesai karena semua worker mati diencode lokal.
+    """
+    workers = workers or WORKER_NODES
+    segment_dir = output_path + "_segments"
+    try:
+        with trace_span("split_segments"):
+            segments = split_keyframe_segments(
+                input_path, segment_dir, index=load_packet_index(input_path), trim_start=trim_start, trim_end=trim_end,
+            )
+
+        tasks = build_segment_tasks(segments, segment_dir, {
+            "crf": crf,
+            "preset": preset,
+            "resolution": resolution,
+            "target_fps": target_fps,
+            "aspect_ratio": aspect_ratio,
+            "max_bitrate": max_bitrate,
+            "out_format": out_format,
+            "crop_rect": crop_rect,
+            "decimate": decimate,
+            "out_width": out_width,
+            "two_pass": two_pass,
+            "source_size": source_size,
+            "denoise": denoise,
+            "source_fps": source_fps,
+        }, trim_start, trim_end)
+
+        with trace_span("dispatch_segments", segments=len(tasks), workers=len(workers)):
+            done, error = dispatch_segments(tasks, workers, progress_callback, duration_seconds)
+        if error:
+            return False, error
+
+        for index in range(len(tasks)):
+            if index in done:
+                continue
+            task = tasks[index]
+            with trace_span("local_segment", index=index):
+                success, error = compress_video(task["path"], task["output"], mute_audio=True, **task["job"])
+            if not success:
+                return False, error
+
+        join_encoded_segments(
+            tasks, input_path, output_path, crf, preset, max_bitrate, out_format, fragmented, copy_audio,
+            mute_audio, trim_start, trim_end,
+        )
+        return True, None
+
+    except ffmpeg.Error as err:
+        error_detail = err.stderr.decode("utf-8") if err.stderr else "Proses encoding gagal"
+        return False, error_detail
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+
+def should_checkpoint(duration, preset, out_format, hls=False, scene_zones=None):
+    """Apakah encode tunggal cukup lama untuk dijalankan per segmen dengan checkpoint."""
+    return (
+        not hls and not scene_zones and out_format not in ANIMATED_IMAGE_FORMATS
+        and duration >= 2 * CHECKPOINT_SEGMENT_SECONDS
+        and estimate_job_cost(duration, [preset]) >= CHECKPOINT_MIN_COST
+    )
+
+
+def checkpoint_job_id(input_path, job):
+    """ID job checkpoint; sama untuk file sesi dan parameter encode yang sama agar bisa dilanjutkan."""
+    payload = os.path.basename(input_path) + "\n" + json.dumps(job, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def list_checkpoints():
+    """Semua manifest encode yang belum selesai, per input_key file sesi."""
+    storage = get_storage()
+    now = time.time()
+    checkpoints = {}
+    for key, mtime in storage.list(CHECKPOINT_PREFIX):
+        if not key.endswith(".json") or now - mtime > CHECKPOINT_MAX_AGE:
+            continue
+        manifest = storage.get_json(key)
+        if manifest and manifest.get("input_key"):
+            checkpoints.setdefault(manifest["input_key"], manifest)
+    return checkpoints
+
+
+def find_checkpoint(input_key):
+    """Manifest encode yang belum selesai untuk file sesi ini, atau None."""
+    return list_checkpoints().get(input_key)
+
+
+def pin_session_files(paths):
+    """Jangan hapus file ini saat proses berhenti; encode yang terputus masih membutuhkannya."""
+    for path in paths:
+        while path in _temp_files:
+            _temp_files.remove(path)
+
+
+@traced("encode_checkpointed")
+def compress_video_checkpointed(
+    input_path,
+    output_path,
+    crf,
+    preset,
+    mute_audio,
+    resolution,
+    trim_start=None,
+    trim_end=None,
+    target_fps=None,
+    aspect_ratio=None,
+    max_bitrate=None,
+    progress_callback=None,
+    duration_seconds=0,
+    out_format="mp4",
+    fragmented=False,
+    copy_audio=False,
+    crop_rect=None,
+    decimate=False,
+    out_width=None,
+    two_pass=False,
+    source_size=None,
+    denoise=None,
+    source_fps=None,
+    meta_key=None,
+    size_limit_mb=None,
+    output_name=None,
+):
+    """Encode panjang per segmen keyframe dengan manifest job di storage sesi.
+
+    Setiap segmen yang selesai disimpan ke storage dan dicatat di manifest.
+    Bila server restart di tengah encode, menjalankan job yang sama (file
+    sesi dan parameter sama) hanya mengencode segmen yang belum selesai,
+    lalu semua segmen digabung dan audio diencode sekali dari sumber.
+    Semua parameter panggilan, batas ukuran, dan nama unduhan ikut dicatat
+    agar resume_checkpoint bisa melanjutkan job tanpa pengaturan ulang.
+    """
+    job = {
+        "crf": crf,
+        "preset": preset,
+        "resolution": resolution,
+        "target_fps": target_fps,
+        "aspect_ratio": aspect_ratio,
+        "max_bitrate": max_bitrate,
+        "out_format": out_format,
+        "crop_rect": crop_rect,
+        "decimate": decimate,
+        "out_width": out_width,
+        "two_pass": two_pass,
+        "source_size": source_size,
+        "denoise": denoise,
+        "source_fps": source_fps,
+    }
+    job_id = checkpoint_job_id(input_path, dict(
+        job, trim_start=trim_start, trim_end=trim_end, mute_audio=mute_audio, copy_audio=copy_audio,
+        fragmented=fragmented,
+    ))
+    manifest_key = CHECKPOINT_PREFIX + job_id + ".json"
+    storage = get_storage()
+    pin_session_files([input_path, os.path.join(SESSION_DIR, meta_key)] if meta_key else [input_path])
+    segment_dir = output_path + "_segments"
+    try:
+        # Batas segmen harus sama di setiap percobaan agar segmen di manifest bisa dipakai ulang,
+        # jadi indeks ditunggu (atau dibangun) di sini, tidak bergantung pada indexer background
+        with trace_span("split_segments"):
+            segments = split_keyframe_segments(
+                input_path, segment_dir, CHECKPOINT_SEGMENT_SECONDS, ensure_packet_index(input_path),
+                trim_start, trim_end,
+            )
+        tasks = build_segment_tasks(segments, segment_dir, job, trim_start, trim_end)
+        bounds = [[round(s["start"], 3), round(s["end"], 3)] for s in segments]
+
+        manifest = storage.get_json(manifest_key)
+        # Segmen tersimpan hanya dipakai bila batas segmennya sama persis
+        if manifest is None or manifest.get("bounds") != bounds:
+            manifest = {
+                "job_id": job_id,
+                "input_key": os.path.basename(input_path),
+                "meta_key": meta_key,
+                "job": job,
+                "params": {
+                    "trim_start": trim_start,
+                    "trim_end": trim_end,
+                    "mute_audio": mute_audio,
+                    "copy_audio": copy_audio,
+                    "fragmented": fragmented,
+                    "duration_seconds": duration_seconds,
+                },
+                "size_limit_mb": size_limit_mb,
+                "output_name": output_name,
+                "segments": len(tasks),
+                "bounds": bounds,
+                "done": {},
+                "created": time.time(),
+            }
+            storage.put_json(manifest_key, manifest)
+
+        total = sum(task["seconds"] for task in tasks) or 1
+        done_seconds = 0.0
+        for task in tasks:
+            done_key = manifest["done"].get(str(task["index"]))
+            if done_key and storage.exists(done_key):
+                with trace_span("restore_segment", index=task["index"]):
+                    storage.fetch(done_key, task["output"])
+                done_seconds += task["seconds"]
+        if progress_callback and done_seconds:
+            progress_callback(done_seconds / total)
+
+        for task in tasks:
+            if manifest["done"].get(str(task["index"])) and os.path.exists(task["output"]):
+                continue
+
+            def on_segment_progress(pct, speed="", eta="", task=task, offset=done_seconds):
+                # ETA ffmpeg hanya untuk segmen ini, jadi tidak diteruskan
+                if progress_callback:
+                    progress_callback((offset + pct * task["seconds"]) / total, speed)
+
+            with trace_span("checkpoint_segment", index=task["index"]):
+                success, error = compress_video(
+                    task["path"], task["output"], mute_audio=True, progress_callback=on_segment_progress,
+                    duration_seconds=task["seconds"], **task["job"]
+                )
+            if not success:
+                return False, error
+            done_key = CHECKPOINT_PREFIX + job_id + "_" + str(task["index"]).zfill(4) + "." + get_output_extension(out_format)
+            storage.put_file(done_key, task["output"])
+            manifest["done"][str(task["index"])] = done_key
+            manifest["updated"] = time.time()
+            storage.put_json(manifest_key, manifest)
+            touch_session_meta(storage, meta_key)
+            done_seconds += task["seconds"]
+
+        join_encoded_segments(
+            tasks, input_path, output_path, crf, preset, max_bitrate, out_format, fragmented, copy_audio,
+            mute_audio, trim_start, trim_end,
+        )
+        for done_key in manifest["done"].values():
+            storage.delete(done_key)
+        storage.delete(manifest_key)
+        return True, None
+
+    except ffmpeg.Error as err:
+        error_detail = err.stderr.decode("utf-8") if err.stderr else "Proses encoding gagal"
+        return False, error_detail
+    except OSError as err:
+        # Storage sesi (S3) gagal atau disk penuh; segmen yang sudah tercatat tetap bisa dilanjutkan nanti
+        return False, "Gagal menyimpan checkpoint encode: " + str(err)
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+
+def gif_ladder_options(index):
+    fps, width, dither, palette = GIF_SIZE_LADDER[index]
+    return {"fps": fps, "width": width, "dither": dither, "palette": palette}
+
+
+def describe_gif_options(options):
+    return (
+        str(options["fps"]) + " fps, lebar maks " + str(options["width"]) + " px, dithering "
+        + options["dither"] + ", palet " + ("per frame" if options["palette"] == "frame" else "global")
+    )
+
+
+@traced("plan_gif_size")
+def plan_gif_for_size(input_path, duration, limit_bytes, resolution, aspect_ratio=None, crop_rect=None,
+                      source_size=None, decimate=False, trim_start=None, trim_end=None, source_fps=None,
+                      niceness=0):
+    """Cari pengaturan GIF berkualitas tertinggi yang diperkirakan muat di bawah limit_bytes.
+
+    Setiap kandidat di GIF_SIZE_LADDER dirender pada beberapa klip sampel
+    pendek, lalu ukuran per detiknya diproyeksikan ke seluruh durasi. Tangga
+    ditelusuri dengan binary search karena ukuran turun di setiap anak
+    tangga. Return {"options", "predicted"}; bila anak tangga terakhir pun
+    masih terlalu besar, itulah yang dikembalikan.
+    """
+    start = trim_start or 0.0
+    end = trim_end or duration
+    span = max(end - start, 0.0)
+    if span <= 0:
+        return None
+    sample_seconds = min(GIF_SAMPLE_SECONDS, span / GIF_SAMPLE_COUNT)
+    windows = [
+        max(t - sample_seconds / 2, start) for t in sample_timestamps(duration, GIF_SAMPLE_COUNT, trim_start, trim_end)
+    ]
+    work_dir = tempfile.mkdtemp(prefix="kompres_gifplan_")
+    predictions = {}
+
+    def predict(index):
+        if index in predictions:
+            return predictions[index]
+        options = gif_ladder_options(index)
+
+        def render(i):
+            sample_path = os.path.join(work_dir, str(index) + "_" + str(i) + ".gif")
+            success, _ = compress_video(
+                input_path, sample_path, crf=0, preset="medium", mute_audio=True, resolution=resolution,
+                trim_start=windows[i], trim_end=windows[i] + sample_seconds, aspect_ratio=aspect_ratio,
+                out_format="gif", crop_rect=crop_rect, decimate=decimate, source_size=source_size,
+                gif_options=options, source_fps=source_fps, niceness=niceness,
+            )
+            return os.path.getsize(sample_path) if success else None
+
+        with ThreadPoolExecutor(max_workers=GIF_SAMPLE_COUNT) as pool:
+            sizes = [size for size in pool.map(render, range(len(windows))) if size]
+        predictions[index] = sum(sizes) / (len(sizes) * sample_seconds) * span if sizes else None
+        return predictions[index]
+
+    try:
+        budget = limit_bytes * GIF_SIZE_SAFETY
+        low, high = 0, len(GIF_SIZE_LADDER) - 1
+        best = None
+        while low <= high:
+            mid = (low + high) // 2
+            predicted = predict(mid)
+            if predicted is None:
+                return None
+            if predicted <= budget:
+                best = mid
+                high = mid - 1
+            else:
+                low = mid + 1
+        if best is None:
+            best = len(GIF_SIZE_LADDER) - 1
+        return {"options": gif_ladder_options(best), "predicted": predict(best)}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def should_distribute(duration, out_format, hls=False, scene_zones=None):
+    """Apakah encode tunggal dikirim ke worker node lewat compress_video_distributed."""
+    return (
+        bool(WORKER_NODES) and not hls and not scene_zones and out_format not in ANIMATED_IMAGE_FORMATS
+        and duration >= WORKER_MIN_DURATION
+    )
+
+
+def plan_encode(input_path, video_metadata, settings, advanced, multi=False, size_limit_mb=None, niceness=0):
+    """Analisis sebelum encode: durasi efektif, audio, bitrate, bingkai hitam, frame duplikat, noise, adegan, dan GIF.
+
+    niceness diteruskan ke encode sampel denoise dan GIF (kerja spekulatif).
+    """
+    out_fmt = settings.get("out_format", "mp4")
+    duration = video_metadata.get("duration", 0) if video_metadata else 0
+    total_duration = duration
+    if advanced.get("trim_start") or advanced.get("trim_end"):
+        start = advanced.get("trim_start") or 0
+        end = advanced.get("trim_end") or duration
+        total_duration = max(end - start, 0)
+
+    # Audio passthrough: salin track yang sudah sesuai format tujuan
+    copy_audio = not settings["mute_audio"] and can_copy_audio(video_metadata, out_fmt)
+    audio_kbps = video_metadata["audio_bitrate"] if copy_audio else AUDIO_BITRATE_KBPS
+    has_audio = (
+        bool(video_metadata and video_metadata.get("has_audio")) and not settings["mute_audio"]
+        and out_fmt not in ANIMATED_IMAGE_FORMATS
+    )
+
+    # Smart compression: hitung bitrate dari target ukuran (gambar animasi tidak punya kontrol bitrate)
+    max_bitrate = advanced.get("max_bitrate")
+    if settings.get("smart_target_mb") and total_duration > 0 and out_fmt not in ANIMATED_IMAGE_FORMATS:
+        smart_br = calculate_target_bitrate(settings["smart_target_mb"], total_duration, has_audio, audio_kbps)
+        if smart_br:
+            max_bitrate = smart_br
+
+    crop_rect = None
+    if advanced.get("auto_crop"):
+        crop_rect = detect_black_borders(
+            input_path, duration, video_metadata, advanced.get("trim_start"), advanced.get("trim_end"),
+        )
+
+    duplicate_ratio = None
+    if advanced.get("auto_decimate"):
+        duplicate_ratio = analyze_duplicate_frames(
+            input_path, duration, advanced.get("trim_start"), advanced.get("trim_end"),
+        )
+    decimate = duplicate_ratio is not None and duplicate_ratio >= DECIMATE_MIN_RATIO
+
+    # Denoise hanya dipakai bila noise terukur dan encode sampel membuktikan bitratenya turun
+    noise_sigma = None
+    denoise = None
+    denoise_saving = None
+    if advanced.get("auto_denoise") and out_fmt not in ANIMATED_IMAGE_FORMATS:
+        noise_sigma = estimate_source_noise(
+            input_path, duration, video_metadata, advanced.get("trim_start"), advanced.get("trim_end"),
+        )
+        candidate = denoise_level_for(noise_sigma) if noise_sigma is not None else None
+        if candidate:
+            denoise_saving = measure_denoise_saving(
+                input_path, duration, candidate, settings["crf"], settings["preset"], settings["resolution"],
+                out_fmt, advanced.get("aspect_ratio"), crop_rect, get_source_size(video_metadata),
+                advanced.get("trim_start"), advanced.get("trim_end"), niceness,
+            )
+            if denoise_saving is not None and denoise_saving >= DENOISE_MIN_SAVING:
+                denoise = candidate
+
+    scenes = []
+    scene_zones = None
+    # Zona x264 memakai nomor frame, tidak lagi cocok setelah frame duplikat dibuang
+    if advanced.get("scene_aware") and out_fmt == "mp4" and not multi and not decimate:
+        scenes = analyze_scenes(input_path, advanced.get("trim_start"), advanced.get("trim_end"))
+        zone_fps = advanced.get("target_fps") or (video_metadata.get("fps") if video_metadata else None)
+        scene_zones = build_scene_zones(scenes, zone_fps)
+
+    # GIF tidak punya bitrate; batas ukuran dicapai lewat fps, lebar, dithering, dan palet
+    gif_plan = None
+    if out_fmt == "gif" and size_limit_mb and total_duration > 0 and not multi:
+        gif_plan = plan_gif_for_size(
+            input_path, duration, size_limit_mb * 1024 * 1024, settings["resolution"],
+            advanced.get("aspect_ratio"), crop_rect, get_source_size(video_metadata), decimate,
+            advanced.get("trim_start"), advanced.get("trim_end"), get_source_fps(video_metadata), niceness,
+        )
+
+    return {
+        "duration": total_duration,
+        "copy_audio": copy_audio,
+        "audio_kbps": audio_kbps,
+        "has_audio": has_audio,
+        "max_bitrate": max_bitrate,
+        "crop_rect": crop_rect,
+        "duplicate_ratio": duplicate_ratio,
+        "decimate": decimate,
+        "noise_sigma": noise_sigma,
+        "denoise": denoise,
+        "denoise_saving": denoise_saving,
+        "scenes": scenes,
+        "scene_zones": scene_zones,
+        "gif_plan": gif_plan,
+        "out_width": planned_output_width(
+            video_metadata, crop_rect, settings["resolution"], advanced.get("aspect_ratio"),
+        ),
+    }
+
+
+def encode_options(settings, advanced, plan, video_metadata):
+    """Argumen compress_video yang sama untuk encode biasa dan encode spekulatif (tanpa crf dan bitrate)."""
+    return {
+        "preset": settings["preset"],
+        "mute_audio": settings["mute_audio"],
+        "resolution": settings["resolution"],
+        "trim_start": advanced.get("trim_start"),
+        "trim_end": advanced.get("trim_end"),
+        "target_fps": advanced.get("target_fps"),
+        "aspect_ratio": advanced.get("aspect_ratio"),
+        "out_format": settings.get("out_format", "mp4"),
+        "fragmented": settings.get("progressive", False),
+        "copy_audio": plan["copy_audio"],
+        "scene_zones": plan["scene_zones"],
+        "crop_rect": plan["crop_rect"],
+        "decimate": plan["decimate"],
+        "out_width": plan["out_width"],
+        "two_pass": settings.get("two_pass", False),
+        "source_size": get_source_size(video_metadata),
+        "gif_options": plan["gif_plan"]["options"] if plan["gif_plan"] else None,
+        "image_quality": settings.get("image_quality"),
+        "denoise": plan["denoise"],
+        "source_fps": get_source_fps(video_metadata),
+    }
+
+
+class SpeculationCancelled(Exception):
+    """Dilempar dari callback progress untuk menghentikan encode spekulatif yang sudah usang."""
+
+
+def speculation_key(input_path, settings, advanced, size_limit_mb, multi_targets):
+    payload = json.dumps([input_path, settings, advanced, size_limit_mb, multi_targets], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def run_speculation(spec, video_metadata, settings, advanced, size_limit_mb, multi):
+    """Kerja spekulatif selagi pengguna memilih pengaturan: probe, analisis, lalu encode berprioritas rendah.
+
+    Semua hasil ditulis ke dict spec. spec["plan_ready"] di-set setelah plan
+    dan keputusan encode (spec["encoding"]) tersedia; spec["cancel"]
+    menghentikan pekerjaan di titik periksa berikutnya, termasuk di tengah encode.
+    """
+    cancel = spec["cancel"]
+    input_path = spec["input_path"]
+    try:
+        # Jeda singkat agar perubahan pengaturan beruntun tidak memulai encode berkali-kali
+        if cancel.wait(SPECULATION_DELAY):
+            return
+        if video_metadata is None:
+            video_metadata = probe_video(input_path)
+        spec["metadata"] = video_metadata
+        plan = plan_encode(
+            input_path, video_metadata, settings, advanced, multi, size_limit_mb, niceness=SPECULATION_NICENESS,
+        )
+        spec["plan"] = plan
+        out_fmt = settings.get("out_format", "mp4")
+        # Encode spekulatif hanya untuk jalur lokal satu output, dan hanya bila server tidak sibuk
+        spec["encoding"] = not (
+            multi or cancel.is_set() or settings.get("hls") or out_fmt == "gif"
+            or should_distribute(plan["duration"], out_fmt, False, plan["scene_zones"])
+            or should_checkpoint(plan["duration"], settings["preset"], out_fmt, False, plan["scene_zones"])
+            or get_scheduler().busy()
+        )
+    finally:
+        spec["plan_ready"].set()
+    if not spec["encoding"]:
+        return
+
+    # Ticket background: slot hanya dipakai bila tidak ada job biasa yang menunggu, dan dilepas begitu ada
+    scheduler = get_scheduler()
+    ticket = scheduler.submit("speculation:" + spec["key"], 0, background=True)
+
+    def on_progress(pct, speed="", eta=""):
+        if cancel.is_set() or ticket["preempted"]:
+            raise SpeculationCancelled()
+        spec["progress"] = (pct, speed, eta)
+
+    size_guard = None
+    if size_limit_mb and plan["duration"] > 0 and SIZE_RETUNE_MAX_ATTEMPTS > 0:
+        size_guard = {"limit": size_limit_mb * 1024 * 1024}
+    try:
+        while not scheduler.wait(ticket, SCHEDULER_POLL_INTERVAL):
+            if cancel.is_set():
+                raise SpeculationCancelled()
+        spec["result"] = compress_video(
+            input_path=input_path,
+            output_path=spec["output_path"],
+            crf=settings["crf"],
+            max_bitrate=plan["max_bitrate"],
+            # Tanpa durasi, callback progress tidak dipanggil dan encode tidak bisa dibatalkan
+            progress_callback=on_progress,
+            duration_seconds=plan["duration"] or SPECULATION_UNKNOWN_DURATION,
+            size_guard=size_guard,
+            niceness=SPECULATION_NICENESS,
+            **encode_options(settings, advanced, plan, video_metadata),
+        )
+    except SpeculationCancelled:
+        spec["result"] = (False, "Encode spekulatif dibatalkan")
+    finally:
+        scheduler.release(ticket)
+
+
+def discard_speculation():
+    """Batalkan kerja spekulatif sesi ini dan hapus hasilnya setelah thread-nya berhenti."""
+    spec = st.session_state.pop("speculation", None)
+    if spec is None:
+        return
+    spec["cancel"].set()
+    spec["future"].cancel()
+
+    def remove_output(_):
+        if os.path.exists(spec["output_path"]):
+            os.unlink(spec["output_path"])
+
+    spec["future"].add_done_callback(remove_output)
+
+
+def update_speculation(input_path, video_metadata, settings, advanced, size_limit_mb, multi_targets):
+    """Pastikan kerja spekulatif sesi ini sesuai pengaturan terkini; mulai ulang bila berubah."""
+    if not SPECULATION_ENABLED:
+        return None
+    key = speculation_key(input_path, settings, advanced, size_limit_mb, multi_targets)
+    spec = st.session_state.get("speculation")
+    if spec is not None and spec["key"] == key:
+        return spec
+    discard_speculation()
+    spec = {
+        "key": key,
+        "input_path": input_path,
+        "output_path": (
+            input_path + "_spec_" + key + "." + get_output_extension(settings.get("out_format", "mp4"))
+        ),
+        "cancel": threading.Event(),
+        "plan_ready": threading.Event(),
+        "metadata": None,
+        "plan": None,
+        "encoding": False,
+        "progress": None,
+        "result": None,
+        "consumed": False,
+    }
+    _temp_files.append(spec["output_path"])
+    # Salinan: main() masih mengubah advanced (crop_rect) saat tombol diklik
+    spec["future"] = get_speculation_pool().submit(
+        run_speculation, spec, video_metadata, dict(settings), dict(advanced), size_limit_mb, bool(multi_targets),
+    )
+    st.session_state["speculation"] = spec
+    return spec
+
+
+def await_speculation(spec, output_path, progress_callback):
+    """Tunggu encode spekulatif selesai sambil meneruskan progresnya, lalu pindahkan hasilnya ke output_path."""
+    spec["consumed"] = True
+    while not spec["future"].done():
+        if spec["progress"]:
+            progress_callback(*spec["progress"])
+        time.sleep(SCHEDULER_POLL_INTERVAL)
+    success, error_msg = spec["result"] or (False, None)
+    if success:
+        os.replace(spec["output_path"], output_path)
+    return success, error_msg
+
+
+def open_gray_pipe(video_path, width, height, sample_fps, input_args=None, aspect_ratio=None, crop_rect=None):
+    """Decode video ke frame grayscale rawvideo lewat pipe stdout, tanpa file sementara."""
+    video = ffmpeg.input(video_path, **(input_args or {})).video
+    if aspect_ratio or crop_rect:
+        video = apply_video_filters(video, "original", aspect_ratio, crop_rect=crop_rect)
+    video = ffmpeg.filter(video, "fps", fps=sample_fps)
+    video = ffmpeg.filter(video, "scale", width, height, flags="area")
+    output = ffmpeg.output(video, "pipe:", format="rawvideo", pix_fmt="gray")
+    return output.global_args("-loglevel", "error", "-nostats").run_async(pipe_stdout=True)
+
+
+def block_ssim(frame_a, frame_b, block=QUALITY_BLOCK):
+    """SSIM per blok untuk dua frame grayscale (vektorisasi penuh dengan NumPy)."""
+    h, w = frame_a.shape
+    shape = (h // block, block, w // block, block)
+    a = frame_a.reshape(shape).astype(np.float32)
+    b = frame_b.reshape(shape).astype(np.float32)
+    mu_a = a.mean(axis=(1, 3))
+    mu_b = b.mean(axis=(1, 3))
+    var_a = a.var(axis=(1, 3))
+    var_b = b.var(axis=(1, 3))
+    cov = (a * b).mean(axis=(1, 3)) - mu_a * mu_b
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    return ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+
+
+@traced("quality_map")
+def compute_quality_map(input_path, output_path, duration, video_metadata=None,
+                        trim_start=None, trim_end=None, aspect_ratio=None, crop_rect=None):
+    """Bandingkan input dan output frame demi frame dengan SSIM per blok.
+
+    Frame dari kedua file di-decode, diperkecil, dan dialirkan sebagai
+    rawvideo langsung ke buffer NumPy. Hanya peta SSIM kumulatif, satu frame
+    referensi, dan kurva per sampel yang disimpan, sehingga memori tetap
+    konstan berapa pun durasi videonya.
+    """
+    if duration <= 0:
+        return None
+    ratio = 16 / 9
+    if aspect_ratio:
+        num, _, den = aspect_ratio.partition(":")
+        ratio = float(num) / float(den or 1)
+    elif crop_rect:
+        ratio = crop_rect["w"] / crop_rect["h"]
+    elif video_metadata and video_metadata.get("width") and video_metadata.get("height"):
+        ratio = video_metadata["width"] / video_metadata["height"]
+    width = QUALITY_WIDTH
+    height = max(int(round(width / ratio / QUALITY_BLOCK)) * QUALITY_BLOCK, QUALITY_BLOCK)
+    sample_fps = min(1.0, QUALITY_MAX_SAMPLES / duration)
+    frame_bytes = width * height
+
+    source = open_gray_pipe(
+        input_path, width, height, sample_fps, build_input_args(trim_start, trim_end), aspect_ratio, crop_rect,
+    )
+    result = open_gray_pipe(output_path, width, height, sample_fps)
+    ssim_sum = None
+    reference = None
+    curve = []
+    try:
+        while True:
+            raw_a = source.stdout.read(frame_bytes)
+            raw_b = result.stdout.read(frame_bytes)
+            if len(raw_a) < frame_bytes or len(raw_b) < frame_bytes:
+                break
+            frame_a = np.frombuffer(raw_a, dtype=np.uint8).reshape(height, width)
+            frame_b = np.frombuffer(raw_b, dtype=np.uint8).reshape(height, width)
+            ssim_map = block_ssim(frame_a, frame_b)
+            ssim_sum = ssim_map if ssim_sum is None else ssim_sum + ssim_map
+            if len(curve) == QUALITY_MAX_SAMPLES // 2:
+                reference = frame_b
+            curve.append((len(curve) / sample_fps, float(ssim_map.mean())))
+    finally:
+        for process in (source, result):
+            process.stdout.close()
+            process.kill()
+            process.wait()
+
+    if ssim_sum is None:
+        return None
+    if reference is None:
+        reference = frame_b
+    mean_map = ssim_sum / len(curve)
+
+    # Overlay: frame hasil grayscale, blok dengan SSIM rendah diwarnai merah
+    error = np.clip((1.0 - mean_map) * 4.0, 0.0, 1.0)
+    error = np.kron(error, np.ones((QUALITY_BLOCK, QUALITY_BLOCK), dtype=np.float32))
+    base = reference.astype(np.float32) * 0.6
+    overlay = np.stack([base + error * 160, base * (1 - error * 0.5), base * (1 - error * 0.5)], axis=-1)
+    return {
+        "overlay": np.clip(overlay, 0, 255).astype(np.uint8),
+        "curve": curve,
+        "mean_ssim": float(mean_map.mean()),
+    }
+
+
+class StorageError(OSError):
+    """Kegagalan backend storage sesi; turunan OSError agar ditangani sama seperti kegagalan disk lokal."""
+
+
+class LocalStorage:
+    """Backend penyimpanan sesi di filesystem lokal (default, satu replika)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def put_file(self, key, src_path):
+        dest = self.path(key)
+        if os.path.abspath(dest) == os.path.abspath(src_path):
+            return
+        os.makedirs(self.root, exist_ok=True)
+        shutil.copyfile(src_path, dest)
+
+    def put_json(self, key, data):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.path(key) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path(key))
+
+    def get_json(self, key):
+        try:
+            with open(self.path(key), "r") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return None
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def list(self, prefix=""):
+        """Daftar (key, waktu modifikasi) semua objek dengan awalan prefix."""
+        if not os.path.isdir(self.root):
+            return []
+        items = []
+        for name in os.listdir(self.root):
+            if not name.startswith(prefix):
+                continue
+            try:
+                items.append((name, os.path.getmtime(self.path(name))))
+            except OSError:
+                continue
+        return items
+
+    def delete(self, key):
+        full = self.path(key)
+        try:
+            if os.path.isdir(full):
+                shutil.rmtree(full, ignore_errors=True)
+            elif os.path.exists(full):
+                os.unlink(full)
+        except OSError:
+            pass
+
+    def fetch(self, key, dest_path):
+        """Salin objek ke dest_path lokal (no-op bila sudah di tempat yang sama)."""
+        if not os.path.exists(self.path(key)):
+            raise FileNotFoundError("File sesi " + key + " tidak ditemukan")
+        if os.path.abspath(self.path(key)) != os.path.abspath(dest_path):
+            shutil.copyfile(self.path(key), dest_path)
 
-        # --- WebM VP9 output ---
-        if out_format == "webm":
-            encoding_params = {
-                "vcodec": "libvpx-vp9",
-                "crf": crf,
-                "b:v": "0",
-                "threads": FFMPEG_THREADS,
-                "row-mt": 1,
-            }
-            if max_bitrate:
-                encoding_params["b:v"] = max_bitrate
-            if mute_audio:
-                output = ffmpeg.output(video, output_path, an=None, **encoding_params)
-            else:
-                audio_params = {"c:a": "libopus", "b:a": "96k", "ac": 2}
-                output = ffmpeg.output(audio, video, output_path, **audio_params, **encoding_params)
-        else:
-            # --- MP4 H.264 output ---
-            encoding_params = {
-                "vcodec": "libx264",
-                "crf": crf,
-                "preset": preset,
-                "movflags": "+faststart",
-                "profile:v": "high",
-                "tune": "film",
-                "threads": FFMPEG_THREADS,
-            }
-            encoding_params.update(COLOR_PROFILE)
-            if max_bitrate:
-                encoding_params["maxrate"] = max_bitrate
-                encoding_params["bufsize"] = max_bitrate
-            if mute_audio:
-                output = ffmpeg.output(video, output_path, an=None, **encoding_params)
-            else:
-                audio_params = {"c:a": "aac", "b:a": "96k", "ac": 2}
-                output = ffmpeg.output(audio, video, output_path, **audio_params, **encoding_params)
 
-        cmd = ffmpeg.compile(output, overwrite_output=True)
+class S3Storage:
+    """Backend penyimpanan sesi di bucket S3-compatible (AWS S3, MinIO, dll).
 
-        if progress_callback and duration_seconds > 0:
-            process = subprocess.Popen(
-                cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
-            )
-            pattern = re.compile(r"time=(\d+):(\d+):(\d+\.\d+)")
-            speed_pattern = re.compile(r"speed=\s*([0-9.]+)x")
-            stderr_lines = []
-            start_time = time.time()
+    Upload besar memakai multipart upload per S3_PART_SIZE tanpa memuat
+    seluruh file ke memori; download memakai ranged GET per S3_READ_CHUNK
+    yang bisa dilanjutkan bila terputus. Kredensial dibaca boto3 dari
+    environment (AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION).
+    """
 
-            if process.stderr is not None:
-                for line in iter(process.stderr.readline, ""):
-                    stderr_lines.append(line)
-                    match = pattern.search(line)
-                    if match:
-                        h = float(match.group(1))
-                        m = float(match.group(2))
-                        s = float(match.group(3))
-                        elapsed = h * 3600 + m * 60 + s
-                        pct = min(elapsed / duration_seconds, 1.0)
-                        wall = time.time() - start_time
-                        speed_m = speed_pattern.search(line)
-                        speed_txt = speed_m.group(1) + "x" if speed_m else ""
-                        eta = ""
-                        if pct > 0.01 and wall > 2:
-                            remaining = (wall / pct) * (1 - pct)
-                            eta = format_duration(remaining)
-                        progress_callback(pct, speed_txt, eta)
+    def __init__(self, bucket, prefix="", endpoint_url=None):
+        try:
+            import boto3
+            import botocore.exceptions
+        except ImportError:
+            raise RuntimeError("Backend storage s3 membutuhkan paket boto3 (pip install boto3)")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None)
+        self.errors = (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    def object_key(self, key):
+        return self.prefix + key
+
+    def put_file(self, key, src_path):
+        try:
+            self.upload_file(key, src_path)
+        except self.errors as err:
+            raise StorageError("Gagal menyimpan " + key + " ke S3: " + str(err))
+
+    def upload_file(self, key, src_path):
+        object_key = self.object_key(key)
+        if os.path.getsize(src_path) <= S3_PART_SIZE:
+            with open(src_path, "rb") as f:
+                self.client.put_object(Bucket=self.bucket, Key=object_key, Body=f)
+            return
 
-            process.wait()
-            if process.returncode != 0:
-                tail = stderr_lines[-50:] if len(stderr_lines) > 50 else stderr_lines
-                return False, "".join(tail)
-        else:
-            ffmpeg.run(output, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=object_key)["UploadId"]
+        parts = []
+        try:
+            with open(src_path, "rb") as f:
+                while True:
+                    chunk = f.read(S3_PART_SIZE)
+                    if not chunk:
+                        break
+                    part_number = len(parts) + 1
+                    result = self.client.upload_part(
+                        Bucket=self.bucket, Key=object_key, UploadId=upload_id,
+                        PartNumber=part_number, Body=chunk,
+                    )
+                    parts.append({"ETag": result["ETag"], "PartNumber": part_number})
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=object_key, UploadId=upload_id, MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=object_key, UploadId=upload_id)
+            raise
 
-        return True, None
+    def put_json(self, key, data):
+        try:
+            self.client.put_object(
+                Bucket=self.bucket, Key=self.object_key(key),
+                Body=json.dumps(data).encode("utf-8"), ContentType="application/json",
+            )
+        except self.errors as err:
+            raise StorageError("Gagal menyimpan " + key + " ke S3: " + str(err))
 
-    except ffmpeg.Error as err:
-        error_detail = err.stderr.decode("utf-8") if err.stderr else "Proses encoding gagal"
-        return False, error_detail
+    def get_json(self, key):
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))["Body"].read()
+            return json.loads(body)
+        except self.errors:
+            return None
+        except json.JSONDecodeError:
+            return None
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except self.errors:
+            return False
+
+    def list(self, prefix=""):
+        items = []
+        try:
+            paginator = self.client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.object_key(prefix)):
+                for obj in page.get("Contents", []):
+                    items.append((obj["Key"][len(self.prefix):], obj["LastModified"].timestamp()))
+        except self.errors:
+            return []
+        return items
+
+    def delete(self, key):
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+        except self.errors:
+            pass
 
+    def read_range(self, key, start, end):
+        """Baca byte start..end (inklusif) dari objek."""
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self.object_key(key), Range="bytes=" + str(start) + "-" + str(end),
+        )
+        return response["Body"].read()
 
+    def fetch(self, key, dest_path):
+        """Unduh objek ke dest_path dengan ranged GET, melanjutkan file .part bila ada."""
+        partial_path = dest_path + ".part"
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        try:
+            size = self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))["ContentLength"]
+            with open(partial_path, "ab") as f:
+                while offset < size:
+                    chunk = self.read_range(key, offset, min(offset + S3_READ_CHUNK, size) - 1)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    offset += len(chunk)
+        except self.errors as err:
+            raise StorageError("Gagal mengunduh " + key + " dari S3: " + str(err))
+        if offset < size:
+            raise OSError("Download " + key + " terputus di byte " + str(offset))
+        os.replace(partial_path, dest_path)
+
+
+@st.cache_resource(show_spinner=False)
+def get_storage():
+    """Backend penyimpanan sesi sesuai KOMPRES_STORAGE (local atau s3)."""
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(S3_BUCKET, S3_PREFIX, S3_ENDPOINT)
+    return LocalStorage(SESSION_DIR)
+
+
+def session_meta_key(token, session_id):
+    """Key metadata sesi; token di depan agar sesi satu browser bisa dicari per prefix."""
+    return re.sub(r"[^A-Za-z0-9]", "", token) + "_" + session_id + ".json"
+
+
+@traced("save_upload_to_temp")
 def save_upload_to_temp(uploaded_file, token):
-    """Simpan file upload ke direktori sesi persisten dengan token unik."""
+    """Simpan file upload ke cache lokal dan storage sesi dengan token unik."""
     os.makedirs(SESSION_DIR, exist_ok=True)
     cleanup_old_sessions()
 
     suffix = pathlib.Path(uploaded_file.name).suffix or ".mp4"
-    session_id = str(int(time.time() * 1000))
-    file_path = os.path.join(SESSION_DIR, session_id + suffix)
-    meta_path = os.path.join(SESSION_DIR, session_id + ".json")
+    file_path = os.path.join(SESSION_DIR, str(int(time.time() * 1000)) + suffix)
 
     with open(file_path, "wb") as f:
         f.write(uploaded_file.getbuffer())
 
+    _temp_files.append(file_path)
+    try:
+        meta = register_session_file(file_path, uploaded_file.name, uploaded_file.size, token)
+    except OSError as err:
+        # Encode tetap bisa jalan dari file lokal; hanya pemulihan sesi yang tidak tersedia
+        st.error(
+            "Gagal menyimpan video ke storage sesi: " + str(err) + ". Video tetap diproses dari file lokal, "
+            + "tetapi sesi ini tidak bisa dilanjutkan nanti."
+        )
+        return file_path
+
+    _temp_files.append(os.path.join(SESSION_DIR, session_meta_key(token, meta["session_id"])))
+    return file_path
+
+
+def register_session_file(file_path, original_name, file_size, token, upload_nonce=None):
+    """Daftarkan file di SESSION_DIR sebagai sesi upload token ini dan simpan ke storage.
+
+    upload_nonce menandai sesi hasil upload bertahap dari halaman tertentu,
+    agar tombol Gunakan File Upload memuat file itu dan bukan sesi lain.
+    """
+    file_key = os.path.basename(file_path)
+    session_id = pathlib.Path(file_key).stem
+    storage = get_storage()
+    storage.put_file(file_key, file_path)
     meta = {
-        "original_name": uploaded_file.name,
+        "original_name": original_name,
+        "file_key": file_key,
         "file_path": file_path,
-        "file_size": uploaded_file.size,
+        "file_size": file_size,
         "timestamp": time.time(),
         "session_id": session_id,
         "token": token,
     }
-    with open(meta_path, "w") as f:
-        json.dump(meta, f)
+    if upload_nonce:
+        meta["upload_nonce"] = upload_nonce
+    storage.put_json(session_meta_key(token, session_id), meta)
+    return meta
 
-    _temp_files.append(file_path)
-    _temp_files.append(meta_path)
-    return file_path
 
-
-def find_recent_session(token):
-    """Cari sesi upload terakhir yang cocok dengan token browser ini."""
-    if not os.path.isdir(SESSION_DIR):
-        return None
+def find_recent_session(token, upload_nonce=None):
+    """Cari sesi upload terakhir yang cocok dengan token browser ini (dan nonce upload bertahap, bila ada)."""
     if not token:
         return None
+    storage = get_storage()
     now = time.time()
     best = None
-    for name in os.listdir(SESSION_DIR):
-        if not name.endswith(".json"):
+    # Manifest checkpoint dibaca sekali per panggilan, hanya bila ada sesi yang sudah lewat SESSION_MAX_AGE
+    checkpoints = None
+    for key, mtime in storage.list(session_meta_key(token, "")[:-len(".json")]):
+        if not key.endswith(".json") or now - mtime > CHECKPOINT_MAX_AGE:
             continue
-        meta_path = os.path.join(SESSION_DIR, name)
-        try:
-            with open(meta_path, "r") as f:
-                meta = json.load(f)
-            if meta.get("token") != token:
-                continue
-            age = now - meta.get("timestamp", 0)
-            if age > SESSION_MAX_AGE:
-                continue
-            if not os.path.exists(meta.get("file_path", "")):
-                continue
-            if best is None or meta["timestamp"] > best["timestamp"]:
-                best = meta
-        except (json.JSONDecodeError, OSError):
+        meta = storage.get_json(key)
+        if not meta or meta.get("token") != token:
+            continue
+        if upload_nonce and meta.get("upload_nonce") != upload_nonce:
             continue
+        # Sesi dengan encode checkpoint yang belum selesai tetap bisa dilanjutkan lebih lama
+        if now - meta.get("timestamp", 0) > SESSION_MAX_AGE:
+            if checkpoints is None:
+                checkpoints = list_checkpoints()
+            if meta.get("file_key") not in checkpoints:
+                continue
+        if best is None or meta["timestamp"] > best["timestamp"]:
+            best = meta
+    if best is None or not storage.exists(best.get("file_key", "")):
+        return None
     return best
 
 
-def cleanup_old_sessions():
-    """Hapus file sesi yang lebih dari 1 jam."""
-    if not os.path.isdir(SESSION_DIR):
+def restore_session_file(meta, key_field="file_key"):
+    """Pastikan file sesi ada di cache lokal replika ini dan kembalikan path-nya.
+
+    Bila storage gagal tetapi file asli sesi masih ada di disk replika ini,
+    file itu yang dipakai; selain itu OSError diteruskan ke pemanggil.
+    """
+    file_path = os.path.join(SESSION_DIR, meta[key_field])
+    if not os.path.exists(file_path):
+        os.makedirs(SESSION_DIR, exist_ok=True)
+        try:
+            get_storage().fetch(meta[key_field], file_path)
+        except OSError:
+            if key_field == "file_key" and meta.get("file_path") and os.path.exists(meta["file_path"]):
+                return meta["file_path"]
+            raise
+        _temp_files.append(file_path)
+    return file_path
+
+
+def store_session_output(token, input_path, output_path, download_name):
+    """Simpan hasil kompresi ke storage sesi agar bisa diunduh lagi dari replika mana pun."""
+    storage = get_storage()
+    output_key = os.path.basename(output_path)
+    meta_key = session_meta_key(token, pathlib.Path(input_path).stem)
+    meta = storage.get_json(meta_key)
+    if meta is None:
+        return True, None
+    try:
+        storage.put_file(output_key, output_path)
+        meta["output_key"] = output_key
+        meta["output_name"] = download_name
+        storage.put_json(meta_key, meta)
+    except OSError as err:
+        return False, "Gagal menyimpan hasil ke storage sesi: " + str(err)
+    return True, None
+
+
+def touch_session_meta(storage, meta_key):
+    """Perbarui timestamp sesi agar tidak kedaluwarsa selama encode panjang masih berjalan."""
+    meta = storage.get_json(meta_key) if meta_key else None
+    if meta is None:
         return
+    meta["timestamp"] = time.time()
+    storage.put_json(meta_key, meta)
+
+
+def expire_storage(storage, now):
+    items = storage.list()
+    # File sesi milik encode checkpoint yang belum selesai disimpan selama manifest-nya berlaku
+    keep = set()
+    for key, mtime in items:
+        if key.startswith(CHECKPOINT_PREFIX) and key.endswith(".json") and now - mtime <= CHECKPOINT_MAX_AGE:
+            manifest = storage.get_json(key) or {}
+            keep.update(k for k in (manifest.get("input_key"), manifest.get("meta_key")) if k)
+            if manifest.get("input_key"):
+                keep.add(manifest["input_key"] + PACKET_INDEX_SUFFIX)
+    for key, mtime in items:
+        max_age = CHECKPOINT_MAX_AGE if key.startswith(CHECKPOINT_PREFIX) or key in keep else SESSION_MAX_AGE
+        if now - mtime > max_age:
+            storage.delete(key)
+
+
+def cleanup_old_sessions():
+    """Hapus file sesi yang lebih dari 1 jam, di storage maupun cache lokal."""
     now = time.time()
-    for name in os.listdir(SESSION_DIR):
-        full = os.path.join(SESSION_DIR, name)
+    storage = get_storage()
+    expire_storage(storage, now)
+    if not isinstance(storage, LocalStorage):
+        expire_storage(LocalStorage(SESSION_DIR), now)
+
+
+_upload_lock = threading.Lock()
+
+
+def upload_id_for(token, name, size):
+    """ID upload bertahap; sama untuk file dan token yang sama agar upload bisa dilanjutkan."""
+    return hashlib.sha256((token + "\n" + name + "\n" + str(size)).encode("utf-8")).hexdigest()[:24]
+
+
+def upload_data_path(upload_id):
+    return os.path.join(UPLOAD_DIR, upload_id + ".part")
+
+
+def read_upload_manifest(upload_id):
+    if not re.fullmatch(r"[0-9a-f]{24}", upload_id or ""):
+        return None
+    try:
+        with open(os.path.join(UPLOAD_DIR, upload_id + ".json"), "r") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return None
+
+
+def write_upload_manifest(manifest):
+    path = os.path.join(UPLOAD_DIR, manifest["upload_id"] + ".json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def expire_uploads(now):
+    """Hapus upload bertahap yang tidak disentuh lebih dari UPLOAD_MAX_AGE."""
+    for name in os.listdir(UPLOAD_DIR):
+        path = os.path.join(UPLOAD_DIR, name)
         try:
-            if now - os.path.getmtime(full) > SESSION_MAX_AGE:
-                os.unlink(full)
+            if now - os.path.getmtime(path) > UPLOAD_MAX_AGE:
+                os.unlink(path)
+        except OSError:
+            continue
+
+
+def upload_signature(token, nonce):
+    """Tanda tangan HMAC untuk upload bertahap dari halaman ini; kosong bila KOMPRES_SECRET tidak diset."""
+    if not SHARED_SECRET:
+        return ""
+    message = (token + "\n" + nonce).encode("utf-8")
+    return hmac.new(SHARED_SECRET.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def check_upload_signature(token, nonce, provided):
+    if not SHARED_SECRET:
+        return True
+    return hmac.compare_digest((provided or "").encode("utf-8"), upload_signature(token, nonce).encode("utf-8"))
+
+
+def create_upload(token, name, size, nonce=""):
+    """Mulai upload bertahap, atau kembalikan manifest yang ada untuk dilanjutkan: (manifest, error_msg)."""
+    suffix = pathlib.Path(name).suffix.lower().lstrip(".")
+    if suffix not in SUPPORTED_FORMATS:
+        return None, "Format file tidak didukung: " + (suffix or name)
+    if size <= 0 or size > UPLOAD_MAX_SIZE:
+        return None, "Ukuran file harus antara 1 byte dan " + format_filesize(UPLOAD_MAX_SIZE)
+
+    upload_id = upload_id_for(token, name, size)
+    with _upload_lock:
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        expire_uploads(time.time())
+        manifest = read_upload_manifest(upload_id)
+        if manifest and os.path.exists(upload_data_path(upload_id)):
+            # Dilanjutkan dari halaman baru: sesi hasilnya milik nonce halaman itu
+            if manifest.get("nonce") != nonce:
+                manifest["nonce"] = nonce
+                write_upload_manifest(manifest)
+            return manifest, None
+
+        manifest = {
+            "upload_id": upload_id,
+            "token": token,
+            "name": name,
+            "size": size,
+            "nonce": nonce,
+            "chunk_size": UPLOAD_CHUNK_SIZE,
+            "chunks": int(math.ceil(size / UPLOAD_CHUNK_SIZE)),
+            "received": {},
+            "created": time.time(),
+        }
+        # File tujuan dialokasikan penuh; setiap chunk yang lolos verifikasi disalin ke posisinya
+        with open(upload_data_path(upload_id), "wb") as f:
+            f.truncate(size)
+        write_upload_manifest(manifest)
+    return manifest, None
+
+
+def write_upload_chunk(upload_id, index, stream, length, checksum):
+    """Terima satu chunk dari stream ke file sementara sambil menghitung SHA-256-nya.
+
+    Chunk baru disalin ke posisinya di file upload dan dicatat diterima bila
+    panjang dan checksum cocok, jadi chunk yang terputus atau rusak tidak
+    pernah menimpa data yang sudah benar. Return (success, error_msg).
+    """
+    manifest = read_upload_manifest(upload_id)
+    if manifest is None:
+        return False, "Upload tidak ditemukan"
+    if index < 0 or index >= manifest["chunks"]:
+        return False, "Nomor chunk di luar rentang"
+    if not re.fullmatch(r"[0-9a-fA-F]{64}", checksum or ""):
+        return False, "Header X-Chunk-SHA256 wajib berisi SHA-256 chunk"
+    offset = index * manifest["chunk_size"]
+    expected = min(manifest["chunk_size"], manifest["size"] - offset)
+    if length != expected:
+        return False, "Panjang chunk " + str(length) + " byte, seharusnya " + str(expected)
+
+    # Nama unik: chunk yang sama bisa sedang dikirim ulang browser selagi percobaan lama masih berjalan
+    slice_path = upload_data_path(upload_id) + "." + str(index) + "." + uuid.uuid4().hex[:8]
+    try:
+        digest = hashlib.sha256()
+        remaining = length
+        with open(slice_path, "wb") as f:
+            while remaining > 0:
+                data = stream.read(min(UPLOAD_COPY_CHUNK, remaining))
+                if not data:
+                    break
+                digest.update(data)
+                f.write(data)
+                remaining -= len(data)
+        if remaining > 0:
+            return False, "Koneksi terputus setelah " + str(length - remaining) + " byte"
+        if digest.hexdigest() != checksum.lower():
+            return False, "Checksum chunk " + str(index) + " tidak cocok"
+
+        # Disalin di bawah lock agar tidak balapan dengan finalize_upload yang memindahkan file upload
+        with _upload_lock:
+            manifest = read_upload_manifest(upload_id)
+            if manifest is None:
+                return False, "Upload tidak ditemukan"
+            with open(slice_path, "rb") as src, open(upload_data_path(upload_id), "r+b") as dst:
+                dst.seek(offset)
+                shutil.copyfileobj(src, dst, UPLOAD_COPY_CHUNK)
+            manifest["received"][str(index)] = digest.hexdigest()
+            write_upload_manifest(manifest)
+    finally:
+        try:
+            os.unlink(slice_path)
         except OSError:
             pass
+    return True, None
+
+
+def finalize_upload(upload_id):
+    """Pindahkan upload yang lengkap ke SESSION_DIR dan daftarkan sebagai sesi: (meta, error_msg)."""
+    with _upload_lock:
+        manifest = read_upload_manifest(upload_id)
+        if manifest is None:
+            return None, "Upload tidak ditemukan"
+        missing = manifest["chunks"] - len(manifest["received"])
+        if missing > 0:
+            return None, str(missing) + " chunk belum diterima"
+        os.makedirs(SESSION_DIR, exist_ok=True)
+        suffix = pathlib.Path(manifest["name"]).suffix or ".mp4"
+        file_path = os.path.join(SESSION_DIR, str(int(time.time() * 1000)) + suffix)
+        shutil.move(upload_data_path(upload_id), file_path)
+        os.unlink(os.path.join(UPLOAD_DIR, upload_id + ".json"))
+    return register_session_file(
+        file_path, manifest["name"], manifest["size"], manifest["token"], manifest.get("nonce"),
+    ), None
+
+
+def package_hls(hls_dir):
+    """Kemas playlist dan segmen HLS ke arsip zip di memori."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zf:
+        for name in sorted(os.listdir(hls_dir)):
+            zf.write(os.path.join(hls_dir, name), arcname=name)
+    return buffer.getvalue()
 
 
 def cleanup_temp_files():
     for path in _temp_files:
         try:
-            if os.path.exists(path):
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
                 os.unlink(path)
         except OSError:
             pass
@@ -673,6 +3782,7 @@ def cleanup_temp_files():
 atexit.register(cleanup_temp_files)
 
 
+@traced("load_file_bytes")
 @st.cache_data(show_spinner=False, ttl=600)
 def load_file_bytes(file_path):
     with open(file_path, "rb") as f:
@@ -712,6 +3822,217 @@ def render_history():
                 )
 
 
+def render_chunked_upload(token, nonce):
+    """Upload bertahap lewat upload_server.py: per chunk dengan SHA-256, bisa dilanjutkan setelah terputus."""
+    import streamlit.components.v1 as components
+
+    html_code = """<!DOCTYPE html>
+<html>
+<head>
+<style>
+* { margin: 0; padding: 0; box-sizing: border-box; }
+body { background: transparent; font-family: 'Inter', sans-serif; color: #e2e8f0; font-size: 14px; }
+.bar { height: 8px; border-radius: 4px; background: #1a1f2e; margin: 10px 0 6px; overflow: hidden; }
+.fill { height: 100%; width: 0; background: #7c3aed; transition: width 0.2s; }
+#status { color: #94a3b8; font-size: 13px; }
+</style>
+</head>
+<body>
+<input type="file" id="file" accept="__ACCEPT__">
+<div class="bar"><div class="fill" id="fill"></div></div>
+<div id="status">Pilih file. Upload yang terputus dilanjutkan dari chunk terakhir bila file yang sama dipilih lagi.</div>
+<script>
+(function() {
+    var API = "__API__", TOKEN = "__TOKEN__", NONCE = "__NONCE__", SIGNATURE = "__SIGNATURE__";
+    var fill = document.getElementById('fill'), status = document.getElementById('status');
+    function sleep(ms) { return new Promise(function(r) { setTimeout(r, ms); }); }
+    function hex(buf) {
+        return Array.prototype.map.call(new Uint8Array(buf), function(b) {
+            return ('0' + b.toString(16)).slice(-2);
+        }).join('');
+    }
+    // crypto.subtle hanya ada di HTTPS/localhost; di luar itu SHA-256 dihitung di JavaScript
+    var K = [
+        0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+        0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+        0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+        0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+        0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+        0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+        0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+        0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+    ];
+    function sha256(buf) {
+        var bytes = new Uint8Array(buf), n = bytes.length;
+        var padded = new Uint8Array(((n + 9 + 63) >> 6) << 6);
+        padded.set(bytes);
+        padded[n] = 0x80;
+        var view = new DataView(padded.buffer);
+        view.setUint32(padded.length - 8, Math.floor(n / 0x20000000));
+        view.setUint32(padded.length - 4, (n << 3) >>> 0);
+        var h = [0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19];
+        var w = new Array(64);
+        for (var off = 0; off < padded.length; off += 64) {
+            for (var i = 0; i < 16; i++) w[i] = view.getUint32(off + i * 4);
+            for (i = 16; i < 64; i++) {
+                var x = w[i - 15], y = w[i - 2];
+                var s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+                var s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+                w[i] = (w[i - 16] + s0 + w[i - 7] + s1) | 0;
+            }
+            var a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7];
+            for (i = 0; i < 64; i++) {
+                var S1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+                var t1 = (k + S1 + ((e & f) ^ (~e & g)) + K[i] + w[i]) | 0;
+                var S0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+                var t2 = (S0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+                k = g; g = f; f = e; e = (d + t1) | 0; d = c; c = b; b = a; a = (t1 + t2) | 0;
+            }
+            h[0] = (h[0] + a) | 0; h[1] = (h[1] + b) | 0; h[2] = (h[2] + c) | 0; h[3] = (h[3] + d) | 0;
+            h[4] = (h[4] + e) | 0; h[5] = (h[5] + f) | 0; h[6] = (h[6] + g) | 0; h[7] = (h[7] + k) | 0;
+        }
+        var out = new DataView(new ArrayBuffer(32));
+        for (i = 0; i < 8; i++) out.setUint32(i * 4, h[i]);
+        return out.buffer;
+    }
+    async function digest(blob) {
+        var buf = await blob.arrayBuffer();
+        if (window.crypto && crypto.subtle) return hex(await crypto.subtle.digest('SHA-256', buf));
+        return hex(sha256(buf));
+    }
+    async function sendChunk(id, index, blob) {
+        var checksum = await digest(blob);
+        for (var attempt = 0; ; attempt++) {
+            try {
+                var headers = {
+                    'Content-Type': 'application/octet-stream', 'X-Kompres-Signature': SIGNATURE,
+                    'X-Chunk-SHA256': checksum
+                };
+                var res = await fetch(API + '/uploads/' + id + '/' + index, {method: 'PUT', headers: headers, body: blob});
+                if (res.ok) return;
+                if (res.status === 404) throw new Error('upload kedaluwarsa, pilih file lagi');
+                if (res.status === 403) throw new Error('upload ditolak, muat ulang halaman');
+            } catch (err) {
+                if (err.message.indexOf('kedaluwarsa') >= 0 || err.message.indexOf('ditolak') >= 0) throw err;
+            }
+            status.textContent = 'Koneksi terputus, mencoba lagi chunk ' + (index + 1) + '...';
+            await sleep(Math.min(30000, 1000 * Math.pow(2, attempt)));
+        }
+    }
+    async function upload(file) {
+        var res = await fetch(API + '/uploads', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json', 'X-Kompres-Signature': SIGNATURE},
+            body: JSON.stringify({token: TOKEN, nonce: NONCE, name: file.name, size: file.size})
+        });
+        if (!res.ok) throw new Error(await res.text());
+        var m = await res.json();
+        var done = Object.keys(m.received).length;
+        for (var i = 0; i < m.chunks; i++) {
+            if (m.received[i]) continue;
+            var start = i * m.chunk_size;
+            await sendChunk(m.upload_id, i, file.slice(start, Math.min(start + m.chunk_size, file.size)));
+            done++;
+            fill.style.width = (done / m.chunks * 100) + '%';
+            status.textContent = 'Mengupload: ' + done + ' / ' + m.chunks + ' chunk';
+        }
+        res = await fetch(API + '/uploads/' + m.upload_id + '/complete', {
+            method: 'POST', headers: {'X-Kompres-Signature': SIGNATURE}
+        });
+        if (!res.ok) throw new Error(await res.text());
+        fill.style.width = '100%';
+        status.textContent = 'Upload selesai. Klik "Gunakan File Upload" di bawah.';
+    }
+    document.getElementById('file').addEventListener('change', function(e) {
+        var file = e.target.files[0];
+        if (!file) return;
+        fill.style.width = '0';
+        status.textContent = 'Memulai upload...';
+        upload(file).catch(function(err) { status.textContent = 'Upload gagal: ' + err.message; });
+    });
+})();
+</script>
+</body>
+</html>"""
+
+    accept = ",".join("." + ext for ext in SUPPORTED_FORMATS)
+    html_final = (
+        html_code.replace("__API__", UPLOAD_URL).replace("__TOKEN__", token).replace("__NONCE__", nonce)
+        .replace("__SIGNATURE__", upload_signature(token, nonce)).replace("__ACCEPT__", accept)
+    )
+    components.html(html_final, height=90, scrolling=False)
+
+
+def activate_session(meta):
+    """Jadikan file sesi tersimpan sebagai input sesi Streamlit ini: (success, error_msg)."""
+    try:
+        file_path = restore_session_file(meta)
+    except OSError as err:
+        return False, "Gagal memulihkan file sesi dari storage: " + str(err)
+    st.session_state["input_path"] = file_path
+    st.session_state["input_name"] = meta["original_name"]
+    st.session_state["input_size"] = meta["file_size"]
+    st.session_state["input_size_raw"] = meta["file_size"]
+    st.session_state.pop("video_metadata", None)
+    start_filmstrip(file_path)
+    return True, None
+
+
+def resume_checkpoint(meta, checkpoint, token):
+    """Lanjutkan encode checkpoint yang terputus dengan parameter persis dari manifest-nya."""
+    try:
+        input_path = restore_session_file(meta)
+    except OSError as err:
+        st.error("Gagal memulihkan file sesi dari storage: " + str(err))
+        return
+    job = checkpoint["job"]
+    params = checkpoint["params"]
+    output_path = input_path + "_out." + get_output_extension(job["out_format"])
+    _temp_files.append(output_path)
+
+    progress_bar = st.progress(0, text="Melanjutkan encoding...")
+    status_text = st.empty()
+
+    def on_progress(pct, speed="", eta=""):
+        progress_bar.progress(min(int(pct * 100), 99), text="Encoding: " + str(int(pct * 100)) + "%")
+        if speed:
+            status_text.caption("Kecepatan: " + speed)
+
+    encode_passes = 2 if job.get("two_pass") and job["out_format"] == "webm" else 1
+    job_cost = estimate_job_cost(params["duration_seconds"], [job["preset"]] * encode_passes)
+    with encode_slot(token, job_cost, status_text):
+        success, error_msg = compress_video_checkpointed(
+            input_path=input_path,
+            output_path=output_path,
+            progress_callback=on_progress,
+            meta_key=checkpoint["meta_key"],
+            size_limit_mb=checkpoint.get("size_limit_mb"),
+            output_name=checkpoint.get("output_name"),
+            **dict(job, **params)
+        )
+
+    status_text.empty()
+    if not success:
+        progress_bar.empty()
+        st.error("Terjadi kesalahan saat melanjutkan encode.")
+        st.code(error_msg, language="text")
+        return
+    progress_bar.progress(100, text="Selesai!")
+    download_name = checkpoint.get("output_name") or get_clean_filename(
+        meta["original_name"], get_output_extension(job["out_format"]),
+    )
+    warn_if_oversize(output_path, checkpoint.get("size_limit_mb"))
+    stored, error_msg = store_session_output(token, input_path, output_path, download_name)
+    if not stored:
+        st.warning(error_msg + ". Hasil tetap bisa diunduh dari halaman ini.")
+    st.download_button(
+        label="Download Hasil",
+        data=load_file_bytes(output_path),
+        file_name=download_name,
+        use_container_width=True,
+    )
+
+
 def render_video_info(metadata):
     c1, c2, c3 = st.columns(3)
     c1.metric("Durasi", metadata.get("duration_text", "N/A"))
@@ -749,8 +4070,21 @@ def render_compression_controls(preset, video_metadata):
     st.markdown('<div class="section-title">Kompresi dan Kualitas</div>', unsafe_allow_html=True)
 
     # --- Format Output ---
-    fmt_label = st.selectbox("Format Output", list(OUTPUT_FORMATS.keys()), index=0)
-    settings["out_format"] = OUTPUT_FORMATS[fmt_label]
+    output_formats = get_output_formats()
+    fmt_label = st.selectbox(
+        "Format Output", list(output_formats.keys()), index=0,
+        help="HEVC dan AV1 menghasilkan file lebih kecil dengan encoding lebih lambat; "
+             "hanya muncul bila didukung ffmpeg di server.",
+    )
+    settings["out_format"] = output_formats[fmt_label]
+    # H.264 tetap default karena diputar di semua klien; HEVC hanya disarankan
+    suggested = preset.get("suggest_format")
+    if suggested and suggested in output_formats.values() and settings["out_format"] != suggested:
+        suggested_label = next(label for label, value in output_formats.items() if value == suggested)
+        st.caption(
+            "Pilih " + suggested_label + " untuk file lebih kecil, tetapi tidak semua perangkat "
+            "bisa memutarnya."
+        )
 
     # --- Smart Compression ---
     smart_mode = st.checkbox("Smart Compression (target ukuran file)", value=False)
@@ -761,17 +4095,24 @@ def render_compression_controls(preset, video_metadata):
             help="Masukkan target ukuran file hasil. Bitrate akan dihitung otomatis.",
         )
         settings["smart_target_mb"] = target_mb
+        if settings["out_format"] == "gif":
+            st.caption("Untuk GIF, fps, lebar, dithering, dan palet dipilih otomatis dari klip sampel.")
+        elif settings["out_format"] in ANIMATED_IMAGE_FORMATS:
+            st.caption("WebP dan AVIF animasi tidak punya kontrol bitrate; atur ukuran lewat kualitas di bawah.")
     else:
         settings["smart_target_mb"] = None
 
     if is_custom and not smart_mode:
-        settings["crf"] = st.slider(
-            "Level Kompresi (CRF)",
-            min_value=18,
-            max_value=36,
-            value=preset["crf"],
-            help="Nilai lebih tinggi = file lebih kecil. 18-22 hampir lossless, 28-32 ukuran minimal.",
-        )
+        # WebP/AVIF animasi memakai slider kualitasnya sendiri
+        settings["crf"] = preset["crf"]
+        if settings["out_format"] not in ("webp", "avif"):
+            settings["crf"] = st.slider(
+                "Level Kompresi (CRF)",
+                min_value=18,
+                max_value=36,
+                value=preset["crf"],
+                help="Nilai lebih tinggi = file lebih kecil. 18-22 hampir lossless, 28-32 ukuran minimal.",
+            )
         settings["preset"] = st.select_slider(
             "Kecepatan Encoding",
             options=SPEED_OPTIONS,
@@ -791,35 +4132,109 @@ def render_compression_controls(preset, video_metadata):
         st.info(
             "CRF: " + str(preset["crf"]) + " | Preset: " + preset["preset"]
             + " | Resolusi: " + preset["resolution"]
+            + (" | Batas: " + str(preset["max_size_mb"]) + " MB" if preset.get("max_size_mb") else "")
         )
     else:
         settings["crf"] = 28
         settings["preset"] = "medium"
         settings["resolution"] = preset.get("resolution", "720p")
 
+    settings["image_quality"] = None
+    if settings["out_format"] in ("webp", "avif"):
+        settings["image_quality"] = st.slider(
+            "Kualitas Gambar Animasi",
+            min_value=10,
+            max_value=100,
+            value=IMAGE_QUALITY_DEFAULT,
+            help="Nilai lebih rendah = file lebih kecil. Gambar animasi diputar otomatis dan berulang, "
+                 "tanpa audio, dengan " + str(GIF_DEFAULT_FPS) + " fps bila frame rate tidak diatur.",
+        )
+
     settings["mute_audio"] = st.checkbox("Nonaktifkan Audio")
 
-    # --- Estimasi Ukuran ---
-    if video_metadata and not smart_mode:
-        duration = video_metadata.get("duration", 0)
-        has_audio = video_metadata.get("has_audio", False) and not settings["mute_audio"]
-        if duration > 0:
-            est = estimate_output_size(
-                duration, settings["crf"], settings["resolution"],
-                has_audio, settings["out_format"],
+    settings["two_pass"] = False
+    if settings["out_format"] == "webm":
+        settings["two_pass"] = st.checkbox(
+            "Encoding two-pass",
+            value=False,
+            help="Analisis video dulu lalu encode ulang dengan alokasi bitrate lebih baik. "
+                 "Hasil lebih efisien, waktu encoding sekitar dua kali lipat.",
+        )
+
+    # --- Pratinjau Progresif ---
+    settings["progressive"] = False
+    settings["hls"] = False
+    # Fragmented MP4 hanya berlaku untuk kontainer MP4 (H.264, HEVC, AV1)
+    if get_output_extension(settings["out_format"]) == "mp4":
+        settings["progressive"] = st.checkbox(
+            "Pratinjau progresif",
+            value=False,
+            help="Tulis output secara bertahap (fragmented MP4) sehingga hasil bisa "
+                 "ditonton selagi encoding berjalan.",
+        )
+        if settings["progressive"]:
+            settings["hls"] = st.checkbox(
+                "Buat playlist HLS",
+                value=False,
+                help="Paketkan hasil juga sebagai playlist HLS (segmen fMP4).",
             )
-            st.caption("Estimasi ukuran hasil: **" + format_filesize(est) + "**")
 
     return settings
 
 
-def render_advanced_controls(preset, video_metadata):
+def render_size_estimate(settings, advanced, video_metadata):
+    """Estimasi ukuran hasil dengan durasi trim, fps, dan aspect ratio yang benar-benar dipilih."""
+    if not video_metadata or settings.get("smart_target_mb"):
+        return
+    duration = video_metadata.get("duration", 0)
+    if advanced.get("trim_start") or advanced.get("trim_end"):
+        duration = max((advanced.get("trim_end") or duration) - (advanced.get("trim_start") or 0), 0)
+    if duration <= 0:
+        return
+    has_audio = video_metadata.get("has_audio", False) and not settings["mute_audio"]
+    audio_kbps = AUDIO_BITRATE_KBPS
+    if can_copy_audio(video_metadata, settings["out_format"]):
+        audio_kbps = video_metadata["audio_bitrate"]
+    est_crf = settings["crf"]
+    if settings["image_quality"] is not None:
+        est_crf = image_quality_to_crf(settings["image_quality"])
+    est = estimate_output_size(
+        duration, est_crf, settings["resolution"],
+        has_audio, settings["out_format"], audio_kbps,
+        video_metadata, advanced.get("aspect_ratio"), advanced.get("target_fps"),
+    )
+    st.caption("Estimasi ukuran hasil: **" + format_filesize(est) + "**")
+
+
+def render_advanced_controls(preset, video_metadata, filmstrip=None, index=None):
     advanced = {}
 
     st.markdown('<div class="section-title">Pengaturan Lanjutan</div>', unsafe_allow_html=True)
 
     max_duration = video_metadata.get("duration", 600) if video_metadata else 600
 
+    strip_start, strip_end = None, None
+    if filmstrip:
+        st.image(filmstrip["sprite_path"])
+        strip_duration = filmstrip.get("duration") or max_duration
+        marks = list(filmstrip["timestamps"])
+        if strip_duration > marks[-1]:
+            marks.append(float(strip_duration))
+        if len(marks) > 1:
+            strip_start, strip_end = st.select_slider(
+                "Pilih rentang dari filmstrip",
+                options=marks,
+                value=(marks[0], marks[-1]),
+                format_func=format_duration,
+                help="Titik potong mengikuti keyframe sehingga pemotongan cepat dan akurat.",
+            )
+            if strip_end == marks[-1]:
+                strip_end = None
+    elif filmstrip_pending():
+        st.caption("Filmstrip sedang disiapkan...")
+    else:
+        st.caption("Filmstrip tidak tersedia untuk video ini. Gunakan kolom potong di bawah.")
+
     col_start, col_end = st.columns(2)
     with col_start:
         trim_start = st.number_input(
@@ -841,9 +4256,22 @@ def render_advanced_controls(preset, video_metadata):
             help="Isi 0 untuk memproses sampai akhir video.",
         )
 
+    if trim_start <= 0 and strip_start:
+        trim_start = strip_start
+    if trim_end <= 0 and strip_end:
+        trim_end = strip_end
+
     advanced["trim_start"] = trim_start if trim_start > 0 else None
     advanced["trim_end"] = trim_end if trim_end > 0 else None
 
+    if index is not None and (advanced["trim_start"] or advanced["trim_end"]):
+        keyframe = keyframe_at_or_before(index, trim_start)
+        range_kbps = index_bitrate(index, advanced["trim_start"], advanced["trim_end"]) // 1000
+        st.caption(
+            "Keyframe terdekat sebelum titik mulai: " + f"{keyframe:.2f}" + " s · bitrate sumber pada rentang ini: "
+            + str(range_kbps) + " kbps"
+        )
+
     is_custom = preset["name"] == "Custom"
 
     col_fps, col_ratio = st.columns(2)
@@ -867,16 +4295,68 @@ def render_advanced_controls(preset, video_metadata):
 
     advanced["max_bitrate"] = preset.get("max_bitrate")
 
+    advanced["scene_aware"] = st.checkbox(
+        "Alokasi bitrate per adegan",
+        value=False,
+        help="Deteksi pergantian adegan lalu pindahkan bitrate dari bagian statis ke bagian "
+             "yang banyak gerak. Hanya untuk MP4 (H.264).",
+    )
+
+    advanced["auto_crop"] = st.checkbox(
+        "Hapus bingkai hitam otomatis",
+        value=False,
+        help="Deteksi letterbox/pillarbox di beberapa titik video lalu potong sebelum encoding.",
+    )
+
+    advanced["auto_decimate"] = st.checkbox(
+        "Buang frame duplikat otomatis",
+        value=False,
+        help="Untuk rekaman layar dan video slide: bila sebagian besar frame identik, "
+             "frame duplikat dibuang dan video disimpan dengan frame rate variabel.",
+    )
+
+    advanced["auto_denoise"] = st.checkbox(
+        "Kurangi noise otomatis",
+        value=False,
+        help="Ukur noise di beberapa frame; bila sumber berbintik (mis. rekaman HP di tempat gelap), "
+             "noise dibuang sebelum scaling agar bitrate tidak habis untuk grain. Dilewati untuk sumber bersih.",
+    )
+
+    advanced["quality_map"] = st.checkbox(
+        "Analisis kualitas setelah kompresi",
+        value=False,
+        help="Tampilkan heatmap SSIM dan kurva kualitas hasil dibanding video asli.",
+    )
+
     return advanced
 
 
+def render_multi_export(settings):
+    """Pilih beberapa platform tambahan untuk diekspor dalam satu proses."""
+    if settings.get("out_format") not in MULTI_OUTPUT_FORMATS:
+        return []
+    multi_mode = st.checkbox(
+        "Ekspor ke beberapa platform sekaligus",
+        value=False,
+        help="Video hanya didecode sekali, lalu semua target diencode paralel dalam satu proses.",
+    )
+    if not multi_mode:
+        return []
+    choices = [name for name in PLATFORM_PRESETS if name != "Custom"]
+    return st.multiselect("Platform Target", choices, default=choices[:2])
+
+
 def render_comparison_slider(input_path, output_path, duration):
     """Render before/after image comparison slider menggunakan iframe component."""
     import streamlit.components.v1 as components
 
     timestamp = min(duration * 0.3, 5.0) if duration > 0 else 1.0
 
-    before_b64 = extract_frame(input_path, timestamp)
+    index = load_packet_index(input_path)
+    if index is not None:
+        # Titik banding di keyframe sumber sehingga frame asli cukup didecode satu
+        timestamp = keyframe_at_or_before(index, timestamp)
+    before_b64 = extract_frame(input_path, timestamp, index)
     after_b64 = extract_frame(output_path, timestamp)
 
     if not before_b64 or not after_b64:
@@ -1073,7 +4553,44 @@ body { background: transparent; overflow: hidden; font-family: 'Inter', sans-ser
     components.html(html_final, height=800, scrolling=False)
 
 
-def render_before_after(input_path, output_path, original_size, uploaded_name, video_metadata, out_format="mp4"):
+def render_quality_map(input_path, output_path, duration, video_metadata, advanced):
+    """Tampilkan heatmap SSIM dan kurva kualitas per detik."""
+    with st.spinner("Menganalisis kualitas..."):
+        quality = compute_quality_map(
+            input_path, output_path, duration, video_metadata,
+            advanced.get("trim_start"), advanced.get("trim_end"), advanced.get("aspect_ratio"),
+            advanced.get("crop_rect"),
+        )
+    if not quality:
+        return
+    st.markdown('<div class="section-title">Analisis Kualitas</div>', unsafe_allow_html=True)
+    st.image(
+        quality["overlay"],
+        caption="Area merah = detail yang paling banyak hilang · SSIM rata-rata "
+                + f"{quality['mean_ssim']:.3f}",
+    )
+    st.line_chart({"SSIM": [value for _, value in quality["curve"]]})
+    step = quality["curve"][1][0] if len(quality["curve"]) > 1 else 1.0
+    st.caption("Kurva SSIM per sampel, satu sampel setiap " + f"{step:.1f}" + " detik.")
+
+
+def warn_if_oversize(output_path, size_limit_mb, label=None):
+    """Peringatkan bila hasil akhir tetap melebihi batas ukuran (target Smart Compression atau batas platform)."""
+    if not size_limit_mb or not os.path.exists(output_path):
+        return
+    size = os.path.getsize(output_path)
+    limit = size_limit_mb * 1024 * 1024
+    if size > limit:
+        st.warning(
+            (label + ": " if label else "") + "Ukuran hasil " + format_filesize(size) + " melebihi batas "
+            + format_filesize(limit) + ". Coba turunkan resolusi atau kualitas lalu kompres ulang."
+        )
+
+
+def render_before_after(
+    input_path, output_path, original_size, uploaded_name, video_metadata, out_format="mp4", hls_dir=None,
+    advanced=None,
+):
     compressed_size = os.path.getsize(output_path)
     reduction = calculate_reduction(original_size, compressed_size)
 
@@ -1101,15 +4618,20 @@ def render_before_after(input_path, output_path, original_size, uploaded_name, v
     )
 
     duration = video_metadata.get("duration", 0) if video_metadata else 0
-    if out_format != "gif":
+    is_image = out_format in ANIMATED_IMAGE_FORMATS
+    if not is_image:
         render_comparison_slider(input_path, output_path, duration)
+        if advanced and advanced.get("quality_map"):
+            start = advanced.get("trim_start") or 0
+            end = advanced.get("trim_end") or duration
+            render_quality_map(input_path, output_path, max(end - start, 0), video_metadata, advanced)
 
     st.markdown('<div class="section-title">Ukuran File</div>', unsafe_allow_html=True)
     col_s1, col_s2 = st.columns(2)
     col_s1.metric("Asli", format_filesize(original_size))
     col_s2.metric("Hasil", format_filesize(compressed_size), delta="-" + f"{reduction:.1f}" + "%", delta_color="normal")
 
-    if out_format != "gif":
+    if not is_image:
         output_meta = probe_video(output_path)
         if video_metadata and output_meta:
             st.markdown('<div class="section-title">Detail Teknis</div>', unsafe_allow_html=True)
@@ -1133,19 +4655,75 @@ def render_before_after(input_path, output_path, original_size, uploaded_name, v
 
     if out_format == "gif":
         st.image(output_path, caption="Hasil GIF")
+    elif is_image:
+        # st.image mengonversi WebP/AVIF ke gambar diam; tampilkan file aslinya lewat tag img
+        st.markdown(
+            '<img src="data:' + MIME_TYPES[out_format] + ';base64,'
+            + base64.b64encode(load_file_bytes(output_path)).decode("ascii")
+            + '" style="max-width:100%;border-radius:12px">',
+            unsafe_allow_html=True,
+        )
+        st.caption("Hasil " + out_format.upper() + " animasi")
     else:
         st.video(output_path)
 
-    mime_map = {"mp4": "video/mp4", "webm": "video/webm", "gif": "image/gif"}
-    download_name = get_clean_filename(uploaded_name, out_format)
+    out_ext = get_output_extension(out_format)
+    download_name = get_clean_filename(uploaded_name, out_ext)
     file_data = load_file_bytes(output_path)
     st.download_button(
         label="Download Hasil",
         data=file_data,
         file_name=download_name,
-        mime=mime_map.get(out_format, "video/mp4"),
+        mime=MIME_TYPES.get(out_ext, "video/mp4"),
+    )
+
+    if hls_dir and os.path.isdir(hls_dir):
+        st.download_button(
+            label="Download Playlist HLS (.zip)",
+            data=package_hls(hls_dir),
+            file_name=get_clean_filename(uploaded_name, "zip", "_hls"),
+            mime="application/zip",
+        )
+
+
+def render_multi_results(results, original_size, uploaded_name, out_format="mp4"):
+    """Tampilkan hasil ekspor multi platform beserta tombol download masing-masing."""
+    history = st.session_state.get("compression_history", [])
+    st.markdown(
+        '<div class="result-panel">'
+        '<h3>Kompresi Berhasil</h3>'
+        '<div class="result-stats">'
+        + str(len(results)) + ' platform dari ' + format_filesize(original_size)
+        + '</div>'
+        '</div>',
+        unsafe_allow_html=True,
     )
 
+    out_ext = get_output_extension(out_format)
+    for preset_name, output_path in results:
+        compressed_size = os.path.getsize(output_path)
+        reduction = calculate_reduction(original_size, compressed_size)
+        history.append({
+            "name": uploaded_name + " (" + preset_name + ")",
+            "original": format_filesize(original_size),
+            "result": format_filesize(compressed_size),
+            "reduction": f"-{reduction:.1f}%",
+        })
+
+        st.markdown('<div class="section-title">' + preset_name + '</div>', unsafe_allow_html=True)
+        col_m, col_d = st.columns(2)
+        col_m.metric("Hasil", format_filesize(compressed_size), delta="-" + f"{reduction:.1f}" + "%", delta_color="normal")
+        with col_d:
+            st.download_button(
+                label="Download " + preset_name,
+                data=load_file_bytes(output_path),
+                file_name=get_clean_filename(uploaded_name, out_ext, "_" + get_preset_slug(preset_name)),
+                mime=MIME_TYPES.get(out_ext, "video/mp4"),
+                key="download_" + get_preset_slug(preset_name),
+            )
+
+    st.session_state["compression_history"] = history
+
 
 def render_features():
     c1, c2, c3 = st.columns(3)
@@ -1207,8 +4785,25 @@ def main():
             input_path = st.session_state["input_path"]
             original_size = st.session_state["input_size"]
         else:
+            if UPLOAD_URL:
+                with st.expander("Upload file besar (maks " + format_filesize(UPLOAD_MAX_SIZE) + ", bisa dilanjutkan)"):
+                    # Nonce per halaman: tombol di bawah hanya memuat file yang diupload dari halaman ini
+                    if "upload_nonce" not in st.session_state:
+                        st.session_state["upload_nonce"] = uuid.uuid4().hex
+                    render_chunked_upload(session_token, st.session_state["upload_nonce"])
+                    if st.button("Gunakan File Upload", use_container_width=True):
+                        recent = find_recent_session(session_token, st.session_state["upload_nonce"])
+                        if recent:
+                            with st.spinner("Memuat file upload..."):
+                                success, error_msg = activate_session(recent)
+                            if success:
+                                st.rerun()
+                            st.error(error_msg)
+                        else:
+                            st.warning("Upload belum selesai.")
+
             recent = find_recent_session(session_token)
-            if recent and os.path.exists(recent.get("file_path", "")):
+            if recent:
                 st.info("Kami menemukan sesi sebelumnya.")
                 col_info, col_btn = st.columns([3, 1])
                 with col_info:
@@ -1218,14 +4813,43 @@ def main():
                     )
                     age_min = int((time.time() - recent["timestamp"]) / 60)
                     st.caption(str(age_min) + " menit yang lalu")
+                    checkpoint = find_checkpoint(recent["file_key"])
+                    # Manifest lama belum mencatat semua parameter dan tidak bisa dilanjutkan langsung
+                    if checkpoint and "params" not in checkpoint:
+                        checkpoint = None
+                    if checkpoint:
+                        job = checkpoint["job"]
+                        st.caption(
+                            "Encode terputus: " + str(len(checkpoint["done"])) + " dari "
+                            + str(checkpoint["segments"]) + " segmen sudah tersimpan (CRF " + str(job["crf"])
+                            + ", preset " + job["preset"] + ", " + job["resolution"] + "). Klik Lanjutkan Encode "
+                            + "untuk menyelesaikannya dengan pengaturan yang sama."
+                        )
+                resume = False
                 with col_btn:
+                    restore_error = None
                     if st.button("Lanjutkan", use_container_width=True):
-                        st.session_state["input_path"] = recent["file_path"]
-                        st.session_state["input_name"] = recent["original_name"]
-                        st.session_state["input_size"] = recent["file_size"]
-                        st.session_state["input_size_raw"] = recent["file_size"]
-                        st.session_state.pop("video_metadata", None)
-                        st.rerun()
+                        with st.spinner("Memulihkan sesi..."):
+                            success, restore_error = activate_session(recent)
+                        if success:
+                            st.rerun()
+                    if checkpoint:
+                        resume = st.button("Lanjutkan Encode", type="primary", use_container_width=True)
+                if restore_error:
+                    st.error(restore_error)
+                if resume:
+                    resume_checkpoint(recent, checkpoint, session_token)
+                if recent.get("output_key") and st.checkbox("Tampilkan hasil kompresi terakhir", value=False):
+                    try:
+                        output_path = restore_session_file(recent, "output_key")
+                    except OSError as err:
+                        st.error("Gagal mengambil hasil kompresi terakhir dari storage: " + str(err))
+                    else:
+                        st.download_button(
+                            label="Download Hasil Terakhir",
+                            data=load_file_bytes(output_path),
+                            file_name=recent.get("output_name", recent["output_key"]),
+                        )
             else:
                 st.info("Upload video untuk memulai kompresi.")
 
@@ -1239,15 +4863,22 @@ def main():
         )
 
         if file_changed:
-            with st.spinner("Menyimpan video..."):
-                input_path = save_upload_to_temp(uploaded_file, session_token)
-                original_size = os.path.getsize(input_path)
+            start_job_trace("upload", token=session_token, name=uploaded_file.name, size=uploaded_file.size)
+            upload_status = "error"
+            try:
+                with st.spinner("Menyimpan video..."):
+                    input_path = save_upload_to_temp(uploaded_file, session_token)
+                    original_size = os.path.getsize(input_path)
+                upload_status = "ok"
+            finally:
+                finish_job_trace(upload_status)
 
             st.session_state["input_path"] = input_path
             st.session_state["input_name"] = uploaded_file.name
             st.session_state["input_size"] = original_size
             st.session_state["input_size_raw"] = uploaded_file.size
             st.session_state.pop("video_metadata", None)
+            start_filmstrip(input_path)
         else:
             input_path = st.session_state["input_path"]
             original_size = st.session_state["input_size"]
@@ -1257,6 +4888,10 @@ def main():
     st.success("File terpilih: **" + uploaded_name + "** (**" + format_filesize(original_size) + "**)")
 
     video_metadata = st.session_state.get("video_metadata")
+    spec = st.session_state.get("speculation")
+    if video_metadata is None and spec is not None and spec["input_path"] == input_path and spec["metadata"]:
+        video_metadata = spec["metadata"]
+        st.session_state["video_metadata"] = video_metadata
 
     show_info = st.checkbox("Tampilkan info video", value=False)
     if show_info:
@@ -1269,10 +4904,13 @@ def main():
 
     preset = render_platform_presets()
     settings = render_compression_controls(preset, video_metadata)
+    multi_targets = render_multi_export(settings)
 
     show_advanced = st.checkbox("Tampilkan pengaturan lanjutan", value=False)
     if show_advanced:
-        advanced = render_advanced_controls(preset, video_metadata)
+        advanced = render_advanced_controls(
+            preset, video_metadata, get_filmstrip(input_path), load_packet_index(input_path),
+        )
     else:
         advanced = {
             "trim_start": None,
@@ -1280,82 +4918,345 @@ def main():
             "target_fps": preset.get("fps"),
             "aspect_ratio": preset.get("aspect"),
             "max_bitrate": preset.get("max_bitrate"),
+            "scene_aware": False,
+            "auto_crop": False,
+            "auto_decimate": False,
+            "auto_denoise": False,
+            "quality_map": False,
         }
 
-    st.write("")
+    render_size_estimate(settings, advanced, video_metadata)
 
-    if st.button("Mulai Kompresi", use_container_width=True):
-        out_fmt = settings.get("out_format", "mp4")
-        output_path = input_path + "_out." + out_fmt
-        _temp_files.append(output_path)
+    # Batas ukuran: target Smart Compression atau batas kirim platform
+    size_limit_mb = settings.get("smart_target_mb") or preset.get("max_size_mb")
+    spec = update_speculation(input_path, video_metadata, settings, advanced, size_limit_mb, multi_targets)
 
-        if video_metadata is None:
-            with st.spinner("Membaca metadata..."):
-                video_metadata = probe_video(input_path)
-                st.session_state["video_metadata"] = video_metadata
+    st.write("")
 
-        total_duration = 0
-        if video_metadata:
-            total_duration = video_metadata.get("duration", 0)
-            if advanced.get("trim_start") or advanced.get("trim_end"):
-                start = advanced.get("trim_start") or 0
-                end = advanced.get("trim_end") or total_duration
-                total_duration = max(end - start, 0)
-
-        # Smart compression: hitung bitrate dari target ukuran
-        effective_max_bitrate = advanced.get("max_bitrate")
-        if settings.get("smart_target_mb") and total_duration > 0:
-            has_audio = video_metadata.get("has_audio", False) if video_metadata else False
-            smart_br = calculate_target_bitrate(
-                settings["smart_target_mb"], total_duration,
-                has_audio and not settings["mute_audio"],
-            )
-            if smart_br:
-                effective_max_bitrate = smart_br
+    if st.button("Mulai Kompresi", use_container_width=True):
+        start_job_trace(
+            "compress", token=session_token, name=uploaded_name, size=original_size,
+            preset=preset["name"], settings=settings, advanced=advanced, multi=multi_targets,
+        )
+        success = False
+        try:
+            out_fmt = settings.get("out_format", "mp4")
+            output_path = input_path + "_out." + get_output_extension(out_fmt)
+            _temp_files.append(output_path)
+
+            # Kerja spekulatif dengan pengaturan yang sama dipakai ulang; yang belum sempat berjalan dibatalkan
+            if spec is not None and (spec["consumed"] or spec["future"].cancel()):
+                spec = None
+            plan = None
+            if spec is not None:
+                with st.spinner("Menganalisis video..."):
+                    spec["plan_ready"].wait()
+                plan = spec["plan"]
+                if video_metadata is None and spec["metadata"]:
+                    video_metadata = spec["metadata"]
+                    st.session_state["video_metadata"] = video_metadata
+
+            if video_metadata is None:
+                with st.spinner("Membaca metadata..."):
+                    video_metadata = probe_video(input_path)
+                    st.session_state["video_metadata"] = video_metadata
+
+            if plan is None:
+                with st.spinner("Menganalisis video..."):
+                    plan = plan_encode(
+                        input_path, video_metadata, settings, advanced, bool(multi_targets), size_limit_mb,
+                    )
+            total_duration = plan["duration"]
+            copy_audio = plan["copy_audio"]
+            audio_kbps = plan["audio_kbps"]
+            has_audio = plan["has_audio"]
+            effective_max_bitrate = plan["max_bitrate"]
+            crop_rect = plan["crop_rect"]
+            decimate = plan["decimate"]
+            scene_zones = plan["scene_zones"]
+            out_width = plan["out_width"]
+
+            if crop_rect:
+                st.caption(
+                    "Bingkai hitam dipotong: " + video_metadata["resolution_text"]
+                    + " → " + str(crop_rect["w"]) + "x" + str(crop_rect["h"])
+                )
+            advanced["crop_rect"] = crop_rect
+            if decimate:
+                st.caption(
+                    f"{plan['duplicate_ratio'] * 100:.0f}" + "% frame identik terdeteksi, "
+                    + "frame duplikat dibuang (frame rate variabel)."
+                )
+            if plan["denoise"]:
+                st.caption(
+                    "Noise terdeteksi (σ " + f"{plan['noise_sigma']:.1f}" + "): denoise "
+                    + build_denoise_filter(plan["denoise"], settings["preset"])["filter"]
+                    + " " + plan["denoise"] + " sebelum scaling, bitrate sampel turun "
+                    + f"{plan['denoise_saving'] * 100:.0f}" + "%."
+                )
+            elif plan["denoise_saving"] is not None:
+                st.caption(
+                    "Noise terdeteksi (σ " + f"{plan['noise_sigma']:.1f}" + "), tetapi denoise hanya menghemat "
+                    + f"{plan['denoise_saving'] * 100:.0f}" + "% pada sampel sehingga dilewati."
+                )
+            elif plan["noise_sigma"] is not None and plan["noise_sigma"] < DENOISE_LEVELS[0][0]:
+                st.caption("Sumber bersih (σ " + f"{plan['noise_sigma']:.1f}" + "), denoise dilewati.")
+            if scene_zones:
+                st.caption(str(len(plan["scenes"])) + " adegan terdeteksi, bitrate dialokasikan per adegan.")
+            if plan["gif_plan"]:
+                st.caption(
+                    "GIF: " + describe_gif_options(plan["gif_plan"]["options"]) + ". Perkiraan ukuran "
+                    + format_filesize(plan["gif_plan"]["predicted"])
+                    + " (batas " + format_filesize(size_limit_mb * 1024 * 1024) + ")."
+                )
 
-        progress_bar = st.progress(0, text="Mempersiapkan encoding...")
-        status_text = st.empty()
+            progress_bar = st.progress(0, text="Mempersiapkan encoding...")
+            status_text = st.empty()
+            preview_slot = st.empty()
 
-        def on_progress(pct, speed="", eta=""):
-            progress_bar.progress(
-                min(int(pct * 100), 99),
-                text="Encoding: " + str(int(pct * 100)) + "%",
-            )
-            info_parts = []
-            if speed:
-                info_parts.append("Kecepatan: " + speed)
-            if eta:
-                info_parts.append("Sisa: ~" + eta)
-            if info_parts:
-                status_text.caption(" · ".join(info_parts))
-
-        success, error_msg = compress_video(
-            input_path=input_path,
-            output_path=output_path,
-            crf=settings["crf"],
-            preset=settings["preset"],
-            mute_audio=settings["mute_audio"],
-            resolution=settings["resolution"],
-            trim_start=advanced.get("trim_start"),
-            trim_end=advanced.get("trim_end"),
-            target_fps=advanced.get("target_fps"),
-            aspect_ratio=advanced.get("aspect_ratio"),
-            max_bitrate=effective_max_bitrate,
-            progress_callback=on_progress,
-            duration_seconds=total_duration,
-            out_format=out_fmt,
-        )
+            def on_progress(pct, speed="", eta=""):
+                progress_bar.progress(
+                    min(int(pct * 100), 99),
+                    text="Encoding: " + str(int(pct * 100)) + "%",
+                )
+                info_parts = []
+                if speed:
+                    info_parts.append("Kecepatan: " + speed)
+                if eta:
+                    info_parts.append("Sisa: ~" + eta)
+                if info_parts:
+                    status_text.caption(" · ".join(info_parts))
+
+            preview_state = {"stopped": False}
+
+            def on_preview(encoded_seconds):
+                if preview_state["stopped"] or not os.path.exists(output_path):
+                    return
+                # Setiap pratinjau mengirim ulang seluruh hasil sementara ke browser; berhenti di batas ukuran
+                if os.path.getsize(output_path) > PREVIEW_MAX_BYTES:
+                    preview_state["stopped"] = True
+                    with preview_slot.container():
+                        st.caption(
+                            "Pratinjau berhenti di " + format_duration(encoded_seconds) + " karena hasil sementara "
+                            "sudah lebih dari " + format_filesize(PREVIEW_MAX_BYTES) + "."
+                        )
+                    return
+                with open(output_path, "rb") as f:
+                    partial = f.read()
+                with preview_slot.container():
+                    st.caption("Pratinjau " + format_duration(encoded_seconds) + " pertama")
+                    st.video(partial, format=MIME_TYPES.get(get_output_extension(out_fmt), "video/mp4"))
+
+            hls_dir = input_path + "_hls" if settings.get("hls") else None
+            if hls_dir:
+                _temp_files.append(hls_dir)
+
+            if multi_targets:
+                targets = []
+                for preset_name in multi_targets:
+                    target = dict(PLATFORM_PRESETS[preset_name])
+                    target["output_path"] = (
+                        input_path + "_" + get_preset_slug(preset_name) + "." + get_output_extension(out_fmt)
+                    )
+                    if settings.get("smart_target_mb") and effective_max_bitrate:
+                        target["max_bitrate"] = effective_max_bitrate
+                    target["out_width"] = planned_output_width(
+                        video_metadata, crop_rect, target["resolution"], target.get("aspect"),
+                    )
+                    _temp_files.append(target["output_path"])
+                    targets.append(target)
+
+                job_cost = estimate_job_cost(total_duration, [t["preset"] for t in targets])
+                with encode_slot(session_token, job_cost, status_text):
+                    success, error_msg = compress_video_multi(
+                        input_path=input_path,
+                        targets=targets,
+                        mute_audio=settings["mute_audio"],
+                        trim_start=advanced.get("trim_start"),
+                        trim_end=advanced.get("trim_end"),
+                        progress_callback=on_progress,
+                        duration_seconds=total_duration,
+                        out_format=out_fmt,
+                        fragmented=settings.get("progressive", False),
+                        copy_audio=copy_audio,
+                        crop_rect=crop_rect,
+                        decimate=decimate,
+                        source_size=get_source_size(video_metadata),
+                        denoise=plan["denoise"],
+                        source_fps=get_source_fps(video_metadata),
+                    )
 
-        if success:
-            progress_bar.progress(100, text="Selesai!")
-            status_text.empty()
-            render_before_after(input_path, output_path, original_size, uploaded_name, video_metadata, out_fmt)
-        else:
-            progress_bar.empty()
-            status_text.empty()
-            st.error("Terjadi kesalahan saat memproses video.")
-            with st.container():
-                st.code(error_msg, language="text")
+                if success:
+                    progress_bar.progress(100, text="Selesai!")
+                    status_text.empty()
+                    # Hasil decimate dan denoise jauh lebih kecil dari biasanya, dan hasil yang dibatasi
+                    # bitrate maks bukan hasil CRF murni; jangan dipakai melatih model ukuran
+                    if not decimate and not plan["denoise"]:
+                        for target in targets:
+                            if target.get("max_bitrate"):
+                                continue
+                            record_size_sample(
+                                video_metadata, target["crf"], target["resolution"], out_fmt,
+                                target.get("aspect"), target.get("fps"), total_duration,
+                                os.path.getsize(target["output_path"]), audio_kbps if has_audio else 0,
+                            )
+                    results = [(name, t["output_path"]) for name, t in zip(multi_targets, targets)]
+                    for name, target in zip(multi_targets, targets):
+                        warn_if_oversize(
+                            target["output_path"], settings.get("smart_target_mb") or target.get("max_size_mb"), name,
+                        )
+                    render_multi_results(results, original_size, uploaded_name, out_fmt)
+                else:
+                    progress_bar.empty()
+                    status_text.empty()
+                    st.error("Terjadi kesalahan saat memproses video.")
+                    with st.container():
+                        st.code(error_msg, language="text")
+            else:
+                encode_crf = settings["crf"]
+                size_capped = bool(effective_max_bitrate)
+                success, error_msg = False, None
+                if spec is not None and spec["encoding"]:
+                    status_text.caption("Melanjutkan encode yang sudah berjalan di background")
+                    success, error_msg = await_speculation(spec, output_path, on_progress)
+                if not success:
+                    # Two-pass menjalankan encoder dua kali, jadi biayanya ikut dua kali
+                    encode_passes = 2 if settings.get("two_pass") and out_fmt == "webm" else 1
+                    job_cost = estimate_job_cost(total_duration, [settings["preset"]] * encode_passes)
+                    # Segmen tidak punya guard proyeksi ukuran: batas ukuran dipasang sebagai bitrate maks sejak awal
+                    segment_max_bitrate = effective_max_bitrate
+                    if size_limit_mb and total_duration > 0:
+                        segment_max_bitrate = cap_bitrate_for_size(
+                            effective_max_bitrate, size_limit_mb, total_duration, audio_kbps if has_audio else 0,
+                        )
+                    with encode_slot(session_token, job_cost, status_text):
+                        if should_distribute(total_duration, out_fmt, bool(hls_dir), scene_zones):
+                            status_text.caption("Encoding terdistribusi di " + str(len(WORKER_NODES)) + " worker")
+                            size_capped = bool(segment_max_bitrate)
+                            success, error_msg = compress_video_distributed(
+                                input_path=input_path,
+                                output_path=output_path,
+                                crf=settings["crf"],
+                                preset=settings["preset"],
+                                mute_audio=settings["mute_audio"],
+                                resolution=settings["resolution"],
+                                trim_start=advanced.get("trim_start"),
+                                trim_end=advanced.get("trim_end"),
+                                target_fps=advanced.get("target_fps"),
+                                aspect_ratio=advanced.get("aspect_ratio"),
+                                max_bitrate=segment_max_bitrate,
+                                progress_callback=on_progress,
+                                duration_seconds=total_duration,
+                                out_format=out_fmt,
+                                fragmented=settings.get("progressive", False),
+                                copy_audio=copy_audio,
+                                crop_rect=crop_rect,
+                                decimate=decimate,
+                                out_width=out_width,
+                                two_pass=settings.get("two_pass", False),
+                                source_size=get_source_size(video_metadata),
+                                denoise=plan["denoise"],
+                                source_fps=get_source_fps(video_metadata),
+                            )
+                        elif should_checkpoint(total_duration, settings["preset"], out_fmt, bool(hls_dir), scene_zones):
+                            status_text.caption(
+                                "Encoding per segmen dengan checkpoint (bisa dilanjutkan setelah restart)"
+                            )
+                            size_capped = bool(segment_max_bitrate)
+                            success, error_msg = compress_video_checkpointed(
+                                input_path=input_path,
+                                output_path=output_path,
+                                crf=settings["crf"],
+                                preset=settings["preset"],
+                                mute_audio=settings["mute_audio"],
+                                resolution=settings["resolution"],
+                                trim_start=advanced.get("trim_start"),
+                                trim_end=advanced.get("trim_end"),
+                                target_fps=advanced.get("target_fps"),
+                                aspect_ratio=advanced.get("aspect_ratio"),
+                                max_bitrate=segment_max_bitrate,
+                                progress_callback=on_progress,
+                                duration_seconds=total_duration,
+                                out_format=out_fmt,
+                                fragmented=settings.get("progressive", False),
+                                copy_audio=copy_audio,
+                                crop_rect=crop_rect,
+                                decimate=decimate,
+                                out_width=out_width,
+                                two_pass=settings.get("two_pass", False),
+                                source_size=get_source_size(video_metadata),
+                                denoise=plan["denoise"],
+                                source_fps=get_source_fps(video_metadata),
+                                meta_key=session_meta_key(session_token, pathlib.Path(input_path).stem),
+                                size_limit_mb=size_limit_mb,
+                                output_name=get_clean_filename(uploaded_name, get_output_extension(out_fmt)),
+                            )
+                        else:
+                            # Percobaan terakhir berjalan tanpa guard agar selalu ada hasil
+                            encode_max_bitrate = effective_max_bitrate
+                            for attempt in range(SIZE_RETUNE_MAX_ATTEMPTS + 1):
+                                size_guard = None
+                                if size_limit_mb and total_duration > 0 and attempt < SIZE_RETUNE_MAX_ATTEMPTS:
+                                    size_guard = {"limit": size_limit_mb * 1024 * 1024}
+                                success, error_msg = compress_video(
+                                    input_path=input_path,
+                                    output_path=output_path,
+                                    crf=encode_crf,
+                                    max_bitrate=encode_max_bitrate,
+                                    progress_callback=on_progress,
+                                    duration_seconds=total_duration,
+                                    hls_dir=hls_dir,
+                                    preview_callback=on_preview if settings.get("progressive") else None,
+                                    size_guard=size_guard,
+                                    **encode_options(settings, advanced, plan, video_metadata),
+                                )
+
+                                if success or not size_guard or "projected" not in size_guard:
+                                    break
+                                new_crf, new_max_bitrate = retune_for_size(
+                                    encode_crf, size_guard["limit"], total_duration, audio_kbps if has_audio else 0,
+                                )
+                                st.caption(
+                                    "Proyeksi ukuran " + format_filesize(size_guard["projected"]) + " melebihi batas "
+                                    + format_filesize(size_guard["limit"]) + " setelah "
+                                    + format_duration(size_guard["encoded_seconds"]) + "; encode ulang dengan CRF "
+                                    + str(new_crf)
+                                    + (" dan bitrate maks " + new_max_bitrate if new_max_bitrate else "") + "."
+                                )
+                                encode_crf, encode_max_bitrate = new_crf, new_max_bitrate or encode_max_bitrate
+                                size_capped = size_capped or bool(new_max_bitrate)
+
+                preview_slot.empty()
+                if success:
+                    progress_bar.progress(100, text="Selesai!")
+                    status_text.empty()
+                    # Hasil yang dibatasi bitrate maks bukan hasil CRF murni
+                    if not decimate and not plan["denoise"] and not size_capped:
+                        record_size_sample(
+                            video_metadata, encode_crf, settings["resolution"], out_fmt,
+                            advanced.get("aspect_ratio"), advanced.get("target_fps"), total_duration,
+                            os.path.getsize(output_path), audio_kbps if has_audio else 0,
+                        )
+                    warn_if_oversize(output_path, size_limit_mb)
+                    stored, store_error = store_session_output(
+                        session_token, input_path, output_path,
+                        get_clean_filename(uploaded_name, get_output_extension(out_fmt)),
+                    )
+                    if not stored:
+                        st.warning(store_error + ". Hasil tetap bisa diunduh dari halaman ini.")
+                    render_before_after(
+                        input_path, output_path, original_size, uploaded_name, video_metadata, out_fmt, hls_dir,
+                        advanced,
+                    )
+                else:
+                    progress_bar.empty()
+                    status_text.empty()
+                    st.error("Terjadi kesalahan saat memproses video.")
+                    with st.container():
+                        st.code(error_msg, language="text")
+        finally:
+            # Rerun Streamlit atau exception di tengah encode tetap menutup trace job ini
+            finish_job_trace("ok" if success else "error")
 
     render_history()
     render_footer()
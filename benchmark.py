@@ -0,0 +1,207 @@
+"""
+Benchmark encoder Kompres.
+
+Membuat klip sintetis (atau memakai file sendiri lewat --source), lalu
+mengompresnya dengan setiap format output yang didukung ffmpeg terpasang
+dan mencetak tabel waktu encoding, kecepatan, dan ukuran hasil.
+
+Dengan --filters, yang diukur adalah rantai filter geometri (tanpa encode):
+rantai lama (scale, crop, scale ulang, fps) dibanding rantai hasil
+plan_geometry untuk setiap preset platform, dalam milidetik CPU per frame.
+
+Pemakaian:
+    python benchmark.py
+    python benchmark.py --source video.mp4 --preset slow --resolution 1080p
+    python benchmark.py --filters --size 1920x1080
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+import ffmpeg
+
+import app
+
+FILTER_BENCH_FRAMES = 90
+FILTER_BENCH_RUNS = 5
+
+
+def make_source(path, duration, size):
+    """Buat klip uji dengan gerakan dan noise agar encoder punya pekerjaan nyata."""
+    subprocess.run(
+        [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "lavfi", "-i", "testsrc2=size=" + size + ":rate=30:duration=" + str(duration),
+            "-f", "lavfi", "-i", "sine=frequency=440:duration=" + str(duration),
+            "-vf", "noise=alls=4:allf=t",
+            "-c:v", "libx264", "-preset", "ultrafast", "-crf", "12",
+            "-c:a", "aac", "-b:a", "128k", "-shortest", path,
+        ],
+        check=True,
+    )
+
+
+def run_case(source, out_dir, label, out_format, crf, preset, resolution, duration, two_pass=False):
+    output_path = os.path.join(out_dir, "bench_" + out_format + "." + app.get_output_extension(out_format))
+    start = time.time()
+    success, error = app.compress_video(
+        input_path=source,
+        output_path=output_path,
+        crf=crf,
+        preset=preset,
+        mute_audio=False,
+        resolution=resolution,
+        out_format=out_format,
+        two_pass=two_pass,
+    )
+    elapsed = time.time() - start
+    if not success:
+        return {"label": label, "error": (error or "").strip().splitlines()[-1:]}
+    return {
+        "label": label,
+        "seconds": elapsed,
+        "speed": duration / elapsed if elapsed > 0 else 0,
+        "size": os.path.getsize(output_path),
+    }
+
+
+def legacy_filters(video, resolution, aspect_ratio, target_fps):
+    """Rantai filter sebelum plan_geometry, sebagai pembanding."""
+    if resolution in app.RESOLUTION_MAP:
+        video = video.filter("scale", "trunc(oh*a/2)*2", app.RESOLUTION_MAP[resolution])
+    else:
+        video = video.filter("scale", "trunc(iw/2)*2", "trunc(ih/2)*2")
+    ratio_map = {"16:9": "16/9", "9:16": "9/16", "1:1": "1", "4:3": "4/3"}
+    if aspect_ratio in ratio_map:
+        r = ratio_map[aspect_ratio]
+        video = video.filter("crop", "if(gt(iw/ih," + r + "),ih*" + r + ",iw)", "if(gt(iw/ih," + r + "),ih,iw/(" + r + "))")
+        video = video.filter("scale", "trunc(iw/2)*2", "trunc(ih/2)*2")
+    if target_fps:
+        video = video.filter("fps", fps=target_fps)
+    return video
+
+
+def time_chain(build):
+    """Waktu CPU minimum (detik) dari beberapa run satu rantai filter ke muxer null."""
+    best = None
+    for _ in range(FILTER_BENCH_RUNS):
+        output = ffmpeg.output(build(), "-", f="null").global_args("-benchmark", "-threads", "1")
+        _, err = ffmpeg.run(output, capture_stdout=True, capture_stderr=True)
+        utime = app.parse_ffmpeg_benchmark(err.decode("utf-8", errors="ignore")).get("utime_s", 0.0)
+        best = utime if best is None else min(best, utime)
+    return best
+
+
+def run_filter_bench(source, size, out_dir):
+    """Bandingkan biaya filter per frame; sumber didecode dulu ke rawvideo agar biaya decode tidak menutupi selisih."""
+    width, height = [int(v) for v in size.split("x")]
+    raw_path = os.path.join(out_dir, "frames.nut")
+    ffmpeg.run(
+        ffmpeg.output(ffmpeg.input(source).video, raw_path, vframes=FILTER_BENCH_FRAMES, vcodec="rawvideo",
+                      pix_fmt="yuv420p"),
+        overwrite_output=True, capture_stdout=True, capture_stderr=True,
+    )
+    read_ms = time_chain(lambda: ffmpeg.input(raw_path).video) * 1000 / FILTER_BENCH_FRAMES
+    print("Baca frame mentah: " + f"{read_ms:.2f}" + " ms/frame (" + str(FILTER_BENCH_FRAMES) + " frame)")
+    print("")
+    print("| Preset | Output | Lama | Baru | Hemat filter |")
+    print("|--------|--------|------|------|--------------|")
+    for name, preset in app.PLATFORM_PRESETS.items():
+        old_s = time_chain(lambda: legacy_filters(
+            ffmpeg.input(raw_path).video, preset["resolution"], preset.get("aspect"), preset.get("fps"),
+        ))
+        new_s = time_chain(lambda: app.apply_video_filters(
+            ffmpeg.input(raw_path).video, preset["resolution"], preset.get("aspect"), preset.get("fps"),
+            source_size=(width, height, 1.0), scaler=app.SCALER_FLAGS.get(preset["preset"], "bicubic"),
+        ))
+        plan = app.plan_geometry(width, height, preset["resolution"], preset.get("aspect"))
+        old_ms = max(old_s * 1000 / FILTER_BENCH_FRAMES - read_ms, 0.0)
+        new_ms = max(new_s * 1000 / FILTER_BENCH_FRAMES - read_ms, 0.0)
+        saving = (1 - new_ms / old_ms) * 100 if old_ms > 0 else 0
+        print(
+            "| " + name
+            + " | " + str(plan["width"]) + "x" + str(plan["height"])
+            + " | " + f"{old_ms:.2f}" + " ms"
+            + " | " + f"{new_ms:.2f}" + " ms"
+            + " | " + f"{saving:.0f}" + "% |"
+        )
+
+
+def print_table(results, baseline_size):
+    print("| Format | Waktu | Kecepatan | Ukuran | vs H.264 |")
+    print("|--------|-------|-----------|--------|----------|")
+    for r in results:
+        if "error" in r:
+            print("| " + r["label"] + " | gagal: " + " ".join(r["error"]) + " | | | |")
+            continue
+        ratio = (r["size"] / baseline_size * 100) if baseline_size else 0
+        print(
+            "| " + r["label"]
+            + " | " + f"{r['seconds']:.1f}" + " s"
+            + " | " + f"{r['speed']:.2f}" + "x"
+            + " | " + app.format_filesize(r["size"])
+            + " | " + f"{ratio:.0f}" + "% |"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark format output Kompres")
+    parser.add_argument("--source", help="File video uji (default: klip sintetis)")
+    parser.add_argument("--duration", type=int, default=10, help="Durasi klip sintetis (detik)")
+    parser.add_argument("--size", default="1280x720", help="Resolusi klip sintetis")
+    parser.add_argument("--crf", type=int, default=28)
+    parser.add_argument("--preset", default="medium", choices=app.SPEED_OPTIONS)
+    parser.add_argument("--resolution", default="720p", choices=list(app.RESOLUTION_MAP.keys()) + ["original"])
+    parser.add_argument("--formats", help="Daftar format dipisah koma, mis. mp4,hevc (default: semua)")
+    parser.add_argument("--two-pass", action="store_true", help="Tambahkan baris WebM two-pass")
+    parser.add_argument("--filters", action="store_true", help="Ukur rantai filter geometri per preset, tanpa encode")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="kompres_bench_") as out_dir:
+        source = args.source
+        duration = args.duration
+        if not source:
+            source = os.path.join(out_dir, "source.mp4")
+            make_source(source, args.duration, args.size)
+        else:
+            duration = (app.probe_video(source) or {}).get("duration", 0) or args.duration
+
+        if args.filters:
+            size = args.size
+            if args.source:
+                meta = app.probe_video(source) or {}
+                size = str(meta.get("width", 0)) + "x" + str(meta.get("height", 0))
+            print("Sumber: " + (args.source or "sintetis") + " " + size + ", " + str(duration) + " s")
+            run_filter_bench(source, size, out_dir)
+            return
+
+        print(
+            "Sumber: " + (args.source or "sintetis " + args.size) + ", " + str(duration) + " s"
+            + " | CRF " + str(args.crf) + ", preset " + args.preset + ", " + args.resolution
+        )
+        formats = app.get_output_formats()
+        results = []
+        for label, out_format in formats.items():
+            # GIF hanya diukur bila diminta lewat --formats (pembanding WebP/AVIF animasi)
+            if out_format == "gif" and not args.formats:
+                continue
+            if args.formats and out_format not in args.formats.split(","):
+                continue
+            results.append(run_case(
+                source, out_dir, label, out_format, args.crf, args.preset, args.resolution, duration,
+            ))
+            if out_format == "webm" and args.two_pass:
+                results.append(run_case(
+                    source, out_dir, label + " two-pass", out_format, args.crf, args.preset, args.resolution,
+                    duration, two_pass=True,
+                ))
+
+        baseline = next((r["size"] for r in results if r["label"] == "MP4 (H.264)" and "size" in r), 0)
+        print_table(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Load test Kompres dengan banyak sesi Streamlit bersamaan.
+
+Setiap sesi disimulasikan dengan AppTest dan menjalankan alur lengkap:
+upload video sintetis -> pilih preset -> Mulai Kompresi -> hasil. Laporan
+berisi latensi rerun p50/p95 per langkah, perkiraan waktu antre encode,
+throughput, dan pertumbuhan memori proses.
+
+Dengan --long-sessions, sejumlah sesi tambahan memakai satu token yang sama
+dan video panjang, meniru satu pengguna yang mengirim banyak job sekaligus.
+Waktu antre scheduler sesi pendek dilaporkan terpisah.
+
+Pemakaian:
+    python loadtest.py --sessions 8
+    python loadtest.py --sessions 16 --preset Email --duration 20
+    python loadtest.py --sessions 8 --long-sessions 4 --long-duration 120
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlit.testing.v1 import AppTest
+
+import app
+from benchmark import make_source
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+RUN_TIMEOUT = 1800
+
+
+class SyntheticUpload:
+    """Pengganti UploadedFile Streamlit untuk save_upload_to_temp."""
+
+    def __init__(self, path):
+        self.name = "loadtest_" + uuid.uuid4().hex[:8] + ".mp4"
+        self.size = os.path.getsize(path)
+        self._path = path
+
+    def getbuffer(self):
+        with open(self._path, "rb") as f:
+            return memoryview(f.read())
+
+
+def read_rss_kb():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def find_widget(widgets, label):
+    return next(w for w in widgets if w.label == label)
+
+
+def timed_run(at, timings, step):
+    start = time.perf_counter()
+    at.run(timeout=RUN_TIMEOUT)
+    timings[step] = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(step + ": " + at.exception[0].value)
+
+
+def run_session(source_path, preset_name, token=None):
+    """Jalankan satu sesi lengkap dan kembalikan durasi setiap langkah (detik)."""
+    timings = {}
+    token = token or uuid.uuid4().hex[:16]
+
+    start = time.perf_counter()
+    upload = SyntheticUpload(source_path)
+    input_path = app.save_upload_to_temp(upload, token)
+    timings["upload"] = time.perf_counter() - start
+
+    at = AppTest.from_file(APP_FILE, default_timeout=RUN_TIMEOUT)
+    at.query_params["sid"] = token
+    at.session_state["input_path"] = input_path
+    at.session_state["input_name"] = upload.name
+    at.session_state["input_size"] = upload.size
+    at.session_state["input_size_raw"] = upload.size
+    timed_run(at, timings, "load")
+
+    find_widget(at.selectbox, "Platform Target").select(preset_name)
+    timed_run(at, timings, "preset")
+
+    find_widget(at.button, "Mulai Kompresi").click()
+    timed_run(at, timings, "compress")
+
+    if not any("Kompresi Berhasil" in m.value for m in at.markdown):
+        errors = [e.value for e in at.error]
+        raise RuntimeError("compress: " + (errors[0] if errors else "hasil tidak ditemukan"))
+    timings["queue"] = at.session_state["last_queue_wait"] if "last_queue_wait" in at.session_state else 0.0
+    return timings
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def print_report(results, errors, wall, baseline_compress, rss_start, rss_peak, rss_end, long_results=None):
+    print("")
+    print("| Langkah | p50 | p95 | maks |")
+    print("|---------|-----|-----|------|")
+    for step in ["upload", "load", "preset", "compress"]:
+        values = [r[step] for r in results]
+        print(
+            "| " + step
+            + " | " + f"{percentile(values, 50):.2f}" + " s"
+            + " | " + f"{percentile(values, 95):.2f}" + " s"
+            + " | " + f"{max(values, default=0):.2f}" + " s |"
+        )
+
+    waits = [max(r["compress"] - baseline_compress, 0.0) for r in results]
+    queue_waits = [r["queue"] for r in results]
+    print("")
+    print("Baseline compress (1 sesi): " + f"{baseline_compress:.2f}" + " s")
+    print(
+        "Perkiraan antre encode: p50 " + f"{percentile(waits, 50):.2f}" + " s, p95 "
+        + f"{percentile(waits, 95):.2f}" + " s"
+    )
+    print(
+        "Antre scheduler: p50 " + f"{percentile(queue_waits, 50):.2f}" + " s, p95 "
+        + f"{percentile(queue_waits, 95):.2f}" + " s (" + str(app.ENCODE_SLOTS) + " slot)"
+    )
+    if long_results:
+        long_waits = [r["queue"] for r in long_results]
+        print(
+            "Antre scheduler sesi panjang (" + str(len(long_results)) + ", satu token): p50 "
+            + f"{percentile(long_waits, 50):.2f}" + " s, maks " + f"{max(long_waits):.2f}" + " s"
+        )
+    print("Sesi selesai: " + str(len(results)) + ", gagal: " + str(len(errors)))
+    print("Throughput: " + f"{len(results) / wall * 60:.2f}" + " job/menit (" + f"{wall:.1f}" + " s total)")
+    print(
+        "Memori RSS: awal " + app.format_filesize(rss_start * 1024)
+        + ", puncak " + app.format_filesize(rss_peak * 1024)
+        + ", akhir " + app.format_filesize(rss_end * 1024)
+        + " (+" + app.format_filesize(max(rss_end - rss_start, 0) * 1024) + ")"
+    )
+    for err in errors[:5]:
+        print("  gagal: " + err)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test sesi bersamaan Kompres")
+    parser.add_argument("--sessions", type=int, default=4, help="Jumlah sesi bersamaan")
+    parser.add_argument("--preset", default="WhatsApp", choices=list(app.PLATFORM_PRESETS.keys()))
+    parser.add_argument("--duration", type=int, default=10, help="Durasi video sintetis (detik)")
+    parser.add_argument("--size", default="1280x720", help="Resolusi video sintetis")
+    parser.add_argument("--long-sessions", type=int, default=0, help="Sesi video panjang dengan satu token bersama")
+    parser.add_argument("--long-duration", type=int, default=120, help="Durasi video panjang (detik)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="kompres_load_") as work_dir:
+        source_path = os.path.join(work_dir, "source.mp4")
+        make_source(source_path, args.duration, args.size)
+        long_path = os.path.join(work_dir, "long.mp4")
+        if args.long_sessions:
+            make_source(long_path, args.long_duration, args.size)
+
+        print("Baseline: 1 sesi, preset " + args.preset + "...")
+        baseline = run_session(source_path, args.preset)
+
+        rss_start = read_rss_kb()
+        rss_peak = [rss_start]
+        stop = threading.Event()
+
+        def sample_memory():
+            while not stop.wait(0.5):
+                rss_peak[0] = max(rss_peak[0], read_rss_kb())
+
+        sampler = threading.Thread(target=sample_memory, daemon=True)
+        sampler.start()
+
+        print("Load: " + str(args.sessions) + " sesi bersamaan...")
+        results, long_results, errors = [], [], []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions + args.long_sessions) as pool:
+            # Job panjang dikirim lebih dulu agar mengisi antrean sebelum sesi pendek datang
+            long_token = uuid.uuid4().hex[:16]
+            long_futures = [
+                pool.submit(run_session, long_path, args.preset, long_token) for _ in range(args.long_sessions)
+            ]
+            if long_futures:
+                time.sleep(1)
+            futures = [pool.submit(run_session, source_path, args.preset) for _ in range(args.sessions)]
+            for bucket, group in [(results, futures), (long_results, long_futures)]:
+                for future in group:
+                    try:
+                        bucket.append(future.result())
+                    except Exception as err:
+                        errors.append(str(err))
+        wall = time.perf_counter() - start
+
+        stop.set()
+        sampler.join()
+        print_report(
+            results, errors, wall, baseline["compress"], rss_start, rss_peak[0], read_rss_kb(), long_results,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Server upload bertahap Kompres.
+
+Menerima file besar per chunk (tanpa menampung file di memori), memverifikasi
+SHA-256 setiap chunk sebelum menyalinnya ke posisinya di disk, dan mendaftarkan file yang lengkap ke storage sesi sehingga app.py bisa
+memakainya seperti upload biasa. Upload yang terputus dilanjutkan dari chunk
+yang belum diterima.
+
+Endpoint:
+    POST /uploads                  -> body JSON {token, nonce, name, size}; mulai
+                                      atau lanjutkan upload, balas manifest
+    GET  /uploads/<id>             -> manifest (chunk yang sudah diterima)
+    PUT  /uploads/<id>/<index>     -> body berisi chunk, header X-Chunk-SHA256
+                                      wajib berisi checksum chunk
+    POST /uploads/<id>/complete    -> gabungkan ke sesi, balas session_id
+
+Bila KOMPRES_SECRET diset, setiap request upload harus membawa header
+X-Kompres-Signature berisi HMAC token dan nonce halaman yang dibuat app.py.
+Secara default server hanya mendengarkan di 127.0.0.1; bind ke alamat lain
+membutuhkan KOMPRES_SECRET.
+
+Pemakaian:
+    python upload_server.py --port 8602
+    KOMPRES_UPLOAD_URL=http://localhost:8602 streamlit run app.py
+"""
+
+import argparse
+import json
+import re
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import app
+
+CHUNK_PATH = re.compile(r"^/uploads/([0-9a-f]{24})/(\d+)$")
+UPLOAD_PATH = re.compile(r"^/uploads/([0-9a-f]{24})(/complete)?$")
+MAX_JSON_BODY = 64 * 1024
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    """Handler HTTP upload bertahap."""
+
+    server_version = "KompresUpload/" + app.APP_VERSION
+
+    def send_cors(self):
+        self.send_header("Access-Control-Allow-Origin", self.server.allow_origin)
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, PUT, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, X-Chunk-SHA256, " + app.UPLOAD_SIGNATURE_HEADER)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_cors()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_text(self, status, message):
+        body = message.encode("utf-8")
+        self.send_response(status)
+        self.send_cors()
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def content_length(self):
+        try:
+            return int(self.headers.get("Content-Length", "0"))
+        except ValueError:
+            return -1
+
+    def discard_body(self):
+        """Buang body chunk yang ditolak; body yang terlalu besar membuat koneksi ditutup."""
+        length = self.content_length()
+        if 0 <= length <= app.UPLOAD_CHUNK_SIZE:
+            self.rfile.read(length)
+        else:
+            self.close_connection = True
+
+    def authorized(self, token, nonce):
+        return app.check_upload_signature(token, nonce, self.headers.get(app.UPLOAD_SIGNATURE_HEADER))
+
+    def read_authorized_manifest(self, upload_id):
+        """Manifest upload ini, atau None setelah membalas 404/403."""
+        manifest = app.read_upload_manifest(upload_id)
+        if manifest is None:
+            self.send_error_text(404, "Upload tidak ditemukan")
+            return None
+        if not self.authorized(manifest["token"], manifest.get("nonce", "")):
+            self.send_error_text(403, "Tanda tangan upload tidak valid")
+            return None
+        return manifest
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_cors()
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+            return
+        match = UPLOAD_PATH.match(self.path)
+        if not match or match.group(2):
+            self.send_error_text(404, "Upload tidak ditemukan")
+            return
+        manifest = self.read_authorized_manifest(match.group(1))
+        if manifest is not None:
+            self.send_json(200, manifest)
+
+    def do_POST(self):
+        if self.path == "/uploads":
+            length = self.content_length()
+            if length < 0 or length > MAX_JSON_BODY:
+                self.send_error_text(400, "Body tidak valid")
+                return
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+                token, nonce = str(request["token"]), str(request.get("nonce", ""))
+                name, size = str(request["name"]), int(request["size"])
+            except (ValueError, KeyError, TypeError, AttributeError):
+                self.send_error_text(400, "Body harus berisi token, name, dan size")
+                return
+            if not self.authorized(token, nonce):
+                self.send_error_text(403, "Tanda tangan upload tidak valid")
+                return
+            manifest, error = app.create_upload(token, name, size, nonce)
+            if manifest is None:
+                self.send_error_text(400, error)
+                return
+            self.send_json(200, manifest)
+            return
+
+        match = UPLOAD_PATH.match(self.path)
+        if not match or not match.group(2):
+            self.send_error_text(404, "Endpoint tidak ditemukan")
+            return
+        if self.read_authorized_manifest(match.group(1)) is None:
+            return
+        try:
+            meta, error = app.finalize_upload(match.group(1))
+        except OSError as err:
+            self.send_error_text(503, "Gagal menyimpan upload ke storage sesi: " + str(err))
+            return
+        if meta is None:
+            self.send_error_text(409, error)
+            return
+        self.send_json(200, {"session_id": meta["session_id"], "file_size": meta["file_size"]})
+
+    def do_PUT(self):
+        match = CHUNK_PATH.match(self.path)
+        if not match:
+            self.send_error_text(404, "Endpoint tidak ditemukan")
+            return
+        manifest = app.read_upload_manifest(match.group(1))
+        if manifest is None:
+            # Body chunk tidak dibaca; tutup koneksi agar tidak tercampur request berikutnya
+            self.close_connection = True
+            self.send_error_text(404, "Upload tidak ditemukan")
+            return
+        if not self.authorized(manifest["token"], manifest.get("nonce", "")):
+            # Body chunk dibuang agar browser menerima 403, bukan koneksi putus yang terus dicoba ulang
+            self.discard_body()
+            self.send_error_text(403, "Tanda tangan upload tidak valid")
+            return
+        if not self.headers.get("X-Chunk-SHA256"):
+            self.discard_body()
+            self.send_error_text(400, "Header X-Chunk-SHA256 wajib berisi SHA-256 chunk")
+            return
+        success, error = app.write_upload_chunk(
+            match.group(1), int(match.group(2)), self.rfile, self.content_length(),
+            self.headers.get("X-Chunk-SHA256"),
+        )
+        if not success:
+            # Sisa body chunk yang ditolak tidak dibaca; tutup koneksi agar tidak tercampur request berikutnya
+            self.close_connection = True
+            self.send_error_text(400, error)
+            return
+        self.send_json(200, {"index": int(match.group(2))})
+
+    def log_message(self, format, *args):
+        sys.stderr.write("[upload " + str(self.server.server_port) + "] " + (format % args) + "\n")
+
+
+def serve(host, port, allow_origin):
+    server = ThreadingHTTPServer((host, port), UploadHandler)
+    server.daemon_threads = True
+    server.allow_origin = allow_origin
+    print("Server upload Kompres siap di http://" + host + ":" + str(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server upload bertahap Kompres")
+    parser.add_argument("--host", default="127.0.0.1", help="Alamat non-loopback membutuhkan KOMPRES_SECRET")
+    parser.add_argument("--port", type=int, default=8602)
+    parser.add_argument(
+        "--allow-origin", default="http://localhost:8501",
+        help="Nilai header Access-Control-Allow-Origin (alamat app Streamlit)",
+    )
+    args = parser.parse_args()
+    if args.host not in app.LOOPBACK_HOSTS and not app.SHARED_SECRET:
+        parser.error("--host " + args.host + " membutuhkan KOMPRES_SECRET")
+    serve(args.host, args.port, args.allow_origin)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Worker encode terdistribusi Kompres.
+
+Menjalankan server HTTP kecil yang menerima segmen video dari coordinator
+(app.py dengan KOMPRES_WORKERS), mengencodenya dengan compress_video, lalu
+mengirim hasilnya kembali di body respons.
+
+Endpoint:
+    GET  /health  -> status worker, dipakai heartbeat coordinator
+    POST /encode  -> body berisi segmen video, header X-Kompres-Job berisi
+                     parameter encode (JSON), header X-Kompres-Secret berisi
+                     KOMPRES_SECRET
+
+Secara default worker hanya mendengarkan di 127.0.0.1. Untuk node lain,
+set KOMPRES_SECRET yang sama di worker dan app; worker menolak bind ke
+alamat non-loopback tanpa secret.
+
+Pemakaian:
+    KOMPRES_SECRET=rahasia python worker.py --host 0.0.0.0 --port 8601
+    KOMPRES_SECRET=rahasia KOMPRES_WORKERS=http://10.0.0.2:8601,http://10.0.0.3:8601 streamlit run app.py
+
+Uji lokal dengan beberapa proses worker sebagai pengganti node:
+    python worker.py --spawn 3 --port 8601
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import app
+
+COPY_CHUNK = 1024 * 1024
+
+
+class EncodeHandler(BaseHTTPRequestHandler):
+    """Handler HTTP worker: health check dan encode satu segmen per request."""
+
+    server_version = "KompresWorker/" + app.APP_VERSION
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": "not found"})
+            return
+        self.send_json(200, {
+            "status": "ok",
+            "active": self.server.active_jobs,
+            "slots": self.server.max_jobs,
+            "cpus": os.cpu_count(),
+        })
+
+    def do_POST(self):
+        if self.path != "/encode":
+            self.send_json(404, {"error": "not found"})
+            return
+        if not app.check_secret(self.headers.get(app.WORKER_SECRET_HEADER)):
+            self.send_json(403, {"error": "secret tidak valid"})
+            return
+        try:
+            job = json.loads(self.headers.get("X-Kompres-Job", "{}"))
+            length = int(self.headers.get("Content-Length", "0"))
+        except ValueError:
+            self.send_json(400, {"error": "header job tidak valid"})
+            return
+        if not isinstance(job, dict):
+            self.send_json(400, {"error": "header job tidak valid"})
+            return
+        job = {k: v for k, v in job.items() if k in app.WORKER_JOB_KEYS}
+        error = app.validate_worker_job(job)
+        if error:
+            self.send_json(400, {"error": error})
+            return
+
+        work_dir = tempfile.mkdtemp(prefix="kompres_worker_")
+        try:
+            input_path = os.path.join(work_dir, "segment.mkv")
+            with open(input_path, "wb") as f:
+                remaining = length
+                while remaining > 0:
+                    chunk = self.rfile.read(min(COPY_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    remaining -= len(chunk)
+
+            output_path = os.path.join(
+                work_dir, "encoded." + app.get_output_extension(job.get("out_format", "mp4"))
+            )
+            with self.server.slots:
+                self.server.active_jobs += 1
+                try:
+                    success, error = app.compress_video(input_path, output_path, mute_audio=True, **job)
+                finally:
+                    self.server.active_jobs -= 1
+
+            if not success:
+                body = (error or "Proses encoding gagal").encode("utf-8")
+                self.send_response(500)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(os.path.getsize(output_path)))
+            self.end_headers()
+            with open(output_path, "rb") as f:
+                shutil.copyfileobj(f, self.wfile, COPY_CHUNK)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def log_message(self, format, *args):
+        sys.stderr.write("[worker " + str(self.server.server_port) + "] " + (format % args) + "\n")
+
+
+def serve(host, port, max_jobs):
+    server = ThreadingHTTPServer((host, port), EncodeHandler)
+    server.daemon_threads = True
+    server.max_jobs = max_jobs
+    server.slots = threading.BoundedSemaphore(max_jobs)
+    server.active_jobs = 0
+    print("Worker Kompres siap di http://" + host + ":" + str(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def spawn_local(count, host, port, max_jobs):
+    """Jalankan beberapa proses worker lokal sebagai pengganti node untuk pengujian."""
+    processes = []
+    urls = []
+    for i in range(count):
+        processes.append(subprocess.Popen([
+            sys.executable, os.path.abspath(__file__),
+            "--host", host, "--port", str(port + i), "--jobs", str(max_jobs),
+        ]))
+        urls.append("http://" + host + ":" + str(port + i))
+    print("KOMPRES_WORKERS=" + ",".join(urls))
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker encode terdistribusi Kompres")
+    parser.add_argument("--host", default="127.0.0.1", help="Alamat non-loopback membutuhkan KOMPRES_SECRET")
+    parser.add_argument("--port", type=int, default=8601)
+    parser.add_argument("--jobs", type=int, default=1, help="Jumlah encode bersamaan per worker")
+    parser.add_argument("--spawn", type=int, default=0, help="Jalankan N proses worker lokal mulai dari --port")
+    args = parser.parse_args()
+    if args.host not in app.LOOPBACK_HOSTS and not app.SHARED_SECRET:
+        parser.error("--host " + args.host + " membutuhkan KOMPRES_SECRET")
+
+    if args.spawn:
+        spawn_local(args.spawn, "127.0.0.1" if args.host == "0.0.0.0" else args.host, args.port, args.jobs)
+    else:
+        serve(args.host, args.port, args.jobs)
+
+
+if __name__ == "__main__":
+    main()